@@ -242,6 +242,10 @@ class Config(object):
                 'button-height': 20,
                 'interline-height': 6
                 },
+            # Number of annotations above which the timeline draws
+            # them directly instead of creating one widget per
+            # annotation. -1 disables direct rendering.
+            'timeline-canvas-threshold': 2000,
             # File history
             'history': [],
             'history-size-limit': 5,
@@ -260,6 +264,14 @@ class Config(object):
             'record-actions': False,
             # Imagecache save on exit: 'never', 'ask' or 'always'
             'imagecache-save-on-exit': 'ask',
+            # Size (in MB) of the in-memory part of the imagecache.
+            # Older snapshots are moved to disk.
+            'imagecache-memory-size': 64,
+            # Number of worker threads for the scheduled threaded
+            # actions (sound, external processes...)
+            'action-workers': 4,
+            # Maximum number of pending scheduled actions
+            'action-queue-size': 1024,
             'quicksearch-ignore-case': True,
             # quicksearch sources. If [], it is all package's annotations.
             # Else it is a list of TALES expression applied to the current package
@@ -319,7 +331,10 @@ class Config(object):
             'frameselector-width': 140,
             'frameselector-count': 8,
             # Cache settings for import filters
-            'filter-options': {}
+            'filter-options': {},
+            # Defer plugin imports, using a manifest of their
+            # registrations (see advene.core.plugin)
+            'plugin-manifest': True,
             }
 
         # Player options
@@ -339,6 +354,11 @@ class Config(object):
             'snapshot': True,
             'caption': True,
             'snapshot-width': 160,
+            # Maximum gap (in ms) between snapshot timestamps captured
+            # by linear decoding instead of seeking (0 to disable)
+            'snapshot-batch-gap': 5000,
+            # Number of parallel snapshotter pipelines
+            'snapshot-pipelines': 1,
             'dvd-device': '/dev/dvd',
             'fullscreen-timestamp': False,
             # Name of audio device for gstrecorder
@@ -355,6 +375,18 @@ class Config(object):
             'displaymode': 'raw',
             # engine: simple (for SimpleHTTPServer) or cherrypy (for CherryPy)
             'engine': 'simple',
+            # Maximum number of rendered package views kept in cache
+            # (0 to disable the cache)
+            'response-cache-size': 256,
+            # Number of request threads (per process)
+            'threads': 10,
+            # Number of worker processes of the headless server (see
+            # advene.core.wsgi)
+            'workers': 1,
+            # Default and maximum number of elements returned by a
+            # JSON API request
+            'api-page-size': 500,
+            'api-max-page-size': 10000,
             }
 
         # Global context options
@@ -32,12 +32,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 import cgi
-from gi.repository import GObject
+try:
+    from gi.repository import GObject, GLib
+except ImportError:
+    # Headless mode (see advene.core.wsgi): there is no main loop.
+    GObject = GLib = None
 import itertools
 import json
-import operator
 import os
-from pathlib import Path
 import re
 import socket
 import shlex
@@ -82,6 +84,7 @@ import advene.model.tal.context
 import advene.util.helper as helper
 import advene.util.importer
 from advene.util.exporter import get_exporters, register_exporter
+from advene.util.rwlock import RWLock
 import xml.etree.ElementTree as ET
 from advene.util.audio import SoundPlayer
 
@@ -96,7 +99,8 @@ if config.data.webserver['mode']:
         AdveneWebServer = None
 
 import threading
-GObject.threads_init()
+if GObject is not None:
+    GObject.threads_init()
 
 old_excepthook = sys.excepthook
 def _advene_excepthook(type, value, tracebk, thread=None):
@@ -111,6 +115,42 @@ def _advene_excepthook(type, value, tracebk, thread=None):
     old_excepthook(type, value, tracebk)
 sys.excepthook = _advene_excepthook
 
+if GLib is not None:
+    class ModelLockSource(GLib.Source):
+        """Main loop source holding the model lock for writing.
+
+        The lock is held by the main thread, except while its main loop
+        waits for events: prepare is called before polling, check after.
+        """
+        def __init__(self, lock):
+            GLib.Source.__init__(self)
+            self.lock = lock
+            self.lock.acquire_write()
+            self.held = True
+
+        def prepare(self):
+            if self.held:
+                self.held = False
+                self.lock.release_write()
+            return (False, -1)
+
+        def check(self):
+            if not self.held:
+                self.lock.acquire_write()
+                self.held = True
+            return False
+
+        def dispatch(self, callback, args):
+            return True
+
+        def release(self):
+            """Release the lock and detach the source.
+            """
+            if self.held:
+                self.held = False
+                self.lock.release_write()
+            self.destroy()
+
 class MessageHandler(logging.Handler):
     def __init__(self, level=logging.NOTSET, controller=None):
         super(MessageHandler, self).__init__(level)
@@ -207,7 +247,12 @@ class AdveneController(object):
 
     @ivar gui: the embedding GUI (may be None)
     @type gui: AdveneGUI
+
+    @ivar model_lock: reader/writer lock protecting the packages
+    @type model_lock: advene.util.rwlock.RWLock
     """
+    # Player plugin (None for the configured one)
+    player_plugin = None
 
     def __init__ (self, args=None):
         """Initializes player and other attributes.
@@ -216,6 +261,10 @@ class AdveneController(object):
         self.gui=None
         # Webserver (optional)
         self.server=None
+        # The main thread modifies the packages, while webserver
+        # threads read them.
+        self.model_lock = RWLock()
+        self.model_lock_source = None
 
         # Dictionaries indexed by alias
         self.packages = {}
@@ -266,7 +315,7 @@ class AdveneController(object):
         self._soundplayer=None
 
         self.playerfactory=PlayerFactory()
-        self.player = self.playerfactory.get_player()
+        self.player = self.playerfactory.get_player(self.player_plugin)
         self.player.get_default_media = self.get_default_media
         self.player_restarted = 0
         self.slave_players = set()
@@ -282,6 +331,11 @@ class AdveneController(object):
         # Scrubbing timeout guard
         self.scrub_lastvalue = None
 
+        # Loaded plugin collections, and the manifest used to defer
+        # plugin imports (see advene.core.plugin)
+        self.plugins = []
+        self.plugin_manifest = None
+
         # Misc. modules: some features are implemented as plugins but
         # do not fit in the available categories (content-handler,
         # view, tracer...). Here is a placeholder for keeping their
@@ -346,14 +400,18 @@ class AdveneController(object):
 
         GObject.timeout_add (100, update_wrapper)
         self.notify ("ApplicationStart")
+        self.hold_model_lock()
         self.mainloop.run ()
+        self.release_model_lock()
         self.notify ("ApplicationEnd")
 
     def load_plugins(self, directory, prefix="advene_plugins"):
         """Load the plugins from the given directory.
         """
         logger.debug("Loading plugins from %s", directory)
-        l=advene.core.plugin.PluginCollection(directory, prefix)
+        if self.plugin_manifest is None and config.data.preferences.get('plugin-manifest', True):
+            self.plugin_manifest = advene.core.plugin.PluginManifest(config.data.advenefile('plugin-manifest.json', 'settings'))
+        l=advene.core.plugin.PluginCollection(directory, prefix, manifest=self.plugin_manifest)
         for p in l:
             try:
                 # Do not log plugin info if it could not be
@@ -362,15 +420,49 @@ class AdveneController(object):
                 # done as "is False", since old versions of
                 # register did not have a return clause (and thus
                 # return None)
-                if p.register(controller=self) is False:
+                if l.register(p, self) is False:
                     logger.error("Could not register " + p.name)
                 else:
                     logger.info("Registering " + p.name)
             except AttributeError:
                 logger.error("AttributeError in %s/%s", directory, p.name, exc_info=True)
                 pass
+        if self.plugin_manifest is not None:
+            self.plugin_manifest.save()
+        for name, mode, import_time, register_time in l.report():
+            logger.debug("Plugin %s: %s (import %.1f ms, register %.1f ms)",
+                         name, mode, import_time, register_time)
+        self.plugins.append(l)
         return l
 
+    def plugin_report(self):
+        """Return the startup report of the loaded plugins.
+
+        @return: a list of (name, mode, import time, register time)
+          tuples (see L{advene.core.plugin.PluginCollection.report})
+        """
+        return [ r for l in self.plugins for r in l.report() ]
+
+    def hold_model_lock(self):
+        """Hold the model lock for writing in the main thread.
+
+        This must be called from the main thread, just before running
+        the main loop. The lock is then released while the main loop
+        is idle, so that webserver threads can read the packages.
+        """
+        if self.model_lock_source is None:
+            self.model_lock_source = ModelLockSource(self.model_lock)
+            self.model_lock_source.attach(None)
+        return True
+
+    def release_model_lock(self):
+        """Release the model lock held by the main thread.
+        """
+        if self.model_lock_source is not None:
+            self.model_lock_source.release()
+            self.model_lock_source = None
+        return True
+
     def queue_action(self, method, *args, **kw):
         """Queue an action.
 
@@ -645,9 +737,9 @@ class AdveneController(object):
                 return s.lower()
 
         if case_sensitive:
-            data_func=lambda e: e.content.data
+            content_func=lambda e: e.content.data
         else:
-            data_func=lambda e: normalize_case(e.content.data)
+            content_func=lambda e: normalize_case(e.content.data)
 
         if sources is None:
             sources=[ "all_annotations" ]
@@ -668,6 +760,16 @@ class AdveneController(object):
 
         result=[]
 
+        # Elements from the package are looked up in its text index,
+        # other ones (e.g. from the global package) are scanned.
+        index=p.textIndex
+
+        def scan_match(el):
+            data=data_func(el)
+            return (all(normalize_case(w) in data for w in mandatory)
+                    and not any(normalize_case(w) in data for w in exceptions)
+                    and (not normal or any(normalize_case(w) in data for w in normal)))
+
         for source in sources:
             if source == 'tags':
                 sourcedata=itertools.chain( p.annotations, p.relations )
@@ -675,6 +777,7 @@ class AdveneController(object):
                     data_func=lambda e: e.tags
                 else:
                     data_func=lambda e: [ normalize_case(t) for t in e.tags ]
+                search_func=lambda w: index.tagged(w, case_sensitive)
             elif source == 'ids':
                 # Special search.
                 for i in searched.split():
@@ -683,6 +786,8 @@ class AdveneController(object):
                         result.append(e)
                 continue
             else:
+                data_func=content_func
+                search_func=lambda w: index.search(w, case_sensitive)
                 if source == 'all_annotations':
                     source = 'here/annotations'
                     sourcedata = p.annotations
@@ -692,23 +797,23 @@ class AdveneController(object):
                     c=self.build_context()
                     sourcedata=c.evaluateValue(source)
 
+            # Matching indexed elements. None means all of them.
+            accepted=None
             for w in mandatory:
-                w=normalize_case(w)
-                sourcedata=[ el for el in sourcedata if w in data_func(el) ]
-            for w in exceptions:
-                w=normalize_case(w)
-                sourcedata=[ el for el in sourcedata if w not in data_func(el) ]
-            if not normal:
-                # No "normal" search terms. Return the result.
-                result.extend(sourcedata)
-            else:
-                normal=[ normalize_case(el) for el in normal ]
-                for e in sourcedata:
-                    data=data_func(e)
-                    for w in normal:
-                        if w in data:
-                            result.append(e)
-                            break
+                found=search_func(w)
+                accepted=found if accepted is None else accepted & found
+            if normal:
+                found=set().union(*( search_func(w) for w in normal ))
+                accepted=found if accepted is None else accepted & found
+            excluded=set().union(*( search_func(w) for w in exceptions ))
+
+            for el in sourcedata:
+                if el in index:
+                    if ((accepted is None or el in accepted)
+                        and el not in excluded):
+                        result.append(el)
+                elif scan_match(el):
+                    result.append(el)
         return result
 
     def evaluate_query(self, query=None, context=None, expr=None):
@@ -842,6 +947,11 @@ class AdveneController(object):
                                                 prefix="advene_user_plugins")
         except OSError:
             logger.error("Error while loading user plugins", exc_info=True)
+        report = self.plugin_report()
+        logger.info("Plugins: %d imported, %d deferred, loaded in %.0f ms",
+                    len([ r for r in report if r[1] == 'imported' ]),
+                    len([ r for r in report if r[1] == 'deferred' ]),
+                    sum(r[2] + r[3] for r in report))
 
         # Read the default rules
         self.event_handler.read_ruleset_from_file(config.data.advenefile('default_rules.xml'),
@@ -995,12 +1105,35 @@ class AdveneController(object):
             el=kw[el_name]
             p=el.ownerPackage
             p._modified = True
+            p.generation += 1
             if event_name.endswith('Delete'):
                 # We removed an element, so remove its id from the _idgenerator set
                 p._idgenerator.remove(el.id)
+                p.idIndex.remove(el)
             elif event_name.endswith('Create'):
                 # We created an element. Make sure its id is registered in the _idgenerator
                 p._idgenerator.add(el.id)
+                # The index observes the package bundles, this only
+                # catches elements created by other means.
+                p.idIndex.add(el)
+            if isinstance(el, Annotation):
+                # Keep the temporal index up-to-date. Bundle
+                # modifications are already taken into account by
+                # the index, but fragment and type modifications
+                # are only known through AnnotationEditEnd.
+                if event_name == 'AnnotationDelete':
+                    p.temporalIndex.remove(el)
+                else:
+                    p.temporalIndex.update(el)
+            if isinstance(el, (Annotation, Relation)):
+                # Same for the content and tags in the text index
+                if event_name.endswith('Delete'):
+                    p.textIndex.remove(el)
+                else:
+                    p.textIndex.update(el)
+            elif isinstance(el, View):
+                # Forget the compiled template of the former version
+                advene.model.tal.context.template_cache.invalidate(el.getUri(absolute=True))
 
         if 'immediate' in kw:
             self.event_handler.notify(event_name, *param, **kw)
@@ -1287,29 +1420,8 @@ class AdveneController(object):
     def locate_mediafile(self, mediafile):
         """Locate the given media file.
         """
-        if helper.media_is_valid(mediafile):
-            return mediafile
-
-        mediafile = Path(helper.uri2path(mediafile))
-        if not mediafile.exists():
-            name = mediafile.name
-            for d in str(config.data.path['moviepath']).split(os.pathsep):
-                if d == '_':
-                    # Get package dirname
-                    d = Path(helper.uri2path(str(self.package.uri)))
-                    d = d.parent
-                elif '~' in d:
-                    # Expand userdir
-                    d = Path(d).expanduser()
-                d = Path(d)
-
-                n = d / name
-                if n.is_file():
-                    mediafile = n
-                    logger.info(_("Found matching video file in moviepath: %s") % n)
-                    break
-
-        return str(mediafile.absolute())
+        return helper.locate_mediafile(mediafile,
+                                       str(self.package.uri) if self.package is not None else None)
 
     def get_defined_tags(self, p=None):
         """Return the set of existing tags.
@@ -2351,7 +2463,7 @@ class AdveneController(object):
                 for l in diff.compare(start, end):
                     logger.debug(l)
                 logger.debug("-----------")
-            self.event_handler.reset_queue()
+            self.event_handler.shutdown()
             self.event_handler.clear_state()
             self.event_handler.update_rulesets()
 
@@ -2361,7 +2473,9 @@ class AdveneController(object):
             # Cleanup the ZipPackage directories
             ZipPackage.cleanup()
 
-            # Terminate the web server
+            # Terminate the web server. Its threads may be waiting for
+            # the model lock.
+            self.release_model_lock()
             try:
                 self.server.stop()
             except Exception:
@@ -2515,21 +2629,10 @@ class AdveneController(object):
         # AnnotatioBegin gets correctly notified.
         position -= 20
 
-        future_begins = []
-        future_ends = []
-        active = []
-
-        for a in self.package.annotations:
-            begin = a.fragment.begin
-            end = a.fragment.end
-            if begin >= position:
-                future_begins.append( (a, begin, end) )
-                future_ends.append( (a, begin, end) )
-            elif end >= position:
-                future_ends.append( (a, begin, end) )
-                active.append(a)
-        future_begins.sort(key=operator.itemgetter(1))
-        future_ends.sort(key=operator.itemgetter(2))
+        index = self.package.temporalIndex
+        future_begins = index.begins_from(position)
+        future_ends = index.ends_from(position)
+        active = index.active_at(position)
 
         #logger.debug("Position: %s" % helper.format_time(position))
         #logger.debug("Begins: %s\nEnds: %s" % ([ a[0].id for a in future_begins[:4] ],
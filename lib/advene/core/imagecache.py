@@ -18,17 +18,24 @@
 #
 """
 Imagecache module for advene
+
+Snapshots are kept in two tiers: a size-bounded in-memory LRU of PNG
+data, and a SQLite database (one per saved imagecache) on disk. Recent
+snapshots that do not fit in memory and are not saved yet are moved to
+a temporary database.
 """
 import logging
 logger = logging.getLogger(__name__)
 
 import advene.core.config as config
-import operator
 
-from collections import defaultdict
+import bisect
+from collections import OrderedDict
 import math
 import os
 import re
+import sqlite3
+import threading
 
 class CachedString:
     """String cached in a file.
@@ -72,6 +79,57 @@ class TypedString(bytes):
     def __bytes__(self):
         return self
 
+class SnapshotStore(object):
+    """SQLite-based storage of PNG snapshots, indexed by position.
+
+    If filename is None, a temporary database is used. It is deleted
+    when the store is closed.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        # Snapshots may be stored from player threads.
+        self._db = sqlite3.connect(str(filename) if filename is not None else '',
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS snapshot (position INTEGER PRIMARY KEY, data BLOB)")
+
+    def keys(self):
+        """Return the sorted list of stored positions.
+        """
+        with self._lock:
+            return [ k for (k, ) in self._db.execute("SELECT position FROM snapshot ORDER BY position") ]
+
+    def get(self, key):
+        """Return the PNG data for the given position, or None.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT data FROM snapshot WHERE position = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def update(self, items):
+        """Store the (position, data) items in a single transaction.
+        """
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO snapshot (position, data) VALUES (?, ?)",
+                                 ( (k, sqlite3.Binary(v)) for (k, v) in items ))
+
+    def __setitem__(self, key, value):
+        self.update( ((key, value), ) )
+
+    def stats(self):
+        """Return the (count, size) of the stored snapshots.
+        """
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), SUM(LENGTH(data)) FROM snapshot").fetchone()
+        return count, size or 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
 class ImageCache(object):
     """ImageCache class.
 
@@ -97,6 +155,9 @@ class ImageCache(object):
     not_yet_available_image.timestamp = -1
     not_yet_available_image.is_default = True
 
+    # Name of the snapshot database in the imagecache directory
+    store_filename = 'snapshots.sqlite'
+
     def __init__ (self, uri=None, name=None, precision=20, framerate=None):
         """Initialize the Imagecache
 
@@ -107,13 +168,33 @@ class ImageCache(object):
         @param precision: value of the precision
         @type precision: integer
         """
-        # It is a dictionary whose keys are the positions
-        # (in ms) and values the snapshot in PNG format. We store only
-        # value = self.not_yet_available_image if the image has
-        # not yet been updated.
         self.uri = uri
 
-        self._dict = defaultdict(lambda: self.not_yet_available_image)
+        # Sorted list of the positions (in ms) of the snapshots
+        self._keys = []
+        # In-memory LRU: position -> TypedString
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self.memory_limit = config.data.preferences.get('imagecache-memory-size', 64) * 1024 * 1024
+        # Positions of in-memory snapshots that are not stored anywhere
+        self._dirty = set()
+        # Temporary store for unsaved snapshots evicted from memory
+        self._spill = None
+        self._spilled = set()
+        # Store of the saved imagecache (opened on demand)
+        self._store = None
+        self._stored = set()
+        # Snapshots saved as individual files by older versions
+        self._files = {}
+
+        self._hits = 0
+        self._misses = 0
+
+        # Snapshots are read from the webserver threads, and even
+        # reads update the tiers.
+        self._lock = threading.RLock()
+        # Incremented on each modification of the snapshots
+        self.generation = 0
 
         self._modified=False
 
@@ -148,6 +229,15 @@ class ImageCache(object):
         else:
             return int(1000 * self.framerate * max(0, math.ceil(t_in_ms / 1000 / self.framerate) - 0.5))
 
+    def _has_key(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def _add_key(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+
     def approximate (self, key, precision=None):
         """Return an approximate key value for key.
 
@@ -157,24 +247,147 @@ class ImageCache(object):
         if key is None:
             return None
         key = self.round_timestamp(key)
-        if key in self._dict or precision == 0:
+        if precision == 0 or self._has_key(key):
             return key
 
         if precision is None:
             precision = self.precision
-        best = min( ((pos, abs(pos - key))
-                     for pos in self._dict.keys()
-                     if abs(pos - key) <= precision),
-                    key=operator.itemgetter(1),
-                    default=(key, 0) )
+        # The closest keys are the neighbours of the insertion point
+        i = bisect.bisect_left(self._keys, key)
+        best = (key, precision + 1)
+        for pos in self._keys[max(0, i - 1):i + 1]:
+            if abs(pos - key) < best[1]:
+                best = (pos, abs(pos - key))
+        if best[1] > precision:
+            return key
         #logger.debug("approximate %d (%d) -> %d", key, precision or 0, best[0])
         return best[0]
 
+    #
+    # Storage tiers
+    #
+
+    def _store_directory(self, name):
+        return config.data.path['imagecache'] / name
+
+    def _get_store(self, create=False):
+        """Return the store of the named imagecache.
+
+        If create is True, create the directory and the database if needed.
+        """
+        if self._store is None and self.name is not None:
+            d = self._store_directory(self.name)
+            filename = d / self.store_filename
+            if create and not d.is_dir():
+                d.mkdir(parents=True)
+            if create or filename.exists():
+                self._store = SnapshotStore(filename)
+        return self._store
+
+    def _remember(self, key, value, dirty):
+        """Put value in the in-memory tier, evicting older snapshots if needed.
+        """
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = value
+        self._memory_size += len(value)
+        if dirty:
+            self._dirty.add(key)
+        else:
+            self._dirty.discard(key)
+        evicted = []
+        while self._memory_size > self.memory_limit and len(self._memory) > 1:
+            k, v = self._memory.popitem(last=False)
+            self._memory_size -= len(v)
+            if k in self._dirty:
+                self._dirty.discard(k)
+                evicted.append( (k, v) )
+        if evicted:
+            if self._spill is None:
+                self._spill = SnapshotStore()
+            self._spill.update(evicted)
+            self._spilled.update(k for (k, v) in evicted)
+
+    def _forget(self, key):
+        """Remove the snapshot for key from all tiers.
+        """
+        with self._lock:
+            v = self._memory.pop(key, None)
+            if v is not None:
+                self._memory_size -= len(v)
+            self._dirty.discard(key)
+            self._spilled.discard(key)
+            self._stored.discard(key)
+            self._files.pop(key, None)
+
+    def _typed(self, key, data):
+        value = TypedString(data)
+        value.timestamp = key
+        value.contenttype = 'image/png'
+        return value
+
+    def _fetch(self, key):
+        """Return the snapshot for the (rounded) key, or not_yet_available_image.
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                return value
+            self._misses += 1
+            for (keys, store, dirty) in ( (self._spilled, self._spill, True),
+                                          (self._stored, self._store, False) ):
+                if key in keys:
+                    data = store.get(key)
+                    if data is not None:
+                        value = self._typed(key, data)
+                        # An unsaved snapshot moves back from the spill
+                        # store to memory.
+                        if dirty:
+                            keys.discard(key)
+                        self._remember(key, value, dirty)
+                        return value
+            if key in self._files:
+                return self._files[key]
+            return self.not_yet_available_image
+
+    def _read(self, key):
+        """Return the PNG data for the (rounded) key, or None.
+
+        Unlike _fetch, the in-memory tier is left untouched.
+        """
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+        if key in self._spilled:
+            return self._spill.get(key)
+        if key in self._stored:
+            return self._store.get(key)
+        if key in self._files:
+            return bytes(self._files[key])
+        return None
+
     def clear(self):
-        self._dict.clear()
+        with self._lock:
+            self._keys = []
+            self._memory.clear()
+            self._memory_size = 0
+            self._dirty.clear()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            self._spilled.clear()
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+            self._stored.clear()
+            self._files.clear()
+            self.generation += 1
 
     def __contains__(self, key):
-        return self.round_timestamp(key) in self._dict
+        return self._has_key(self.round_timestamp(key))
 
     def __getitem__ (self, key):
         """Return a snapshot for the image corresponding to the position pos.
@@ -188,16 +401,21 @@ class ImageCache(object):
         """
         if key is None or key < 0:
             return self.not_yet_available_image
-        return self._dict.get(self.round_timestamp(key), self.not_yet_available_image)
+        return self._fetch(self.round_timestamp(key))
 
     def __delitem__(self, key):
-        self._dict.__delitem__(key)
+        with self._lock:
+            if not self._has_key(key):
+                raise KeyError(key)
+            self._keys.remove(key)
+            self._forget(key)
+            self.generation += 1
 
     def __iter__(self):
-        return self._dict.__iter__()
+        return iter(list(self._keys))
 
     def __len__(self):
-        return self._dict.__len__()
+        return len(self._keys)
 
     def get(self, key, precision=None):
         """Return a snapshot for the image corresponding to the position pos with a given precision.
@@ -216,7 +434,7 @@ class ImageCache(object):
         else:
             key = self.round_timestamp(key)
         logger.debug("Getting key %d", key)
-        return self._dict.get(key, self.not_yet_available_image)
+        return self._fetch(key)
 
     def __setitem__ (self, key, value):
         """Set the snapshot for the image corresponding to the position key.
@@ -229,25 +447,22 @@ class ImageCache(object):
         if key is None:
             return value
         key = self.round_timestamp(key)
-        if value != self.not_yet_available_image:
-            if self.autosync and self.name is not None:
-                d = os.path.join(config.data.path['imagecache'], self.name)
-                if not os.path.isdir(d):
-                    os.mkdir (d)
-                filename = os.path.join(d, "%010d.png" % key)
-                with open(filename, 'wb') as f:
-                    f.write (value)
-                value = CachedString(filename)
-                value.contenttype = 'image/png'
-            elif isinstance(value, (str, bytes)):
-                self._modified = True
-                value = TypedString(value)
-                value.timestamp = key
-                value.contenttype = 'image/png'
-            self._dict[key] = value
-            return value
-        else:
-            return self.not_yet_available_image
+        with self._lock:
+            if value != self.not_yet_available_image:
+                self._forget(key)
+                self._add_key(key)
+                self.generation += 1
+                value = self._typed(key, bytes(value))
+                if self.autosync and self.name is not None:
+                    self._get_store(create=True)[key] = value
+                    self._stored.add(key)
+                    self._remember(key, value, False)
+                else:
+                    self._modified = True
+                    self._remember(key, value, True)
+                return value
+            else:
+                return self.not_yet_available_image
 
     def invalidate(self, key, precision=None):
         """Invalidate the given key.
@@ -255,58 +470,83 @@ class ImageCache(object):
         This method is used when the player has some trouble getting
         an accurate screenshot.
         """
-        if key is None:
-            return
-        key = self.round_timestamp(key)
-        del self._dict[key]
-        return key
+        with self._lock:
+            if key is None:
+                return
+            key = self.round_timestamp(key)
+            del self[key]
+            return key
 
     def valid_snapshots (self):
         """Return the list of positions of valid snapshots.
 
         @return: a list of keys
         """
-        return list(self._dict.keys())
+        return list(self._keys)
+
+    keys = valid_snapshots
 
     def save(self, name):
         """Save the content of the cache under a specified name (id).
 
         The method creates a directory in some other directory
-        (config.data.path['imagecache']) and saves the content.
+        (config.data.path['imagecache']) and saves the snapshots in a
+        database in this directory.
 
         @param name: the name
         @type name: string
         @return: the created directory
         @rtype: string
         """
-        directory = config.data.path['imagecache']
-        if not directory.is_dir():
-            if directory.exists():
-                # File exists, but is not a directory.
-                raise Exception("Fatal error: %s should be a directory" % directory)
-            else:
-                directory.mkdir(parents=True)
-
-        d = directory / name
-
-        if not d.is_dir():
-            if d.exists():
-                # File exists, but is not a directory.
-                raise Exception("Fatal error: %s should be a directory" % d)
+        with self._lock:
+            directory = config.data.path['imagecache']
+            if not directory.is_dir():
+                if directory.exists():
+                    # File exists, but is not a directory.
+                    raise Exception("Fatal error: %s should be a directory" % directory)
+                else:
+                    directory.mkdir(parents=True)
+
+            d = self._store_directory(name)
+
+            if not d.is_dir():
+                if d.exists():
+                    # File exists, but is not a directory.
+                    raise Exception("Fatal error: %s should be a directory" % d)
+                else:
+                    d.mkdir()
+
+            if name == self.name:
+                # Only save the modified snapshots
+                keys = self._dirty | self._spilled
+                store = self._get_store(create=True)
             else:
-                d.mkdir()
-
-        for k, i in self._dict.items():
-            if i == self.not_yet_available_image:
-                continue
-            if isinstance(i, CachedString):
-                continue
-            f = open(d / ("%010d.png" % k), 'wb')
-            f.write (i)
-            f.close ()
-
-        self._modified=False
-        return d
+                # Save everything in the new store
+                keys = set(self._memory) | self._spilled | self._stored | set(self._files)
+                store = SnapshotStore(d / self.store_filename)
+
+            # Copy by chunks, so that the snapshots do not all have to be
+            # loaded in memory.
+            keys = sorted(keys)
+            for i in range(0, len(keys), 256):
+                data = ( (k, self._read(k)) for k in keys[i:i + 256] )
+                store.update([ (k, v) for (k, v) in data if v is not None ])
+
+            if store is not self._store:
+                if self._store is not None:
+                    self._store.close()
+                self._store = store
+                self._files.clear()
+                self.name = name
+            self._stored = set(store.keys())
+            self._dirty.clear()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            self._spilled.clear()
+
+            self._modified=False
+            return d
 
     def load (self, name):
         """Add new images to an ImageCache, from the specified imagecache id.
@@ -314,71 +554,95 @@ class ImageCache(object):
         @param name: the name of the origin imagecache directory.
         @type name: string
         """
-        d = config.data.path['imagecache'] / name
+        with self._lock:
+            d = self._store_directory(name)
 
-        if not d.is_dir():
-            # The cache directory does not exist
-            return
-        else:
-            self.name=name
-            for filename in d.glob('*.png'):
-                n = filename.stem
-                # We must do some checks, in case there are non-well
-                # formatted filenames in the directory
-                try:
-                    n = n.lstrip('0')
-                    if n == '':
-                        n = 0
-                    i = int(n)
-                except ValueError:
-                    logger.error("Invalid filename in imagecache: %s", filename)
-                    continue
-                s = CachedString(d / filename)
-                s.contenttype = 'image/png'
-                self._dict[i] = s
-        self._modified=False
+            if not d.is_dir():
+                # The cache directory does not exist
+                return
+            else:
+                if name != self.name and self._store is not None:
+                    self._store.close()
+                    self._store = None
+                self.name=name
+                store = self._get_store()
+                keys = set()
+                if store is not None:
+                    keys = set(store.keys())
+                    self._stored.update(keys)
+                # Snapshots saved as PNG files by older versions
+                for filename in d.glob('*.png'):
+                    n = filename.stem
+                    # We must do some checks, in case there are non-well
+                    # formatted filenames in the directory
+                    try:
+                        n = n.lstrip('0')
+                        if n == '':
+                            n = 0
+                        i = int(n)
+                    except ValueError:
+                        logger.error("Invalid filename in imagecache: %s", filename)
+                        continue
+                    if i in keys:
+                        continue
+                    s = CachedString(d / filename)
+                    s.contenttype = 'image/png'
+                    self._files[i] = s
+                    keys.add(i)
+                self._keys = sorted(keys.union(self._keys))
+                self.generation += 1
+            self._modified=False
 
     def stats(self):
-        memory_size = 0
-        memory_count = 0
-        disk_size = 0
+        memory_count = len(self._memory)
+        memory_size = self._memory_size
         disk_count = 0
-        for s in self._dict.values():
-            if isinstance(s, TypedString):
-                memory_count += 1
-                memory_size += s.size()
-            elif isinstance(s, CachedString):
-                disk_count += 1
-                disk_size += s.size()
+        disk_size = 0
+        for store in (self._spill, self._store):
+            if store is not None:
+                count, size = store.stats()
+                disk_count += count
+                disk_size += size
+        for s in self._files.values():
+            disk_count += 1
+            disk_size += s.size()
 
         stats = {
             'name': self.name or "",
-            'count': len(self._dict),
+            'count': len(self._keys),
             'memory_count': memory_count,
             'memory_size': memory_size,
             'memory_size_mb': memory_size / 1024 / 1024,
+            'memory_limit_mb': self.memory_limit / 1024 / 1024,
             'disk_count': disk_count,
             'disk_size': disk_size,
             'disk_size_mb': disk_size / 1024 / 1024,
+            'unsaved_count': len(self._dirty) + len(self._spilled),
+            'hits': self._hits,
+            'misses': self._misses,
         }
         return stats
 
     def stats_repr(self):
-        return "%(count)d values. Memory: %(memory_count)d (%(memory_size_mb).02f MB) - Disk [%(name)s]: %(disk_count)d (%(disk_size_mb).02f MB)" % self.stats()
+        return "%(count)d values. Memory: %(memory_count)d (%(memory_size_mb).02f / %(memory_limit_mb).02f MB) - Disk [%(name)s]: %(disk_count)d (%(disk_size_mb).02f MB) - Unsaved: %(unsaved_count)d" % self.stats()
 
     def reset(self):
         """Reset imagecache.
+
+        The positions are kept, but the snapshots are discarded.
         """
-        for pos in self._dict:
-            self._dict[pos] = self.not_yet_available_image
+        with self._lock:
+            keys = self._keys
+            self.clear()
+            self._keys = keys
 
     def ids(self):
         """Return the list of currents ids.
         """
-        return [ str(k) for k in self._dict ]
+        return [ str(k) for k in self._keys ]
 
     def __str__(self):
-        return "ImageCache object (%d images)" % len(self._dict)
+        return "ImageCache object (%d images)" % len(self._keys)
 
     def __repr__(self):
-        return "ImageCache object (%d images)" % len(self._dict)
+        return "ImageCache object (%d images)" % len(self._keys)
@@ -18,6 +18,19 @@
 #
 """Plugin loader.
 
+Plugins are python modules defining a name and a register function,
+which registers the plugin features through the controller.
+
+Importing all plugins at startup is costly, since many of them import
+heavy modules. So, when their register function only registers
+importers, exporters or players (possibly depending on a condition,
+see L{lazy_registrations}), their registrations are stored in a
+L{PluginManifest}. On the next startups, the plugin is not imported:
+its features are registered as L{LazyClass} proxies, and the module is
+imported when one of them is first used.
+
+The manifest entries are invalidated when the plugin file, the
+Advene version or the installed python packages change.
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -31,41 +44,233 @@ except ImportError:
     from importlib.machinery import SourceFileLoader
     import_method='old'
 
-import os
+import ast
+import hashlib
 import inspect
+import json
+import os
+import sys
+import time
 import zipfile
 import zipimport
 
+import advene.core.version
+
+# Registration methods that can be deferred, with their feature kind
+LAZY_REGISTRATIONS = {
+    'register_importer': 'importer',
+    'register_exporter': 'exporter',
+    'register_player': 'player',
+    }
+
 class PluginException(Exception):
     pass
 
+def lazy_registrations(filename):
+    """Check whether the plugin registration can be deferred.
+
+    It is the case when the register function only calls the
+    L{LAZY_REGISTRATIONS} methods of the controller with classes
+    defined in the module, possibly in if statements, and returns a
+    constant.
+
+    @return: True if the registration can be deferred
+    """
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read(), filename)
+    classes = set(n.name for n in tree.body if isinstance(n, ast.ClassDef))
+    functions = [ n for n in tree.body
+                  if isinstance(n, ast.FunctionDef) and n.name == 'register' ]
+    if len(functions) != 1 or not functions[0].args.args:
+        return False
+    controller = functions[0].args.args[0].arg
+
+    def valid(statements):
+        for st in statements:
+            if isinstance(st, ast.Pass):
+                continue
+            elif isinstance(st, ast.Return):
+                if st.value is not None and not isinstance(st.value, ast.Constant):
+                    return False
+            elif isinstance(st, ast.If):
+                if not valid(st.body) or not valid(st.orelse):
+                    return False
+            elif isinstance(st, ast.Expr) and isinstance(st.value, ast.Constant):
+                # Docstring
+                continue
+            elif isinstance(st, ast.Expr) and isinstance(st.value, ast.Call):
+                call = st.value
+                if not (isinstance(call.func, ast.Attribute)
+                        and isinstance(call.func.value, ast.Name)
+                        and call.func.value.id == controller
+                        and call.func.attr in LAZY_REGISTRATIONS
+                        and len(call.args) == 1 and not call.keywords
+                        and isinstance(call.args[0], ast.Name)
+                        and call.args[0].id in classes):
+                    return False
+            else:
+                return False
+        return True
+    return valid(functions[0].body)
+
+def environment_signature():
+    """Return a signature of the python environment.
+
+    It changes when python packages are installed or removed, since
+    this modifies the site-packages directories.
+    """
+    h = hashlib.md5(sys.version.encode('utf-8'))
+    h.update(advene.core.version.version.encode('utf-8'))
+    for d in sys.path:
+        if 'site-packages' in d or 'dist-packages' in d:
+            try:
+                h.update(("%s:%d" % (d, os.stat(d).st_mtime_ns)).encode('utf-8'))
+            except OSError:
+                pass
+    return h.hexdigest()
+
+class PluginManifest(object):
+    """Cache of the plugin registrations, stored as JSON.
+
+    Entries are indexed by plugin filename, and hold the file mtime
+    and size, the plugin name, whether its registration can be
+    deferred (lazy), the register result and the registered features.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.modified = False
+        self.signature = environment_signature()
+        self.entries = {}
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('signature') == self.signature:
+                self.entries = data['plugins']
+            else:
+                logger.info("Python environment changed, ignoring the plugin manifest")
+                self.modified = True
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError):
+            logger.error("Cannot read plugin manifest %s", filename, exc_info=True)
+
+    def file_info(self, filename):
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, filename):
+        """Return the valid entry for the given plugin file, or None.
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        try:
+            if tuple(entry['file']) != self.file_info(filename):
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def set(self, filename, entry):
+        entry['file'] = self.file_info(filename)
+        self.entries[filename] = entry
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return True
+        try:
+            with open(self.filename, 'w', encoding='utf-8') as f:
+                json.dump({ 'signature': self.signature,
+                            'plugins': self.entries }, f, indent=1)
+        except OSError:
+            logger.error("Cannot save plugin manifest %s", self.filename, exc_info=True)
+            return False
+        self.modified = False
+        return True
+
+def describe_class(kind, cls):
+    """Return the manifest description of a registered class.
+
+    Constant class attributes (i.e. JSON-serializable) are stored,
+    and callable ones are listed.
+    """
+    attributes = {}
+    methods = []
+    for n in dir(cls):
+        if n.startswith('_'):
+            continue
+        try:
+            v = getattr(cls, n)
+        except AttributeError:
+            continue
+        if callable(v):
+            methods.append(n)
+        elif isinstance(v, (str, int, float, bool, list, tuple, dict)) or v is None:
+            try:
+                json.dumps(v)
+            except (TypeError, ValueError):
+                continue
+            attributes[n] = v
+    return { 'kind': kind,
+             'class': cls.__name__,
+             'attributes': attributes,
+             'methods': methods }
+
+class RegistrationRecorder(object):
+    """Controller replacement recording the deferrable registrations.
+    """
+    def __init__(self):
+        self.registrations = []
+
+    def __getattr__(self, name):
+        if name not in LAZY_REGISTRATIONS:
+            raise AttributeError(name)
+        def record(cls):
+            self.registrations.append( (name, cls) )
+        return record
+
 class PluginCollection(list):
     """A collection of plugins.
 
     A L{PluginCollection} is a list of L{Plugin} instance. It must be
     instanciated with the directory name.  The prefix is used to
     register the module in sys.modules (to avoid nameclashes).
+
+    If a manifest is given, plugins whose registration can be
+    deferred are not imported: they are L{LazyPlugin} instances.
     """
-    def __init__(self, directory, prefix="plugins"):
+    def __init__(self, directory, prefix="plugins", manifest=None):
         """Loads available plugins from directory.
 
         @param directory: the plugins directory
         @type directory: string (path)
+        @param manifest: the plugin manifest
+        @type manifest: PluginManifest
         """
         super(PluginCollection, self).__init__()
         self.prefix=prefix
+        self.manifest=manifest
 
         if os.path.exists(directory):
             it=self.standard_plugins(directory)
         elif '.zip' in directory:
             it=self.zip_plugins(directory)
+            # Files in zip archives have no mtime
+            self.manifest=None
         else:
             it=None
 
         if it:
             for d, fname in it:
                 try:
-                    p = Plugin(d, fname, self.prefix)
+                    entry = None
+                    if self.manifest is not None:
+                        entry = self.manifest.get(os.path.join(d, fname))
+                    if entry is not None and entry['lazy']:
+                        p = LazyPlugin(d, fname, self.prefix, entry)
+                    else:
+                        p = Plugin(d, fname, self.prefix)
                     self.append(p)
                 except (PluginException, OSError):
                     # Silently ignore non-plugin files
@@ -73,6 +278,60 @@ class PluginCollection(list):
                 except (ImportError, SyntaxError, AttributeError):
                     logger.error("!!!! Cannot load %s plugin", fname, exc_info=True)
 
+    def register(self, plugin, controller):
+        """Register the given plugin.
+
+        Deferrable registrations are stored in the manifest, and
+        lazy plugins register proxies for their features.
+
+        @return: the register function result
+        """
+        t = time.time()
+        if isinstance(plugin, LazyPlugin) or self.manifest is None:
+            res = plugin.register(controller=controller)
+        else:
+            filename = plugin._filename
+            entry = { 'name': plugin.name, 'lazy': False }
+            recorder = None
+            try:
+                if lazy_registrations(filename):
+                    recorder = RegistrationRecorder()
+                    res = plugin.register(controller=recorder)
+            except Exception:
+                logger.debug("Cannot record %s registration", filename, exc_info=True)
+                recorder = None
+            if recorder is None:
+                res = plugin.register(controller=controller)
+            else:
+                for method, cls in recorder.registrations:
+                    getattr(controller, method)(cls)
+                entry.update(lazy=True,
+                             result=res,
+                             features=[ describe_class(LAZY_REGISTRATIONS[method], cls)
+                                        for (method, cls) in recorder.registrations ])
+            self.manifest.set(filename, entry)
+        plugin.statistics['register'] = time.time() - t
+        return res
+
+    def report(self):
+        """Return the startup report of the plugins.
+
+        @return: a list of (name, mode, import time, register time)
+          tuples, where mode is 'imported', 'deferred' or 'loaded'
+          (for deferred plugins imported on demand). Times are in ms.
+        """
+        res = []
+        for p in self:
+            st = p.statistics
+            if isinstance(p, LazyPlugin):
+                mode = 'loaded' if p.loaded else 'deferred'
+            else:
+                mode = 'imported'
+            res.append( (p.name, mode,
+                         1000 * (st.get('import') or 0),
+                         1000 * (st.get('register') or 0)) )
+        return res
+
     def standard_plugins(self, d):
         for name in os.listdir(d):
             m, ext = os.path.splitext(name)
@@ -109,6 +368,7 @@ class Plugin(object):
     @type _filename: string (path)
     """
     def __init__(self, directory, fname, prefix="plugins"):
+        t = time.time()
         def get_classes():
             """Return the classes defined in the module.
             """
@@ -141,6 +401,7 @@ class Plugin(object):
         self._filename = fullname
         self.name = self._plugin.name
         self._classes = get_classes()
+        self.statistics = { 'import': time.time() - t }
 
     def __getattribute__ (self, name):
         """Use the defined method if available. Else, forward the request to the plugin.
@@ -157,6 +418,92 @@ class Plugin(object):
             name="loaded from %s" % self.filename
         return "Plugin %s" % name
 
+class LazyPlugin(object):
+    """A plugin whose import is deferred.
+
+    Its registration is replayed from its manifest entry, with
+    L{LazyClass} proxies. The module is imported when a proxy or
+    another plugin attribute is used.
+
+    @ivar loaded: whether the plugin has been imported
+    @type loaded: boolean
+    """
+    def __init__(self, directory, fname, prefix, entry):
+        self._directory = directory
+        self._fname = fname
+        self._prefix = prefix
+        self._entry = entry
+        self._filename = os.path.join(directory, fname)
+        self._loaded = None
+        self.name = entry['name']
+        self.statistics = {}
+
+    @property
+    def loaded(self):
+        return self._loaded is not None
+
+    def load(self):
+        """Import the plugin.
+
+        @return: the loaded L{Plugin}
+        """
+        if self._loaded is None:
+            self._loaded = Plugin(self._directory, self._fname, self._prefix)
+            self.statistics['import'] = self._loaded.statistics['import']
+            logger.info("Loaded %s plugin on demand (%.1f ms)", self.name,
+                        1000 * self.statistics['import'])
+        return self._loaded
+
+    def register(self, controller=None):
+        for feature in self._entry['features']:
+            getattr(controller, 'register_' + feature['kind'])(LazyClass(self, feature))
+        return self._entry['result']
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def __str__(self):
+        return "Plugin %s (deferred)" % self.name
+
+class LazyClass(object):
+    """Proxy for a class registered by a deferred plugin.
+
+    The constant class attributes are available without importing
+    the plugin. Calling the proxy (i.e. instanciating the class),
+    calling one of its methods or accessing another attribute imports
+    the plugin.
+    """
+    def __init__(self, plugin, feature):
+        self._plugin = plugin
+        self._attributes = feature['attributes']
+        self._methods = set(feature['methods'])
+        self.__name__ = feature['class']
+
+    def load(self):
+        """Return the actual class.
+        """
+        return getattr(self._plugin.load()._plugin, self.__name__)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return self._attributes[name]
+        except KeyError:
+            pass
+        if name in self._methods:
+            def method(*p, **kw):
+                return getattr(self.load(), name)(*p, **kw)
+            method.__name__ = name
+            return method
+        return getattr(self.load(), name)
+
+    def __call__(self, *p, **kw):
+        return self.load()(*p, **kw)
+
+    def __repr__(self):
+        return "<LazyClass %s from %s>" % (self.__name__, self._plugin._filename)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     l = PluginCollection('plugins')
@@ -0,0 +1,182 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests of the webserver caching, through the headless WSGI application.
+"""
+import io
+import json
+from pathlib import Path
+import unittest
+
+import sys
+sys.path.insert(0, ".")
+
+import advene.core.config as config
+
+maindir = Path(__file__).absolute().parents[3]
+if (maindir / 'setup.py').exists():
+    # Development tree
+    config.data.fix_paths(maindir)
+
+from advene.core.wsgi import HeadlessController
+
+PACKAGE = maindir / 'examples' / 'Nosferatu_v12.azp'
+
+# The PNG signature is enough for image detection
+PNG1 = b'\x89PNG\r\n\x1a\n' + b'1' * 100
+PNG2 = b'\x89PNG\r\n\x1a\n' + b'2' * 100
+
+@unittest.skipUnless(PACKAGE.exists(), "Example package not available")
+class WebServerCacheTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.controller = HeadlessController()
+        cls.controller.init([ 'nos=%s' % PACKAGE ])
+        cls.application = cls.controller.server.application
+        cls.package = cls.controller.packages['nos']
+
+    def request(self, path, method='GET', headers=None):
+        """Return the (status code, headers, body) of the response.
+
+        Header names are lowercased.
+        """
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost',
+            'CONTENT_LENGTH': '0',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for (name, value) in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        response = {}
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict( (name.lower(), value) for (name, value) in response_headers )
+        chunks = list(self.application(environ, start_response))
+        for chunk in chunks:
+            self.assertIsInstance(chunk, bytes)
+        return response['status'], response['headers'], b''.join(chunks)
+
+    def assertRevalidated(self, path, headers, modified):
+        """Check the conditional requests for path, with the validators of headers.
+        """
+        expected = 200 if modified else 304
+        status, h, body = self.request(path, headers={ 'If-None-Match': headers['etag'] })
+        self.assertEqual(status, expected)
+        if 'last-modified' in headers:
+            status, h, body = self.request(path, headers={ 'If-Modified-Since': headers['last-modified'] })
+            self.assertEqual(status, expected)
+
+    def test_element(self):
+        a = self.package.annotations[0]
+        path = '/packages/nos/annotations/%s/content/data' % a.id
+        status, headers, body = self.request(path)
+        self.assertEqual(status, 200)
+        self.assertEqual(body.decode('utf-8'), a.content.data)
+        self.assertIn('etag', headers)
+        self.assertRevalidated(path, headers, modified=False)
+
+        # Modify the package
+        data = a.content.data
+        try:
+            a.content.data = 'Modified'
+            self.controller.notify('AnnotationEditEnd', annotation=a, immediate=True)
+            status, new_headers, body = self.request(path)
+            self.assertEqual(body, b'Modified')
+            self.assertNotEqual(new_headers['etag'], headers['etag'])
+            self.assertRevalidated(path, headers, modified=True)
+        finally:
+            a.content.data = data
+            self.controller.notify('AnnotationEditEnd', annotation=a, immediate=True)
+
+    def test_player(self):
+        # Views can depend on the player
+        p = self.package
+        v = p.createView(ident='test_player', clazz='package', content_mimetype='text/html')
+        v.content.data = '<span tal:content="player/current_position_value">0</span>'
+        p.views.append(v)
+        player = self.controller.player
+        position = player.current_position_value
+        path = '/packages/nos/view/test_player'
+        try:
+            player.current_position_value = 1000
+            status, headers, body = self.request(path)
+            self.assertEqual(status, 200)
+            self.assertIn(b'1000', body)
+            self.assertRevalidated(path, headers, modified=False)
+
+            player.current_position_value = 2000
+            self.assertRevalidated(path, headers, modified=True)
+            status, headers, body = self.request(path)
+            self.assertIn(b'2000', body)
+        finally:
+            player.current_position_value = position
+            p.views.remove(v)
+
+    def test_snapshot(self):
+        imagecache = self.package.imagecache
+        position = imagecache.round_timestamp(123000)
+        path = '/packages/nos/imagecache/%d' % position
+        try:
+            imagecache[position] = PNG1
+            status, headers, body = self.request(path)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['content-type'], 'image/png')
+            self.assertEqual(body, PNG1)
+            # Snapshots are validated with their content
+            self.assertNotIn('last-modified', headers)
+            self.assertRevalidated(path, headers, modified=False)
+
+            imagecache[position] = PNG2
+            self.assertRevalidated(path, headers, modified=True)
+            status, headers, body = self.request(path, headers={ 'If-Modified-Since': headers['date'] })
+            self.assertEqual(status, 200)
+            self.assertEqual(body, PNG2)
+        finally:
+            imagecache.invalidate(position)
+
+    def test_read_only(self):
+        status, headers, body = self.request('/packages/nos/annotations', method='POST')
+        self.assertEqual(status, 405)
+
+    def test_json_api(self):
+        status, headers, body = self.request('/packages/nos/api/annotations?limit=10')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json; charset=utf-8')
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(data['count'], 10)
+        status, headers, body = self.request('/packages/nos/api/annotations?cursor=invalid')
+        self.assertEqual(status, 400)
+        self.assertIn('error', json.loads(body.decode('utf-8')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,6 +30,28 @@ URL syntax
   The server can run standalone or embedded in another application
   (typically the C{advene} GUI).  In all cases, Webserver depends on
   AdveneController.
+
+Caching
+=======
+
+  Package elements and snapshots are sent with an ETag, so that
+  clients can revalidate their copy with a conditional GET (answered
+  with 304 Not Modified). The ETag of package elements is derived from
+  the package generation, which is incremented by the controller on
+  each modifying event, and by the server on each PUT or POST
+  request, and from the other state available to the views (other
+  packages, player, snapshots). Rendered package elements are also
+  kept in a bounded server-side cache (see the C{response-cache-size}
+  webserver option).
+
+Concurrency
+===========
+
+  Requests are handled by a pool of threads, while the application
+  main thread modifies the packages. Package accesses are protected by
+  the controller model lock: requests reading packages hold it for
+  reading, so that they run in parallel, and requests modifying
+  packages (PUT, POST, package loading...) hold it for writing.
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -44,6 +66,15 @@ import urllib.request, urllib.parse, urllib.error
 import cgi
 import socket
 import imghdr
+import email.utils
+import base64
+import json
+import hashlib
+import itertools
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 from gettext import gettext as _
 
@@ -65,6 +96,46 @@ import simpletal.simpleTALES as simpleTALES
 import advene.util.helper as helper
 
 DEBUG=True
+
+class ResponseCache:
+    """Bounded LRU cache of rendered responses.
+
+    Keys hold the package version, so that the responses for a
+    modified package are never used again: they are eventually evicted.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
 class Common:
     """Common functionalities for all cherrypy nodes.
     """
@@ -122,6 +193,54 @@ class Common:
         cherrypy.response.headers['Pragma']='no-cache'
         cherrypy.response.headers['Cache-Control']='max-age=0'
 
+    def validation_headers(self, etag, last_modified=None):
+        """Write the cache validation headers in the response.
+
+        The response may be cached by the browser, provided that it
+        is revalidated with a conditional request.
+
+        @param etag: the entity tag
+        @type etag: string
+        @param last_modified: the last modification time
+        @type last_modified: float
+        """
+        headers = cherrypy.response.headers
+        headers.pop('Pragma', None)
+        headers['Cache-Control'] = 'no-cache'
+        headers['ETag'] = etag
+        if last_modified is not None:
+            headers['Last-Modified'] = email.utils.formatdate(last_modified, usegmt=True)
+
+    def not_modified(self, etag, last_modified=None):
+        """Handle conditional GET requests.
+
+        Write the validation headers, and check the If-None-Match and
+        If-Modified-Since request headers. If the client copy is still
+        valid, the response status is set to 304 and True is
+        returned: no content should then be sent.
+
+        @return: True if the client copy is still valid
+        """
+        self.validation_headers(etag, last_modified)
+        if cherrypy.request.method not in ('GET', 'HEAD'):
+            return False
+        headers = cherrypy.request.headers
+        match = headers.get('If-None-Match')
+        if match is not None:
+            tags = [ t.strip() for t in match.split(',') ]
+            valid = '*' in tags or etag in tags or ('W/' + etag) in tags
+        else:
+            valid = False
+            since = headers.get('If-Modified-Since')
+            if since and last_modified is not None:
+                try:
+                    valid = int(last_modified) <= email.utils.mktime_tz(email.utils.parsedate_tz(since))
+                except (TypeError, ValueError, OverflowError):
+                    pass
+        if valid:
+            cherrypy.response.status = 304
+        return valid
+
     def start_html (self, title="", headers=None, head_section=None, body_attributes="",
                     mode=None, mimetype=None, duplicate_title=False, cache=False):
         """Starts writing a HTML response (header + common body start).
@@ -444,6 +563,11 @@ class Media(Common):
             return "".join(res)
 
         snapshot = self.controller.get_snapshot(position, media=p.media)
+        if snapshot.is_default:
+            # The snapshot is not available yet
+            self.no_cache()
+        elif self.not_modified('"%s"' % hashlib.md5(bytes(snapshot)).hexdigest()):
+            return b''
         cherrypy.response.headers['Content-type']=snapshot.contenttype
         res.append (bytes(snapshot))
         return res
@@ -930,6 +1054,7 @@ class Admin(Common):
         should link to all functionalities.
         """
         res=[ self.start_html (_("Server Administration"), duplicate_title=True, mode='navigation') ]
+        cache = self.controller.server.response_cache
         if self.controller.server.displaymode == 'raw':
             switch='navigation'
         else:
@@ -947,6 +1072,8 @@ class Admin(Common):
         <p><a href="/admin/list">List available files</a></p>
         <p><a href="/packages">List loaded packages</a> (%(packagelist)s)</p>
         <p>Display mode : %(displaymode)s</p>
+        <p>Response cache : %(cache)s</p>
+        <p>Model lock : %(lock)s</p>
         <hr>
         <p>Load a package :
         <form action="/admin/load" method="GET">
@@ -957,7 +1084,10 @@ class Admin(Common):
         </body></html>
         """) % { 'packagelist': " | ".join( ['<a href="/packages/%s">%s</a>' % (alias, alias)
                                              for alias in self.controller.packages] ),
-                 'displaymode': mode_sw })
+                 'displaymode': mode_sw,
+                 'cache': _("%(count)d responses (%(hits)d hits, %(misses)d misses)") % {
+                     'count': len(cache), 'hits': cache.hits, 'misses': cache.misses },
+                 'lock': _("%(reads)d reads (%(read_contended)d waited, max %(read_wait_max).3fs), %(writes)d writes (%(write_contended)d waited, max %(write_wait_max).3fs), up to %(max_readers)d parallel readers") % self.controller.model_lock.stats() })
         return "".join(res)
     index.exposed=True
 
@@ -1001,7 +1131,8 @@ class Admin(Common):
         try:
             # FIXME: potential problem: this method executes in the webserver thread, which may
             # cause problems with the GUI
-            self.controller.load_package (uri=uri, alias=alias)
+            with self.controller.model_lock.write():
+                self.controller.load_package (uri=uri, alias=alias)
             return "".join( (
                 self.start_html (_("Package %s loaded") % alias, duplicate_title=True, mode='navigation'),
                 _("""<p>Go to the <a href="/packages/%(alias)s">%(alias)s</a> package, or to the <a href="/packages">package list</a>.""") % { 'alias': alias }
@@ -1016,7 +1147,8 @@ class Admin(Common):
         """Unload a package.
         """
         try:
-            self.controller.unregister_package (alias)
+            with self.controller.model_lock.write():
+                self.controller.unregister_package (alias)
             return "".join((
                 self.start_html (_("Package %s deleted") % alias, duplicate_title=True, mode='navigation'),
                 _("""<p>Go to the <a href="/packages">package list</a>.""")
@@ -1032,12 +1164,13 @@ class Admin(Common):
         """Save a package.
         """
         try:
-            if alias is not None:
-                # Save a specific package
-                self.controller.save_package(alias=alias)
-            else:
-                self.controller.save_package()
-                alias='default'
+            with self.controller.model_lock.write():
+                if alias is not None:
+                    # Save a specific package
+                    self.controller.save_package(alias=alias)
+                else:
+                    self.controller.save_package()
+                    alias='default'
             return "".join((
                 self.start_html (_("Package %s saved") % alias, duplicate_title=True, mode='navigation'),
                 _("""<p>Go to the <a href="/packages/%(alias)s">%(alias)s</a> package, or to the <a href="/packages">package list</a>.""") % { 'alias': alias }
@@ -1052,7 +1185,9 @@ class Admin(Common):
     def reset(self):
         """Reset packages list.
         """
-        self.controller.reset()
+        with self.controller.model_lock.write():
+            self.controller.reset()
+        self.controller.server.response_cache.clear()
         return self.start_html (_('Server reset'), duplicate_title=True, mode='navigation')
     reset.exposed=True
 
@@ -1090,9 +1225,283 @@ class Admin(Common):
             return self.controller.server.displaymode
     display.exposed=True
 
+class PackageApi(Common):
+    """JSON access to package annotations and relations.
+
+    URL syntax
+    ==========
+
+    The API of a package is available under C{/packages/alias/api}:
+
+      - C{/packages/alias/api} : the list of endpoints, with counts
+      - C{/packages/alias/api/annotationtypes} : the annotation types
+      - C{/packages/alias/api/relationtypes} : the relation types
+      - C{/packages/alias/api/annotations} : the annotations, sorted
+        by begin time
+      - C{/packages/alias/api/relations} : the relations
+
+    The annotations and relations endpoints accept the following
+    parameters:
+
+      - C{type} : comma-separated list of type ids
+      - C{fields} : comma-separated list of returned fields
+        (see L{ANNOTATION_FIELDS} and L{RELATION_FIELDS})
+      - C{limit} : maximum number of returned elements (see the
+        C{api-page-size} and C{api-max-page-size} webserver options)
+      - C{cursor} : the C{next} value of the previous page
+
+    Annotations can also be filtered by time (in ms, or in any format
+    accepted by L{advene.util.helper.parse_time}) with the C{begin}
+    and C{end} parameters: the annotations intersecting [begin, end]
+    are returned, or only the ones included in it if C{contained} is
+    set.
+
+    The result is an object holding the C{items} list, their
+    C{count}, and the C{next} cursor (null on the last page). Cursors
+    designate the last returned element, so that pages remain
+    consistent when the package is modified meanwhile. The response
+    is streamed: elements are fetched by chunks, holding the model
+    lock only while a chunk is built.
+    """
+    # Number of elements fetched while holding the model lock
+    CHUNK_SIZE = 200
+
+    ANNOTATION_FIELDS = {
+        'id': lambda a, b, e: a.id,
+        'type': lambda a, b, e: a.type.id,
+        'begin': lambda a, b, e: b,
+        'end': lambda a, b, e: e,
+        'duration': lambda a, b, e: e - b,
+        'content': lambda a, b, e: a.content.data,
+        'mimetype': lambda a, b, e: a.content.mimetype,
+        'author': lambda a, b, e: a.author,
+        'date': lambda a, b, e: a.date,
+        'tags': lambda a, b, e: list(a.tags),
+        'relations': lambda a, b, e: [ r.id for r in a.relations ],
+        }
+    ANNOTATION_DEFAULT_FIELDS = ('id', 'type', 'begin', 'end', 'content')
+
+    RELATION_FIELDS = {
+        'id': lambda r: r.id,
+        'type': lambda r: r.type.id,
+        'members': lambda r: [ a.id for a in r.members ],
+        'content': lambda r: r.content.data,
+        'mimetype': lambda r: r.content.mimetype,
+        'author': lambda r: r.author,
+        'date': lambda r: r.date,
+        'tags': lambda r: list(r.tags),
+        }
+    RELATION_DEFAULT_FIELDS = ('id', 'type', 'members', 'content')
+
+    class Error(Exception):
+        """Invalid request parameter.
+        """
+        pass
+
+    def send_json(self, data, status=200):
+        cherrypy.response.status = status
+        cherrypy.response.headers['Content-type'] = 'application/json; charset=utf-8'
+        self.no_cache()
+        # The encode tool only handles text/* types
+        return json.dumps(data).encode('utf-8')
+
+    def encode_cursor(self, value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, query):
+        cursor = query.get('cursor')
+        if not cursor:
+            return None
+        try:
+            value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+            value = (int(value[0]), str(value[1]))
+        except (ValueError, TypeError, IndexError, KeyError, UnicodeDecodeError):
+            raise self.Error(_("Invalid cursor"))
+        return value
+
+    def get_list(self, query, name):
+        """Return the values of a comma-separated list parameter.
+        """
+        value = query.get(name)
+        if not value:
+            return None
+        if isinstance(value, list):
+            # Parameter given multiple times
+            value = ",".join(value)
+        return [ v.strip() for v in value.split(',') if v.strip() ]
+
+    def get_time(self, query, name):
+        value = query.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            return helper.parse_time(value)
+        except (ValueError, helper.InvalidTimestamp):
+            raise self.Error(_("Invalid %(name)s time: %(value)s") % { 'name': name,
+                                                                      'value': value })
+
+    def get_limit(self, query):
+        max_limit = config.data.webserver.get('api-max-page-size', 10000)
+        value = query.get('limit')
+        if value is None or value == '':
+            return min(config.data.webserver.get('api-page-size', 500), max_limit)
+        try:
+            limit = int(value)
+        except ValueError:
+            raise self.Error(_("Invalid limit: %s") % value)
+        if limit <= 0:
+            raise self.Error(_("Invalid limit: %s") % value)
+        return min(limit, max_limit)
+
+    def get_fields(self, query, available, default):
+        fields = self.get_list(query, 'fields') or default
+        unknown = [ f for f in fields if f not in available ]
+        if unknown:
+            raise self.Error(_("Unknown fields: %(unknown)s. Available fields: %(available)s") % {
+                'unknown': ", ".join(unknown),
+                'available': ", ".join(sorted(available)) })
+        return [ (f, available[f]) for f in fields ]
+
+    def get_types(self, query, source):
+        ids = self.get_list(query, 'type')
+        if ids is None:
+            return None
+        types = dict( (t.id, t) for t in source )
+        unknown = [ i for i in ids if i not in types ]
+        if unknown:
+            raise self.Error(_("Unknown types: %s") % ", ".join(unknown))
+        return [ types[i] for i in ids ]
+
+    def stream(self, fetch, limit):
+        """Stream the JSON result of a paginated query.
+
+        fetch(after, count) returns a list of (item, cursor) pairs for
+        at most count elements following the after cursor. It is
+        called with the model lock held for reading.
+        """
+        lock = self.controller.model_lock
+        def generate():
+            yield b'{"items": ['
+            after = None
+            count = 0
+            more = False
+            while count < limit:
+                size = min(self.CHUNK_SIZE, limit - count)
+                with lock.read():
+                    # Fetch one more element, to know whether there is
+                    # a next page.
+                    items = fetch(after, size + 1)
+                more = len(items) > size
+                items = items[:size]
+                if not items:
+                    break
+                yield (("," if count else "") + ",".join(json.dumps(item) for (item, c) in items)).encode('utf-8')
+                count += len(items)
+                after = items[-1][1]
+                if not more:
+                    break
+            yield ('], "count": %d, "next": %s}' % (count,
+                                                   json.dumps(self.encode_cursor(after) if more else None))).encode('utf-8')
+        cherrypy.response.status = 200
+        cherrypy.response.headers['Content-type'] = 'application/json; charset=utf-8'
+        self.no_cache()
+        cherrypy.response.stream = True
+        return generate()
+
+    def annotations(self, p, query):
+        types = self.get_types(query, p.annotationTypes)
+        fields = self.get_fields(query, self.ANNOTATION_FIELDS, self.ANNOTATION_DEFAULT_FIELDS)
+        begin = self.get_time(query, 'begin')
+        end = self.get_time(query, 'end')
+        contained = query.get('contained', '').lower() in ('1', 'true', 'yes', 'on')
+        start = self.decode_cursor(query)
+        index = p.getTemporalIndex()
+
+        def fetch(after, count):
+            segments = index.segments_after(after or start, count, begin=begin, end=end,
+                                            types=types, contained=contained)
+            return [ (dict( (f, get(a, b, e)) for (f, get) in fields ), (b, a.id))
+                     for (a, b, e) in segments ]
+        return self.stream(fetch, self.get_limit(query))
+
+    def relations(self, p, query):
+        types = self.get_types(query, p.relationTypes)
+        fields = self.get_fields(query, self.RELATION_FIELDS, self.RELATION_DEFAULT_FIELDS)
+        start = self.decode_cursor(query)
+
+        def fetch(after, count):
+            # Relation cursors hold the (position, id) of the last
+            # returned relation. If the relation moved, it is looked
+            # up by id.
+            after = after or start
+            relations = p.relations
+            i = 0
+            if after is not None:
+                pos, ident = after
+                if pos < len(relations) and relations[pos].id == ident:
+                    i = pos + 1
+                else:
+                    i = next( (n + 1 for (n, r) in enumerate(relations) if r.id == ident),
+                              min(pos, len(relations)) )
+            res = []
+            while i < len(relations) and len(res) < count:
+                r = relations[i]
+                if types is None or r.type in types:
+                    res.append( (dict( (f, get(r)) for (f, get) in fields ), (i, r.id)) )
+                i += 1
+            return res
+        return self.stream(fetch, self.get_limit(query))
+
+    def element_types(self, source, index=None):
+        res = []
+        for t in source:
+            info = { 'id': t.id,
+                     'title': t.title,
+                     'mimetype': t.mimetype }
+            if index is not None:
+                info['count'] = len(index.annotations_of_type(t))
+            res.append(info)
+        return res
+
+    def handle(self, p, path, query):
+        """Handle a GET request on the package API.
+
+        @param p: the package
+        @param path: the path components following C{api}
+        @param query: the query parameters
+        """
+        if cherrypy.request.method != 'GET':
+            return self.send_json({ 'error': _("Unsupported method: %s") % cherrypy.request.method }, 405)
+        endpoint = path[0] if path else ''
+        try:
+            if endpoint == 'annotations':
+                return self.annotations(p, query)
+            elif endpoint == 'relations':
+                return self.relations(p, query)
+            with self.controller.model_lock.read():
+                if endpoint == 'annotationtypes':
+                    return self.send_json(self.element_types(p.annotationTypes, p.getTemporalIndex()))
+                elif endpoint == 'relationtypes':
+                    return self.send_json(self.element_types(p.relationTypes))
+                elif endpoint == '':
+                    base = cherrypy.url()
+                    return self.send_json({
+                        'annotations': { 'url': base + '/annotations', 'count': len(p.getTemporalIndex()) },
+                        'relations': { 'url': base + '/relations', 'count': len(p.relations) },
+                        'annotationtypes': { 'url': base + '/annotationtypes', 'count': len(p.annotationTypes) },
+                        'relationtypes': { 'url': base + '/relationtypes', 'count': len(p.relationTypes) },
+                        })
+        except self.Error as e:
+            return self.send_json({ 'error': str(e) }, 400)
+        return self.send_json({ 'error': _("Unknown endpoint: %s") % endpoint }, 404)
+
 class Packages(Common):
     """Node for packages access.
     """
+    def __init__(self, controller=None):
+        super().__init__(controller)
+        self.json_api = PackageApi(controller)
+
     def index(self):
         """Display currently available (loaded) packages.
 
@@ -1362,6 +1771,51 @@ class Packages(Common):
                     'value': cgi.escape(str(type(objet)))})
         return res
 
+    def cached_display_package_element(self, p, tales, query):
+        """Display a view for a TALES expression, using the caches.
+
+        Responses are validated with an ETag depending on the
+        rendering version (see L{AdveneWebServer.rendering_version}),
+        and kept in the server response cache. Images are validated
+        with an ETag depending on their content only.
+
+        Expressions using options (i.e. the application state) are
+        not cached.
+        """
+        server = self.controller.server
+        if tales.startswith('options'):
+            return self.display_package_element(p, tales, query)
+
+        version, last_modified = server.rendering_version(p)
+        etag = '"%s-%s"' % (version, server.displaymode)
+        if self.not_modified(etag, last_modified):
+            return b''
+
+        key = (version, server.displaymode, cherrypy.url(), tales,
+               tuple(sorted( (k, str(v)) for (k, v) in query.items() )))
+        cached = server.response_cache.get(key)
+        if cached is not None:
+            mimetype, body = cached
+            cherrypy.response.status = 200
+            cherrypy.response.headers['Content-type'] = mimetype
+            self.validation_headers(etag, last_modified)
+            return list(body)
+
+        # display_package_element modifies the query
+        res = self.display_package_element(p, tales, dict(query))
+        if res is None or not str(cherrypy.response.status).startswith('200'):
+            return res
+        mimetype = cherrypy.response.headers.get('Content-type', '')
+        if mimetype.startswith('image/'):
+            body = b''.join(r if isinstance(r, bytes) else r.encode('utf-8') for r in res)
+            cherrypy.response.headers.pop('Last-Modified', None)
+            if self.not_modified('"%s"' % hashlib.md5(body).hexdigest()):
+                return b''
+            return res
+        self.validation_headers(etag, last_modified)
+        server.response_cache.put(key, (mimetype, tuple(res)))
+        return res
+
     def default(self, *args, **query):
         """Access a specific package.
 
@@ -1381,6 +1835,8 @@ class Packages(Common):
         element view. Its value is in fact the URL displaying the
         correct view, and the browser is redirected.
 
+        The C{/packages/alias/api} paths are handled by the JSON API
+        (see L{PackageApi}).
         """
         if not args:
             return self.index()
@@ -1393,6 +1849,9 @@ class Packages(Common):
             return self.send_error (501, _("<p>Package <strong>%s</strong> not loaded</p>")
                                     % pkgid)
 
+        if len(args) > 1 and args[1] == 'api':
+            return self.json_api.handle(p, args[2:], query)
+
         # Handle form parameters (from the navigation interface)
         if 'view' in query:
             if query['view'] != '':
@@ -1420,16 +1879,26 @@ class Packages(Common):
 
         tales = "/".join (args[1:])
 
-        if cherrypy.request.method == 'PUT':
-            return self.handle_put_request(*args, **query)
-        elif cherrypy.request.method == 'POST':
-            return self.handle_post_request(*args, **query)
+        if cherrypy.request.method in ('PUT', 'POST'):
+            if cherrypy.request.method == 'PUT':
+                handler = self.handle_put_request
+            else:
+                handler = self.handle_post_request
+            with self.controller.model_lock.write():
+                try:
+                    return handler(*args, **query)
+                finally:
+                    # Modifications are not always notified through
+                    # events, and failing requests may have modified
+                    # the package: invalidate the cached responses.
+                    p.generation += 1
         elif cherrypy.request.method != 'GET':
             return self.send_error(400, 'Unknown method: %s' % cherrypy.request.method)
 
         logger.debug("Evaluating %s", tales)
         try:
-            return self.display_package_element (p , tales, query)
+            with self.controller.model_lock.read():
+                return self.cached_display_package_element (p , tales, query)
         except simpletal.simpleTAL.TemplateParseException as e:
             res=[ self.start_html(_("Error")) ]
             res.append(_("<h1>Error</h1>"))
@@ -2132,7 +2601,7 @@ class AdveneWebServer:
                 'log.access_file': config.data.advenefile('webserver.log', 'settings'),
                 'log.error_file': config.data.advenefile('webserver-error.log', 'settings'),
                 'server.reverse_dns': False,
-                'server.thread_pool': 10,
+                'server.thread_pool': config.data.webserver.get('threads', 10),
                 'engine.autoreload.on': False,
                 #'server.environment': "development",
                 'server.environment': "production",
@@ -2143,14 +2612,37 @@ class AdveneWebServer:
             }
         cherrypy.config.update(settings)
 
+        self.init_state()
+        self.urlbase = "http://localhost:%d/" % port
+
+        cherrypy.tree.mount(Root(controller), config=self.app_config())
+
+        try:
+            # engine.start *must* be started from the main thread.
+            cherrypy.engine.start()
+        except Exception as e:
+            self.controller.log(_("Cannot start HTTP server: %s") % str(e))
+
+    def init_state(self):
+        """Initialize the display settings and the caches.
+        """
         self.displaymode = config.data.webserver['displaymode']
 
+        # Package versions, used for cache validation
+        self._token = '%x' % int(time.time())
+        self._serial = itertools.count()
+        self._versions = weakref.WeakKeyDictionary()
+        self._rendering_versions = weakref.WeakKeyDictionary()
+        self._versions_lock = threading.Lock()
+        self.response_cache = ResponseCache(config.data.webserver.get('response-cache-size', 256))
+
         # Not used for the moment.
         self.authorized_hosts = {'127.0.0.1': 'localhost'}
 
-        self.urlbase = "http://localhost:%d/" % port
-
-        app_config={
+    def app_config(self):
+        """Return the cherrypy application configuration.
+        """
+        return {
             '/': {
                  'tools.encode.on': True
             },
@@ -2163,13 +2655,63 @@ class AdveneWebServer:
                 'tools.staticdir.dir': str(config.data.path['web'])
                 },
             }
-        cherrypy.tree.mount(Root(controller), config=app_config)
 
-        try:
-            # engine.start *must* be started from the main thread.
-            cherrypy.engine.start()
-        except Exception as e:
-            self.controller.log(_("Cannot start HTTP server: %s") % str(e))
+    def modification_time(self, previous):
+        """Return the time of a new version.
+
+        HTTP dates have a one second resolution, so the time is at
+        least one second after the previous version, for
+        If-Modified-Since requests to see the modification.
+        """
+        return max(time.time(), int(previous) + 1)
+
+    def package_version(self, p):
+        """Return the (version, last modification time) of package p.
+
+        The version string changes whenever the package is modified
+        (see the package generation), reloaded, or when the server is
+        restarted. The modification time is the time when the server
+        first saw this version.
+        """
+        with self._versions_lock:
+            info = self._versions.get(p)
+            if info is None:
+                info = (next(self._serial), p.generation, time.time())
+                self._versions[p] = info
+            elif info[1] != p.generation:
+                info = (info[0], p.generation, self.modification_time(info[2]))
+                self._versions[p] = info
+        return "%s-%d-%d" % (self._token, info[0], info[1]), info[2]
+
+    def rendering_version(self, p):
+        """Return the (version, last modification time) of the views of package p.
+
+        Views are evaluated with the C{package}, C{packages},
+        C{player} and C{options/snapshot} globals, so the version also
+        changes when the loaded or active packages are modified or
+        changed, when the player position or status changes, and when
+        the snapshots are modified.
+        """
+        c = self.controller
+        player = c.player
+        # Snapshots are accessed through the packages (imagecache
+        # attribute) and the options/snapshot global
+        imagecaches = (getattr(p, 'imagecache', None), getattr(c.package, 'imagecache', None))
+        state = (self.package_version(p)[0],
+                 tuple( (alias, self.package_version(pkg)[0])
+                        for (alias, pkg) in list(c.packages.items()) ),
+                 getattr(player, 'current_position_value', None),
+                 getattr(player, 'status', None),
+                 tuple( getattr(imagecache, 'generation', None) for imagecache in imagecaches ))
+        with self._versions_lock:
+            info = self._rendering_versions.get(p)
+            if info is None:
+                info = (next(self._serial), state, time.time())
+                self._rendering_versions[p] = info
+            elif info[1] != state:
+                info = (next(self._serial), state, self.modification_time(info[2]))
+                self._rendering_versions[p] = info
+        return "%s-%d" % (self._token, info[0]), info[2]
 
     def start(self):
         """Start the webserver.
@@ -2190,3 +2732,61 @@ class AdveneWebServer:
     def is_running(self):
         return cherrypy.engine.state == cherrypy.engine.states.STARTED
 
+class ReadOnlyPackages(Packages):
+    """Node for read-only packages access.
+
+    Modification requests (PUT and POST) are rejected.
+    """
+    def default(self, *args, **query):
+        if cherrypy.request.method not in ('GET', 'HEAD'):
+            cherrypy.response.headers['Allow'] = 'GET, HEAD'
+            return self.send_error(405, _("<p>The packages are read-only.</p>"))
+        return super().default(*args, **query)
+    default.exposed=True
+
+class HeadlessRoot(Root):
+    """Root of the headless server.
+
+    Only the packages (read-only) and the static data are available:
+    there is no player, application or administration access.
+    """
+    def __init__(self, controller=None):
+        self.controller=controller
+        self.packages=ReadOnlyPackages(controller)
+
+    def index(self):
+        """Display the loaded packages.
+        """
+        return self.packages.index()
+    index.exposed=True
+
+class HeadlessWebServer(AdveneWebServer):
+    """Read-only server for WSGI deployment.
+
+    The server does not listen by itself: L{application} is a WSGI
+    callable, to be run by any WSGI server (see L{advene.core.wsgi}).
+
+    @ivar application: the WSGI application
+    @type application: cherrypy.Application
+    """
+    def __init__(self, controller=None, urlbase="/"):
+        self.controller=controller
+        cherrypy.config.update({
+                'log.screen': False,
+                'engine.autoreload.on': False,
+                'server.environment': "production",
+                })
+        # Do not start the builtin HTTP server with the engine
+        cherrypy.server.unsubscribe()
+        self.init_state()
+        self.urlbase = urlbase
+        self.application = cherrypy.tree.mount(HeadlessRoot(controller), config=self.app_config())
+
+    def start(self):
+        return True
+
+    def stop(self):
+        pass
+
+    def is_running(self):
+        return True
@@ -0,0 +1,233 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Headless deployment of the Advene webserver.
+
+The packages are served read-only, without player nor main loop, by
+a WSGI application (see L{advene.core.webcherry.HeadlessWebServer}).
+It can be run by any WSGI server, the packages being specified (as
+C{alias=uri} or C{uri}, separated by spaces) in the C{ADVENE_PACKAGES}
+environment variable:
+
+  ADVENE_PACKAGES="nosferatu=/data/nosferatu.azp" gunicorn -w 4 advene.core.wsgi:application
+
+The application is then created on the first request of each worker.
+To load the packages once, before the workers are forked, use the
+factory with a preloading server:
+
+  gunicorn --preload -w 4 'advene.core.wsgi:make_application()'
+
+The L{serve} function (used by C{advene-webserver --headless}) runs a
+standalone server, with a pool of request threads in each of its
+worker processes.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import concurrent.futures
+import os
+import re
+import shlex
+import signal
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+import advene.core.config as config
+from advene.core.controller import AdveneController
+from advene.core.webcherry import HeadlessWebServer
+
+class HeadlessController(AdveneController):
+    """Controller for read-only package serving.
+
+    It uses the dummy player and has no main loop: queued actions are
+    executed immediately. Snapshots are never captured, they are only
+    read from the imagecache (see C{advene-thumbnails}).
+    """
+    player_plugin = 'dummy'
+
+    def __init__(self, args=None):
+        super().__init__(args)
+        self.event_handler.internal_rule (event="PackageLoad",
+                                          method=self.manage_package_load)
+
+    def init(self, args=None):
+        """Load the packages and create the server.
+
+        @param args: the packages, as C{alias=uri} or C{uri}
+        @type args: list
+        """
+        for uri in args or []:
+            if '=' in uri:
+                alias, uri = uri.split('=', 1)
+            else:
+                alias = os.path.splitext(os.path.basename(uri))[0]
+            alias = re.sub('[^a-zA-Z0-9_]', '_', alias)
+            self.load_package(uri=uri, alias=alias, activate=False)
+            if alias not in self.packages:
+                logger.error("Cannot load package %s", uri)
+                continue
+            # Build the indexes now, rather than in the first requests
+            len(self.packages[alias].getTemporalIndex())
+            logger.info("Loaded %s as %s", uri, alias)
+        aliases = [ a for a in self.packages if a != 'advene' ]
+        if aliases:
+            self.activate_package(aliases[0])
+        else:
+            logger.warning("No package to serve")
+        self.server = HeadlessWebServer(controller=self)
+        return True
+
+    def queue_action(self, method, *args, **kw):
+        method(*args, **kw)
+        return True
+
+    def update_snapshot (self, position=None, media=None, force=False):
+        return True
+
+def make_application(packages=None):
+    """Return a WSGI application serving the given packages.
+
+    @param packages: the packages, as C{alias=uri} or C{uri}. The
+      C{ADVENE_PACKAGES} environment variable is used by default.
+    @type packages: list
+    """
+    if packages is None:
+        packages = shlex.split(os.environ.get('ADVENE_PACKAGES', ''))
+    controller = HeadlessController()
+    controller.init(packages)
+    return controller.server.application
+
+_application = None
+_application_lock = threading.Lock()
+
+def application(environ, start_response):
+    """WSGI entry point, serving the C{ADVENE_PACKAGES} packages.
+    """
+    global _application
+    if _application is None:
+        with _application_lock:
+            if _application is None:
+                _application = make_application()
+    return _application(environ, start_response)
+
+class RequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+class PooledWSGIServer(WSGIServer):
+    """WSGI server handling requests in a pool of threads.
+
+    The pool must be started (by L{start_pool}) in the process
+    serving the requests, i.e. after forking.
+    """
+    pool = None
+
+    def start_pool(self, threads):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads,
+                                                          thread_name_prefix='advene-request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+def serve(packages, port=None, host='127.0.0.1', workers=None, threads=None):
+    """Serve the given packages.
+
+    The packages are loaded, then the worker processes are forked:
+    they share the listening socket, and the loaded data until they
+    modify it. Workers are restarted if they die.
+
+    @param packages: the packages, as C{alias=uri} or C{uri}
+    @type packages: list
+    @param workers: the number of worker processes
+    @param threads: the number of request threads per worker
+    """
+    if port is None:
+        port = config.data.webserver['port']
+    if workers is None:
+        workers = config.data.webserver['workers']
+    if threads is None:
+        threads = config.data.webserver['threads']
+    if not hasattr(os, 'fork'):
+        workers = 1
+
+    app = make_application(packages)
+    server = make_server(host, port, app,
+                         server_class=PooledWSGIServer, handler_class=RequestHandler)
+    logger.info("Serving on http://%s:%d/ (%d workers, %d threads each)",
+                host or '*', port, workers, threads)
+
+    def run():
+        server.start_pool(threads)
+        server.serve_forever()
+
+    if workers <= 1:
+        try:
+            run()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return
+
+    children = set()
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run()
+            finally:
+                os._exit(1)
+        children.add(pid)
+
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %d died (status %d), restarting it", pid, status)
+            # Do not loop if workers cannot start
+            time.sleep(1)
+            spawn()
+    server.server_close()
@@ -396,7 +396,10 @@ class AdveneGUI(object):
             if s:
                 m.append(Gtk.MenuItem(_("Snapshotter activity")))
                 m.append(Gtk.SeparatorMenuItem())
-                m.append(Gtk.MenuItem(_("%d queued requests") % s.timestamp_queue.qsize()))
+                m.append(Gtk.MenuItem(_("%d queued requests") % s.pending()))
+                if hasattr(s, 'progress'):
+                    p = s.progress()
+                    m.append(Gtk.MenuItem(_("%(done)d/%(requested)d snapshots (%(rate).1f/s) on %(count)d pipelines") % dict(p, count=len(p['pipelines']))))
                 i = Gtk.MenuItem(_("Cancel all requests"))
                 i.connect('activate', lambda i: s.clear() or True)
                 m.append(i)
@@ -1392,7 +1395,9 @@ class AdveneGUI(object):
         if config.data.debug:
             self.controller._state=self.controller.event_handler.dump()
         Gdk.threads_enter()
+        self.controller.hold_model_lock()
         Gtk.main ()
+        self.controller.release_model_lock()
         Gdk.threads_leave()
         self.controller.notify ("ApplicationEnd")
 
@@ -3200,7 +3205,7 @@ class AdveneGUI(object):
         # Check snapshotter activity
         s = getattr(c.player, 'snapshotter', None)
         if s:
-            if s.timestamp_queue.empty():
+            if not s.pending():
                 self.snapshotter_monitor_icon.set_state('idle')
             else:
                 self.snapshotter_monitor_icon.set_state('running')
@@ -4268,6 +4273,7 @@ Image cache information: %(imagecache)s
                         'prefer-wysiwyg',
                         'player-shortcuts-in-edit-windows', 'player-shortcuts-modifier',
                         'apply-edited-elements-on-save',
+                        'timeline-canvas-threshold',
                         'frameselector-count', 'frameselector-width',
         )
         # Direct options needing a restart to be taken into account.
@@ -4372,6 +4378,7 @@ Image cache information: %(imagecache)s
 
         ew.add_checkbox(_("Enable snapshots"), "player-snapshot", _("Enable snapshots"))
         ew.add_spin(_("Snapshot width"), "player-snapshot-width", _("Snapshot width in pixels."), 0, 1280)
+        ew.add_spin(_("Snapshot pipelines"), "player-snapshot-pipelines", _("Number of movie decoders used in parallel for snapshots."), 1, 64)
         ew.add_spin(_("Verbosity"), "player-level", _("Verbosity level. -1 for no messages."),
                     -1, 3)
 
@@ -4429,6 +4436,7 @@ Image cache information: %(imagecache)s
         ew.add_spin(_("Font size"), 'font-size', _("Font size for annotation widgets"), 4, 20)
         ew.add_spin(_("Button height"), 'button-height', _("Height of annotation widgets"), 10, 50)
         ew.add_spin(_("Interline height"), 'interline-height', _("Height of interlines"), 0, 40)
+        ew.add_spin(_("Direct rendering"), 'timeline-canvas-threshold', _("Number of displayed annotations above which they are directly drawn instead of using one widget per annotation (-1 to disable)."), -1, 10000000)
 
         ew.add_title(_("Text content"))
         ew.add_checkbox(_("Completion mode"), 'completion-mode', _("Enable dynamic completion mode"))
@@ -41,12 +41,14 @@ from advene.model.annotation import Annotation, Relation
 from advene.gui.views import AdhocView
 import advene.gui.edit.elements
 from advene.gui.util import png_to_pixbuf, enable_drag_source, window_to_png
+from advene.gui.util import get_target_types, drag_data_get_cb, contextual_drag_end
 from advene.gui.util import decode_drop_parameters, MODIFIER_MASK
 from advene.gui.util.completer import Completer
 import advene.util.helper as helper
+import advene.util.dtw
 from advene.gui.util import dialog, name2color, get_small_stock_button, get_pixmap_button, get_pixmap_toolbutton
 from advene.gui.views.annotationdisplay import AnnotationDisplay
-from advene.gui.widget import AnnotationWidget, AnnotationTypeWidget
+from advene.gui.widget import AnnotationWidget, AnnotationTypeWidget, AnnotationSprite
 
 name="Timeline view plugin"
 
@@ -54,10 +56,12 @@ def register(controller):
     controller.register_viewclass(TimeLine)
 
 # The timeline component is not efficient enough to display too many
-# annotations. Set a reasonable threshold here: above this number of
-# annotations to display, and if no selection of annotation types is
-# proposed, the timeline will start empty and ask the user to select
-# the annotation types to actually display.
+# annotations with widgets. Set a reasonable threshold here: above
+# this number of annotations to display, and if no selection of
+# annotation types is proposed, the timeline will start empty and ask
+# the user to select the annotation types to actually display. It
+# does not apply when the annotations are rendered directly (see the
+# timeline-canvas-threshold preference).
 ANNOTATION_COUNT_LIMIT = 2000
 
 class QuickviewBar(Gtk.HBox):
@@ -205,7 +209,8 @@ class TimeLine(AdhocView):
 
         if not annotationtypes:
             # Selecting whole package. Check if there are no too many to display.
-            if not elements and len(self.controller.package.annotations) > ANNOTATION_COUNT_LIMIT:
+            n = len(self.controller.package.annotations)
+            if not elements and n > ANNOTATION_COUNT_LIMIT and not self.use_canvas(n):
                 self.should_display_type_selection_popup = True
                 annotationtypes = []
             else:
@@ -239,6 +244,21 @@ class TimeLine(AdhocView):
         self.annotationtype_widgets = {}
         self.annotation_widgets = {}
 
+        # Direct rendering of annotations (see draw_canvas). In this
+        # mode, annotation_widgets holds AnnotationSprites, created
+        # on demand.
+        self.canvas = False
+        # Annotation under the pointer
+        self.canvas_focus = None
+        # (sprite, x, y) of a button press on an annotation
+        self.canvas_press = None
+        # Sprite being dragged
+        self.canvas_drag = None
+        # Cache of annotation colors
+        self.canvas_colors = {}
+        # Set of displayed annotations, if self.list is defined
+        self.list_set = None
+
         self.colors = {
             'active': name2color('#fdfd4b'),
             'background': name2color('red'),
@@ -296,7 +316,8 @@ class TimeLine(AdhocView):
         # Coordinates of the selected region.
         self.layout_selection=[ [None, None], [None, None] ]
 
-        self.layout.add_events( Gdk.EventMask.BUTTON_PRESS_MASK | Gdk.EventMask.BUTTON_RELEASE_MASK | Gdk.EventMask.BUTTON1_MOTION_MASK )
+        self.layout.add_events( Gdk.EventMask.BUTTON_PRESS_MASK | Gdk.EventMask.BUTTON_RELEASE_MASK | Gdk.EventMask.BUTTON1_MOTION_MASK
+                                | Gdk.EventMask.POINTER_MOTION_MASK | Gdk.EventMask.POINTER_MOTION_HINT_MASK )
         self.scale_layout = Gtk.Layout()
         self.scale_layout.height=0
         self.scale_layout.step=0
@@ -331,10 +352,14 @@ class TimeLine(AdhocView):
 
         # The layout can receive drops
         self.layout.connect('drag-data-received', self.layout_drag_received)
+        # and is the drag source of directly rendered annotations
+        self.layout.connect('drag-begin', self.canvas_drag_begin)
+        self.layout.connect('drag-data-get', self.canvas_drag_data_get)
+        self.layout.connect('drag-end', self.canvas_drag_end)
         self.layout.drag_dest_set(Gtk.DestDefaults.MOTION |
                                   Gtk.DestDefaults.HIGHLIGHT |
                                   Gtk.DestDefaults.ALL,
-                                  config.data.get_target_types('annotation', 'annotation-type', 'timestamp'),
+                                  config.data.get_target_types('annotation', 'annotation-type', 'timestamp', 'tag'),
                                   Gdk.DragAction.COPY | Gdk.DragAction.LINK | Gdk.DragAction.MOVE | Gdk.DragAction.ASK )
 
         self.old_scale_value = self.scale.get_value()
@@ -443,11 +468,223 @@ class TimeLine(AdhocView):
                 context.line_to(width, y)
         context.stroke()
         context.set_dash([])
+        if self.canvas:
+            self.draw_canvas(layout, context)
         return False
 
     def update_relation_lines(self):
         self.layout.queue_draw()
 
+    def use_canvas(self, count):
+        """Should count annotations be rendered directly on the layout?
+        """
+        threshold = config.data.preferences['timeline-canvas-threshold']
+        return threshold >= 0 and count > threshold
+
+    def is_displayed(self, annotation):
+        """Is the annotation displayed in the timeline?
+        """
+        return (annotation.type in self.layer_position
+                and (self.list_set is None or annotation in self.list_set)
+                and annotation.fragment.begin <= self.maximum
+                and annotation.fragment.end >= self.minimum)
+
+    def get_canvas_pointer(self):
+        """Return the pointer position in layout coordinates.
+        """
+        x, y = self.layout.get_pointer()
+        return (int(self.layout.get_hadjustment().get_value() + x),
+                int(self.layout.get_vadjustment().get_value() + y))
+
+    def get_annotation_rectangle(self, annotation):
+        """Return the rectangle of a directly rendered annotation, in layout coordinates.
+        """
+        r = Gdk.Rectangle()
+        r.x = self.unit2pixel(annotation.fragment.begin, absolute=True)
+        r.y = self.layer_position.get(annotation.type, -1)
+        r.width = self.unit2pixel(annotation.fragment.duration)
+        r.height = self.get_element_height(annotation)
+        return r
+
+    def redraw_annotation(self, annotation):
+        """Queue the redraw of a directly rendered annotation.
+        """
+        if not self.canvas or annotation.type not in self.layer_position:
+            return
+        r = self.get_annotation_rectangle(annotation)
+        width = self.layout.get_allocated_width()
+        x1 = max(0, r.x - int(self.layout.get_hadjustment().get_value()) - 2)
+        x2 = min(width, x1 + r.width + 4)
+        y = r.y - int(self.layout.get_vadjustment().get_value()) - 2
+        if x2 > x1:
+            self.layout.queue_draw_area(x1, y, x2 - x1, r.height + 4)
+
+    def draw_canvas(self, layout, context):
+        """Draw the annotations of the visible area.
+
+        Only the annotations intersecting the area to redraw are
+        fetched from the temporal index, summarized at the pixel
+        resolution (see TemporalIndex.overview). Annotations that are
+        too narrow to display their title are drawn as plain
+        rectangles, grouped by color, and skipped when they fall into
+        pixels that are already covered.
+        """
+        x_offset = int(layout.get_hadjustment().get_value())
+        y_offset = layout.get_vadjustment().get_value()
+        cx1, cy1, cx2, cy2 = context.clip_extents()
+        scale = self.scale.get_value()
+        minimum = self.minimum
+        begin = self.pixel2unit(x_offset + cx1, absolute=True)
+        end = self.pixel2unit(x_offset + cx2, absolute=True) + 1
+        index = self.controller.package.temporalIndex
+        displayed = self.list_set
+        sprites = self.annotation_widgets
+        colors = self.canvas_colors
+        white = self.colors['white']
+
+        for at, p in self.layer_position.items():
+            y = p - y_offset
+            height = self.get_element_height(at)
+            if y + height < cy1 or y > cy2:
+                continue
+            if displayed is None:
+                segments = index.overview(begin, end, scale, at)
+            else:
+                segments = [ s for s in index.segments_in(begin, end, at) if s[0] in displayed ]
+            # (red, green, blue) -> list of (x, width) rectangles
+            batches = {}
+            detailed = {}
+            covered = None
+            for a, b, e in sorted(segments, key=operator.itemgetter(1)):
+                if a in sprites:
+                    # Drawn below, with its actual bounds
+                    continue
+                x = (int((b - minimum) / scale) or 1) - x_offset
+                w = int((e - b) / scale) or 1
+                if w >= 10:
+                    detailed[a] = (x, w)
+                    continue
+                if covered is not None and x + w <= covered:
+                    continue
+                covered = x + w if covered is None else max(covered, x + w)
+                try:
+                    color = colors[a]
+                except KeyError:
+                    color = self.get_element_color(a)
+                color = color or white
+                batches.setdefault( (color.red, color.green, color.blue), []).append( (x, w) )
+            # Active or focused annotations
+            for a in sprites:
+                if (a.type == at
+                    and (displayed is None or a in displayed)
+                    and a.fragment.begin <= end and a.fragment.end >= begin):
+                    detailed[a] = ( (int((a.fragment.begin - minimum) / scale) or 1) - x_offset,
+                                    int(a.fragment.duration / scale) or 1 )
+
+            for (red, green, blue), rectangles in batches.items():
+                for x, w in rectangles:
+                    context.rectangle(x, y, w, height)
+                context.set_source_rgb(red / 65536.0, green / 65536.0, blue / 65536.0)
+                context.fill()
+
+            for a, (x, w) in detailed.items():
+                sprite = sprites.get(a)
+                if sprite is None:
+                    sprite = AnnotationSprite(annotation=a, container=self)
+                context.save()
+                context.translate(x, y)
+                context.rectangle(0, 0, w, height)
+                context.clip()
+                sprite.draw(context, w, height)
+                context.restore()
+        return False
+
+    def annotation_at(self, x, y):
+        """Return the directly rendered annotation at the layout position (x, y).
+
+        Return None if there is no annotation.
+        """
+        for at, p in self.layer_position.items():
+            if p <= y <= p + self.get_element_height(at):
+                break
+        else:
+            return None
+        t = self.pixel2unit(x, absolute=True)
+        tolerance = self.pixel2unit(2)
+        candidates = [ (a, b, e)
+                       for (a, b, e) in self.controller.package.temporalIndex.segments_in(t - tolerance, t + tolerance, at)
+                       if self.list_set is None or a in self.list_set ]
+        if not candidates:
+            return None
+        # Use the last drawn annotation under the pointer, else the
+        # closest one.
+        for a, b, e in reversed(candidates):
+            if b <= t <= e:
+                return a
+        return min(candidates, key=lambda c: min(abs(c[1] - t), abs(c[2] - t)))[0]
+
+    def set_canvas_focus(self, annotation):
+        """Set the focused directly rendered annotation.
+        """
+        old = self.canvas_focus
+        if annotation is old:
+            return
+        self.canvas_focus = annotation
+        if old is not None:
+            self.redraw_annotation(old)
+            b = self.annotation_widgets.get(old)
+            if b is not None:
+                self.release_sprite(b)
+            self.annotation_focus_out_cb(None, None)
+        if annotation is not None:
+            b = self.get_widget_for_annotation(annotation)
+            if b is not None:
+                self.layout.grab_focus()
+                self.redraw_annotation(annotation)
+                self.annotation_focus_in_cb(b, None)
+
+    def release_sprite(self, sprite):
+        """Forget a sprite which holds no specific state.
+        """
+        if (self.canvas
+            and not sprite.active
+            and sprite.annotation is not self.canvas_focus
+            and sprite.local_color is None
+            and sprite.fraction_marker is None):
+            self.annotation_widgets.pop(sprite.annotation, None)
+
+    def canvas_button_press(self, annotation, event):
+        """Handle a button press on a directly rendered annotation.
+        """
+        self.set_canvas_focus(annotation)
+        b = self.get_widget_for_annotation(annotation)
+        if b is None or not self.annotation_button_press_cb(b, event, annotation):
+            return False
+        if b._single_click_guard:
+            # It may be the beginning of a drag
+            x, y = self.get_canvas_pointer()
+            self.canvas_press = (b, x, y)
+        return True
+
+    def canvas_drag_begin(self, layout, context):
+        b = self.canvas_drag
+        if b is None:
+            return False
+        context._element = b.annotation
+        self.annotation_drag_begin(b, context)
+        b._drag_begin(layout, context)
+        return True
+
+    def canvas_drag_data_get(self, layout, context, selection, targetType, timestamp):
+        if self.canvas_drag is None:
+            return False
+        return drag_data_get_cb(self.canvas_drag, context, selection, targetType, timestamp, self.controller)
+
+    def canvas_drag_end(self, layout, context):
+        contextual_drag_end(layout, context)
+        self.canvas_drag = None
+        return True
+
     def draw_time_cursor(self, layout, context):
         """Draw the time cursor in the given layout.
 
@@ -717,7 +954,8 @@ class TimeLine(AdhocView):
                 self.annotationtypes = self.annotationtypes_selection
             else:
                 # We display the whole package, so display also empty annotation types
-                if len(package.annotations) > ANNOTATION_COUNT_LIMIT:
+                n = len(package.annotations)
+                if n > ANNOTATION_COUNT_LIMIT and not self.use_canvas(n):
                     self.should_display_type_selection_popup = True
                     self.annotationtypes = []
                 else:
@@ -733,6 +971,17 @@ class TimeLine(AdhocView):
         self.layout.foreach(self.layout.remove)
         self.annotation_widgets = {}
 
+        if self.list is None:
+            self.list_set = None
+            count = sum(len(at.annotations) for at in self.annotationtypes)
+        else:
+            self.list_set = set(self.list)
+            count = len(self.list)
+        self.canvas = self.use_canvas(count)
+        self.canvas_focus = None
+        self.canvas_press = None
+        self.canvas_colors = {}
+
         self.update_layer_position()
 
         self.draw_marks()
@@ -805,7 +1054,10 @@ class TimeLine(AdhocView):
         return False
 
     def get_widget_for_annotation (self, annotation):
-        return self.annotation_widgets.get(annotation)
+        b = self.annotation_widgets.get(annotation)
+        if b is None and self.canvas and self.is_displayed(annotation):
+            b = self.annotation_widgets[annotation] = AnnotationSprite(annotation=annotation, container=self)
+        return b
 
     def get_element_height(self, element):
         if isinstance(element, Annotation):
@@ -817,6 +1069,11 @@ class TimeLine(AdhocView):
         if w is not None:
             w.destroy()
             del self.annotation_widgets[annotation]
+        if self.canvas:
+            if self.canvas_focus is annotation:
+                self.canvas_focus = None
+            self.canvas_colors.pop(annotation, None)
+            self.layout.queue_draw()
 
     def scroll_to_annotation(self, annotation):
         """Scroll the view to put the annotation in the middle.
@@ -971,6 +1228,9 @@ class TimeLine(AdhocView):
 
     def tag_update(self, context, parameters):
         tag=context.evaluateValue('tag')
+        if self.canvas:
+            self.canvas_colors.clear()
+            self.layout.queue_draw()
         for b in self.annotation_widgets.values():
             if tag in b.annotation.tags:
                 self.update_button(b)
@@ -1005,6 +1265,7 @@ class TimeLine(AdhocView):
                 return True
         for b in buttons:
             b.set_active(False)
+            self.release_sprite(b)
         self.update_selection_button()
         return True
 
@@ -1032,12 +1293,24 @@ class TimeLine(AdhocView):
         """Return the gtk color for the given element.
         Return None if no color is defined.
         """
+        if self.canvas:
+            # Directly rendered annotations are redrawn often: cache
+            # their colors.
+            try:
+                return self.canvas_colors[element]
+            except KeyError:
+                color = self.canvas_colors[element] = name2color(self.controller.get_element_color(element))
+                return color
         color=self.controller.get_element_color(element)
         return name2color(color)
 
     def update_button (self, b):
         """Update the representation for button b.
         """
+        if self.canvas:
+            self.canvas_colors.pop(b.annotation, None)
+            self.layout.queue_draw()
+            return True
         b.update_widget()
         a=b.annotation
         self.layout.move(b, self.unit2pixel(a.fragment.begin, absolute=True), self.layer_position[a.type])
@@ -1045,16 +1318,19 @@ class TimeLine(AdhocView):
 
     def update_annotation (self, annotation=None, event=None):
         """Update an annotation's representation."""
-        l = self.get_annotations()
-        if event == 'AnnotationActivate' and annotation in l:
+        if self.canvas:
+            displayed = self.is_displayed(annotation)
+        else:
+            displayed = annotation in self.get_annotations()
+        if event == 'AnnotationActivate' and displayed:
             self.activate_annotation(annotation)
             if self.options['autoscroll'] == 3:
                 self.scroll_to_annotation(annotation)
             return True
-        elif event == 'AnnotationDeactivate' and annotation in l:
+        elif event == 'AnnotationDeactivate' and displayed:
             self.desactivate_annotation(annotation)
             return True
-        elif event == 'AnnotationCreate' and annotation in l:
+        elif event == 'AnnotationCreate' and displayed:
             b=self.get_widget_for_annotation(annotation)
             if b is not None:
                 # It was already created (for instance by the code
@@ -1066,6 +1342,11 @@ class TimeLine(AdhocView):
                 b.grab_focus()
             return True
         elif event == 'AnnotationEditEnd':
+            if self.canvas:
+                # The annotation may have moved anywhere
+                self.canvas_colors.pop(annotation, None)
+                self.layout.queue_draw()
+                return True
             b = self.get_widget_for_annotation(annotation)
             if b is not None:
                 self.update_button (b)
@@ -1090,6 +1371,9 @@ class TimeLine(AdhocView):
             self.legend.show_all()
             # Update also its annotations, since representation or
             # color may have changed
+            if self.canvas:
+                self.canvas_colors.clear()
+                self.layout.queue_draw()
             for b in self.annotation_widgets.values():
                 if b.annotation.type == annotationtype:
                     self.update_button (b)
@@ -1513,92 +1797,15 @@ class TimeLine(AdhocView):
             return self.transmuted_annotation
 
         def DTWalign_annotations(i, at, typ, mode, delete=True):
-            sa = at.annotations
-            sa.sort(key=lambda a: a.fragment.begin)
-            da = typ.annotations
-            da.sort(key=lambda a: a.fragment.begin)
-            bestpath = []
-            bestdist = []
-
-            mindist = (abs(sa[0].fragment.begin - da[0].fragment.begin)
-                       + abs(sa[0].fragment.end - da[0].fragment.end)
-                       + abs((sa[0].fragment.end - sa[0].fragment.begin)
-                             - (da[0].fragment.end - da[0].fragment.begin)))
-            bestdist.append(mindist)
-            bestpath.append([])
-            bestpath[0].append(0)
-
-            for j in range(1,len(sa)):
-                bestpath.append([])
-                bestpath[j].append(j)
-
-                dist = (abs(sa[j].fragment.begin - da[0].fragment.begin)
-                        + abs(sa[j].fragment.end - da[0].fragment.end)
-                        + abs((sa[j].fragment.end - sa[j].fragment.begin)
-                              - (da[0].fragment.end - da[0].fragment.begin)))
-                if dist < mindist:
-                    mindist = dist
-                    bestpath[j] = [j]
-                    bestdist.append(dist)
-                else:
-                    bestpath[j] = list(bestpath[j-1])
-                    bestdist.append(bestdist[j-1] + dist)
-
-            for i in range(1,len(da)):
-                currentdist = 0
-                prevsubdist = 0
-                currentpath = []
-                prevsubpath = []
-                for j in range(0,len(sa)):
-                    dist = (abs(sa[j].fragment.begin - da[i].fragment.begin)
-                            + abs(sa[j].fragment.end - da[i].fragment.end)
-                            + abs((sa[j].fragment.end - sa[j].fragment.begin)
-                                  - (da[i].fragment.end - da[i].fragment.begin)))
-
-                    if j == 0:
-                        currentpath = list(bestpath[0])
-                        currentdist = bestdist[0]
-
-                        bestpath[0].append(0)
-                        bestdist[0] = bestdist[0] + dist
-
-                    else:
-                        insdist = bestdist[j] + dist
-                        deldist = bestdist[j-1] + dist
-                        subdist = prevsubdist + dist*1.5
-
-                        currentdist =  bestdist[j]
-                        currentpath = list(bestpath[j])
-
-                        if insdist < deldist :
-                            if insdist < subdist:
-                                bestpath[j].append(j)
-                                bestdist[j] = insdist
-                            else :
-                                prevsubpath.append(j)
-                                bestpath[j] = prevsubpath
-                                bestdist[j] = subdist
-                        elif subdist < deldist :
-                            prevsubpath.append(j)
-                            bestpath[j] = prevsubpath
-                            bestdist[j] = subdist
-                        else:
-                           bestpath[j] = list(bestpath[j-1])
-                           bestdist[j] = deldist
-
-                    prevsubdist = currentdist
-                    prevsubpath = list(currentpath)
-
             # Update annotation timestamp/contents
             batch_id=object()
-            for (i,j) in enumerate(bestpath[len(sa)-1]):
-                annotation=da[i]
+            for (annotation, reference) in advene.util.dtw.align_annotations(at.annotations, typ.annotations):
                 self.controller.notify('EditSessionStart', element=annotation, immediate=True)
                 if mode == 'time':
-                    annotation.fragment.begin = sa[j].fragment.begin
-                    annotation.fragment.end = sa[j].fragment.end
+                    annotation.fragment.begin = reference.fragment.begin
+                    annotation.fragment.end = reference.fragment.end
                 elif mode == 'content':
-                    annotation.content.data = sa[j].content.data
+                    annotation.content.data = reference.content.data
                 self.controller.notify('AnnotationEditEnd', annotation=annotation, batch=batch_id)
                 self.controller.notify('EditSessionEnd', element=annotation)
             return True
@@ -1956,10 +2163,64 @@ class TimeLine(AdhocView):
             except AttributeError:
                 pass
             return False
-        self.layout.foreach(desactivate)
+        if self.canvas:
+            for b in list(self.annotation_widgets.values()):
+                if b.active:
+                    b.set_active(False)
+                    self.release_sprite(b)
+        else:
+            self.layout.foreach(desactivate)
         self.update_selection_button()
         return True
 
+    def annotation_focus_out_cb(self, widget, event):
+        """Handle focus-out on annotation representations.
+        """
+        self.set_annotation(None)
+        if self.options['display-relations'] and not self.options['display-all-relations']:
+            self.relations_to_draw = []
+            self.update_relation_lines()
+        return False
+
+    def annotation_focus_in_cb(self, button, event):
+        """Handle focus-in on annotation representations.
+        """
+        self.set_annotation(button.annotation)
+        if self.options['display-relations'] and not self.options['display-all-relations']:
+            a=button.annotation
+            for r in button.annotation.relations:
+                # FIXME: handle more-than-binary relations
+                if r.members[0] != a:
+                    b=self.get_widget_for_annotation(r.members[0])
+                    if b:
+                        # b may be None, if the related annotation is not displayed
+                        self.relations_to_draw.append( (b, button, r) )
+                elif r.members[1] != a:
+                    b=self.get_widget_for_annotation(r.members[1])
+                    if b:
+                        self.relations_to_draw.append( (button, b, r) )
+            self.update_relation_lines()
+
+        annotation = button.annotation
+        if (self.options['autoscroll'] and
+            self.controller.player.status != self.controller.player.PlayingStatus):
+            # Check if the annotation is not already visible
+            a = self.adjustment
+            start=a.get_value()
+            finish=a.get_value() + a.get_page_size()
+            begin = self.unit2pixel(annotation.fragment.begin, absolute=True)
+            if begin >= start and begin <= finish:
+                return False
+            end = self.unit2pixel(annotation.fragment.end, absolute=True)
+            if end >= start and end <= finish:
+                return False
+            if begin <= start and end >= finish:
+                # The annotation bounds are off-screen anyway. Do
+                # not move.
+                return False
+            self.scroll_to_annotation(annotation)
+        return False
+
     def create_annotation_widget(self, annotation):
         if not annotation.type in self.layer_position:
             # The annotation is not displayed
@@ -1969,6 +2230,10 @@ class TimeLine(AdhocView):
             return None
         if config.data.livedebug:
             logger.debug("create_annotation_widget for %s", annotation.id, stack_info=False)
+        if self.canvas:
+            b = self.get_widget_for_annotation(annotation)
+            self.layout.queue_draw()
+            return b
         b = self.get_widget_for_annotation(annotation)
         if b is not None:
             logger.warn("There is already 1 representation for annotation %s", annotation.id)
@@ -1992,51 +2257,8 @@ class TimeLine(AdhocView):
         b.connect('drag-begin', deactivate_single_click_guard)
 
         b.connect('enter-notify-event', lambda b, e: b.grab_focus())
-
-        def focus_out(widget, event):
-            self.set_annotation(None)
-            if self.options['display-relations'] and not self.options['display-all-relations']:
-                self.relations_to_draw = []
-                self.update_relation_lines()
-            return False
-        b.connect('focus-out-event', focus_out)
-
-        def focus_in(button, event):
-            self.set_annotation(button.annotation)
-            if self.options['display-relations'] and not self.options['display-all-relations']:
-                a=button.annotation
-                for r in button.annotation.relations:
-                    # FIXME: handle more-than-binary relations
-                    if r.members[0] != a:
-                        b=self.get_widget_for_annotation(r.members[0])
-                        if b:
-                            # b may be None, if the related annotation is not displayed
-                            self.relations_to_draw.append( (b, button, r) )
-                    elif r.members[1] != a:
-                        b=self.get_widget_for_annotation(r.members[1])
-                        if b:
-                            self.relations_to_draw.append( (button, b, r) )
-                self.update_relation_lines()
-
-            if (self.options['autoscroll'] and
-                self.controller.player.status != self.controller.player.PlayingStatus):
-                # Check if the annotation is not already visible
-                a = self.adjustment
-                start=a.get_value()
-                finish=a.get_value() + a.get_page_size()
-                begin = self.unit2pixel(annotation.fragment.begin, absolute=True)
-                if begin >= start and begin <= finish:
-                    return False
-                end = self.unit2pixel(annotation.fragment.end, absolute=True)
-                if end >= start and end <= finish:
-                    return False
-                if begin <= start and end >= finish:
-                    # The annotation bounds are off-screen anyway. Do
-                    # not move.
-                    return False
-                self.scroll_to_annotation(button.annotation)
-            return False
-        b.connect('focus-in-event', focus_in)
+        b.connect('focus-out-event', self.annotation_focus_out_cb)
+        b.connect('focus-in-event', self.annotation_focus_in_cb)
 
         b.connect('drag-begin', self.annotation_drag_begin)
         # The button can receive drops (to create relations)
@@ -2121,7 +2343,7 @@ class TimeLine(AdhocView):
         u2p = self.unit2pixel
         l = annotations
         if l is None:
-            l = self.get_annotations()
+            l = [] if self.canvas else self.get_annotations()
         logger.debug("populate %d annotations", len(l), stack_info=False)
 
         # Use a list so that the counter variable can be modified in
@@ -2139,6 +2361,15 @@ class TimeLine(AdhocView):
                                   + self.button_height + config.data.preferences['timeline']['interline-height'])
             self.scale_layout.set_size(u2p (self.maximum - self.minimum), 40)
 
+        if self.canvas:
+            # Annotations are drawn from the temporal index, there
+            # are no widgets to create.
+            update_layout_size()
+            self.layout.queue_draw()
+            if callback:
+                callback()
+            return
+
         def create_annotations(annotations, length):
             i = counter[0]
             if i < length:
@@ -2316,6 +2547,11 @@ class TimeLine(AdhocView):
     def layout_key_press_cb (self, win, event):
         """Handles key presses in the timeline background
         """
+        if self.canvas and self.canvas_focus is not None and win is self.layout:
+            b = self.get_widget_for_annotation(self.canvas_focus)
+            if b is not None and self.annotation_key_press_cb(b, event, b.annotation):
+                return True
+
         # Process player shortcuts
         if self.controller.gui and self.controller.gui.process_player_shortcuts(win, event):
             return True
@@ -2362,6 +2598,12 @@ class TimeLine(AdhocView):
 
         # Correct y value according to scrollbar position
         y += widget.get_parent().get_vscrollbar().get_adjustment().get_value()
+        if self.canvas and targetType in (config.data.target_type['annotation'],
+                                          config.data.target_type['tag']):
+            a = self.annotation_at(self.adjustment.get_value() + x, y)
+            if a is not None:
+                # Drop on a directly rendered annotation
+                return self.annotation_drag_received(self.get_widget_for_annotation(a), context, x, y, selection, targetType, time)
         drop_types=[ at
                      for (at, p) in self.layer_position.items()
                      if (y >= p and y <= p + self.get_element_height(at) + config.data.preferences['timeline']['interline-height']) ]
@@ -2468,6 +2710,11 @@ class TimeLine(AdhocView):
         x=int(p.get_hadjustment().get_value() + x)
         y=int(p.get_vadjustment().get_value() + y)
 
+        if self.canvas:
+            a = self.annotation_at(x, y)
+            if a is not None and self.canvas_button_press(a, event):
+                return True
+
         if event.button == 3:
             self.context_cb (timel=self, position=self.pixel2unit(x, absolute=True), height=y)
             return True
@@ -2503,6 +2750,13 @@ class TimeLine(AdhocView):
     def layout_button_release_cb(self, widget=None, event=None):
         """Handle mouse button release in timeline window.
         """
+        if self.canvas_press is not None:
+            # Release on a directly rendered annotation
+            b = self.canvas_press[0]
+            self.canvas_press = None
+            self.annotation_button_release_cb(b, event, b.annotation)
+            return True
+
         # Any click in the layout background unlocks the inspector
         self.locked_inspector = False
         self.locked_icon.hide()
@@ -2541,6 +2795,17 @@ class TimeLine(AdhocView):
                     self.unselect_all()
 
                 res=[]
+                if self.canvas:
+                    begin = self.pixel2unit(x1, absolute=True)
+                    end = self.pixel2unit(x2, absolute=True)
+                    index = self.controller.package.temporalIndex
+                    for at, pos in self.layer_position.items():
+                        if pos < y1 or pos + self.get_element_height(at) > y2:
+                            continue
+                        for a in index.annotations_in(begin, end, at, contained=True):
+                            if self.list_set is None or a in self.list_set:
+                                self.activate_annotation(a)
+                                res.append(a)
                 for widget in self.layout.get_children():
                     if not isinstance(widget, AnnotationWidget):
                         continue
@@ -2627,6 +2892,29 @@ class TimeLine(AdhocView):
             y = event.y
             state = event.get_state()
 
+        if self.canvas:
+            if self.canvas_press is not None and state & Gdk.ModifierType.BUTTON1_MASK:
+                b, px, py = self.canvas_press
+                cx, cy = self.get_canvas_pointer()
+                if self.layout.drag_check_threshold(px, py, cx, cy):
+                    # Start dragging the annotation
+                    self.canvas_press = None
+                    b._single_click_guard = False
+                    self.canvas_drag = b
+                    self.layout.drag_begin_with_coordinates(Gtk.TargetList.new(get_target_types(b.annotation)),
+                                                            Gdk.DragAction.LINK | Gdk.DragAction.COPY | Gdk.DragAction.MOVE,
+                                                            1, event,
+                                                            int(px - self.adjustment.get_value()),
+                                                            int(py - self.layout.get_vadjustment().get_value()))
+                return True
+            if not state & Gdk.ModifierType.BUTTON1_MASK:
+                # Like annotation widgets, the hovered annotation
+                # gets the focus, and keeps it over the background.
+                a = self.annotation_at(*self.get_canvas_pointer())
+                if a is not None:
+                    self.set_canvas_focus(a)
+                return True
+
         if state & Gdk.ModifierType.BUTTON1_MASK:
             # Display current time
             self.set_annotation(self.pixel2unit(self.adjustment.get_value() + x, absolute=True))
@@ -2901,6 +3189,8 @@ class TimeLine(AdhocView):
             self.old_scale_value = self.scale.get_value()
             # Reposition all buttons
             self.layout.foreach(move_widget)
+            if self.canvas:
+                self.layout.queue_draw()
             # Redraw marks
             self.scale_layout.foreach(self.scale_layout.remove)
             self.draw_marks ()
@@ -3828,6 +4118,8 @@ class TimeLine(AdhocView):
     def get_selected_annotation_widgets(self):
         """Return the list of currently active annotation widgets.
         """
+        if self.canvas:
+            return [ b for b in self.annotation_widgets.values() if b.active ]
         return [ w for w in self.layout.get_children() if isinstance(w, AnnotationWidget) and w.active ]
 
     def unselect_all(self, widget=None, selection=None):
@@ -478,6 +478,87 @@ class AnnotationWidget(GenericColorButtonWidget):
 
 GObject.type_register(AnnotationWidget)
 
+class AnnotationSprite(object):
+    """Lightweight representation of an annotation drawn by its container.
+
+    It is used by views which render the annotations themselves on a
+    canvas (see the timeline direct rendering). It provides the subset
+    of the AnnotationWidget API used by these views (activation, focus,
+    geometry, key bindings, drawing) without creating a Gtk widget.
+
+    The container must provide the get_annotation_rectangle,
+    get_canvas_pointer and redraw_annotation methods, and the layout
+    and canvas_focus attributes.
+    """
+    def __init__(self, annotation=None, container=None):
+        self.annotation=annotation
+        self.element=annotation
+        self.active=False
+        self._fraction_marker=None
+        self._single_click_guard=False
+        self.local_color=None
+        self.alpha=1.0
+        self.container=container
+        self.controller=container.controller
+        self.no_image_pixbuf=None
+
+    def set_fraction_marker(self, f):
+        self._fraction_marker = f
+        self.update_widget()
+    def get_fraction_marker(self):
+        return self._fraction_marker
+    fraction_marker = property(get_fraction_marker, set_fraction_marker)
+
+    def set_active(self, b):
+        self.active=b
+        self.update_widget()
+
+    def set_color(self, color=None):
+        self.local_color=color
+        self.update_widget()
+        return True
+
+    def update_widget(self, *p):
+        self.container.redraw_annotation(self.annotation)
+        return False
+
+    def needed_size(self):
+        return (self.container.unit2pixel(self.annotation.fragment.duration),
+                self.container.get_element_height(self.annotation))
+
+    def get_allocation(self):
+        """Return the annotation rectangle, in container coordinates.
+        """
+        return self.container.get_annotation_rectangle(self.annotation)
+
+    def get_pointer(self):
+        """Return the pointer position, relative to the annotation rectangle.
+        """
+        x, y = self.container.get_canvas_pointer()
+        r = self.get_allocation()
+        return (x - r.x, y - r.y)
+
+    def get_parent(self):
+        return self.container.layout
+
+    def is_focus(self):
+        return self.container.canvas_focus is self.annotation
+
+    def grab_focus(self):
+        self.container.set_canvas_focus(self.annotation)
+
+    def show(self):
+        pass
+    show_all = show
+
+    def destroy(self):
+        pass
+
+    # Behaviour shared with AnnotationWidget
+    _drag_begin = AnnotationWidget._drag_begin
+    keypress = AnnotationWidget.keypress
+    draw = AnnotationWidget.draw
+
 class AnnotationTypeWidget(GenericColorButtonWidget):
     """ Widget representing an annotation type
     """
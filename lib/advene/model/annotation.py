@@ -226,7 +226,10 @@ class Annotation(modeled.Importable, content.WithContent,
         """
         # ensure that relation objects have been created,
         # since it's them who populate self._relations
-        self.getRootPackage ().getRelations ()
+        # (with lazy bundles, members must also be the actual annotations)
+        package = self.getRootPackage ()
+        package.getAnnotations ().materialize ()
+        package.getRelations ().materialize ()
 
         if rank is None:
             if order is None:
@@ -57,6 +57,8 @@ Permitted dict operations are
 
 Note also that iter(b) iterates over its values (as for lists). Iterating over keys required the _iterkeys_ method.
 """
+from collections import OrderedDict
+
 import advene.model.util.uri
 
 import advene.model.modeled as modeled
@@ -228,6 +230,24 @@ class SumBundle (AbstractBundle):
         return self
 
 
+class InvalidatingObserver (object):
+    """
+    A bundle observer invoking a callback (without parameter) upon each
+    modification of the observed bundles.
+
+    It is used to invalidate values computed from the content of bundles.
+    """
+
+    def __init__ (self, callback):
+        self._callback = callback
+
+    def item_added (self, bundle, item):
+        self._callback ()
+
+    def item_removed (self, bundle, item):
+        self._callback ()
+
+
 class WritableBundle (AbstractBundle):
     """
     Superclass of read-write bundles.
@@ -242,6 +262,25 @@ class WritableBundle (AbstractBundle):
     def __init__ (self):
         self._list = []
         self._dict = {}
+        self._observers = []
+
+    #
+    # observers
+    #
+
+    def add_observer (self, observer):
+        """
+        Register an observer of the bundle modifications.
+
+        The observer must implement the methods item_added(bundle, item) and
+        item_removed(bundle, item), which are invoked after each insertion
+        and deletion.
+        """
+        if observer not in self._observers:
+            self._observers.append (observer)
+
+    def remove_observer (self, observer):
+        self._observers.remove (observer)
 
     #
     # list implementation
@@ -255,6 +294,8 @@ class WritableBundle (AbstractBundle):
             item = self._dict[index]
             self._list.remove (item)
             del self._dict[index]
+        for o in self._observers:
+            o.item_removed (self, item)
 
     def __delslice__(self, begin, end):
         length = len (self)
@@ -282,6 +323,15 @@ class WritableBundle (AbstractBundle):
 
         self._list.insert(index, item)
         self._dict[item.getUri (absolute=True)] = item
+        for o in self._observers:
+            o.item_added (self, item)
+
+    def extend (self, items):
+        """
+        Append all the given items at the end of the bundle.
+        """
+        for item in items:
+            self.append (item)
 
     def remove (self, item):
         uri = item.getUri (absolute=True)
@@ -388,6 +438,15 @@ class AbstractXmlBundle(WritableBundle, modeled.Modeled,
             assert uri not in self._dict, "item %s already in bundle" % item
             dict_append (uri, item)
 
+    def materialize (self):
+        """
+        Make sure that every item of the bundle has been created.
+
+        Items are created along with the bundle, so this is a no-op here, but
+        it is overridden by bundles creating their items on demand.
+        """
+        pass
+
     #
     # Viewable specific implementation
     #
@@ -436,6 +495,34 @@ class AbstractXmlBundle(WritableBundle, modeled.Modeled,
 
         super (AbstractXmlBundle, self).insert (index, item)
 
+    def extend (self, items):
+        """
+        Append all the given items at the end of the bundle.
+
+        This is equivalent to appending them one by one, but the position
+        of the XML elements is only looked up once.
+        """
+        items = list (items)
+        uris = [ item.getUri (absolute=True) for item in items ]
+        for item in items:
+            assert self._assert_add_item (item)
+        assert len (set (uris)) == len (uris), "same uri added twice"
+
+        elt_list = self._getModel ().childNodes
+        elements = [ self._get_element (item) for item in items ]
+        if len (self) == 0:
+            elt_list[0:0] = elements
+        else:
+            ref_elt = self._get_element (self._list[-1])
+            ref_index = elt_list.index (ref_elt) + 1
+            elt_list[ref_index:ref_index] = elements
+
+        self._list.extend (items)
+        self._dict.update (zip (uris, items))
+        for o in self._observers:
+            for item in items:
+                o.item_added (self, item)
+
 
     def _assert_add_item (self, item):
         assert ( item._getParent ().getRootPackage ()
@@ -487,6 +574,182 @@ class StandardXmlBundle(AbstractXmlBundle):
             return None
 
 
+class LazyXmlBundle(StandardXmlBundle):
+    """
+    A StandardXmlBundle which creates its items on demand.
+
+    The XML elements are only scanned when the bundle is built, so that
+    len(), ids(), keys() and uris() do not require any item. Items are
+    created on the first access by index or by URI, and kept in a cache of
+    at most _cache_size_ items (None means unbounded).
+
+    Any operation needing the whole list (slicing, values(), modifications...)
+    materializes the bundle, which then behaves as a StandardXmlBundle.
+    Note that an item evicted from the cache is created again on next access,
+    so that identity of items is only guaranteed once materialized.
+    """
+
+    def __init__ (self, parent, element, cls, cache_size=1024):
+        self.__cache_size = cache_size
+        self.__cache = OrderedDict ()
+        self.__elements = None
+        StandardXmlBundle.__init__ (self, parent, element, cls)
+
+    # _list and _dict are only built when materialized
+
+    def __get_list (self):
+        if self.__elements is not None:
+            self.materialize ()
+        return self.__list
+
+    def __set_list (self, value):
+        self.__list = value
+
+    _list = property (__get_list, __set_list)
+
+    def __get_dict (self):
+        if self.__elements is not None:
+            self.materialize ()
+        return self.__dict
+
+    def __set_dict (self, value):
+        self.__dict = value
+
+    _dict = property (__get_dict, __set_dict)
+
+    def _update (self):
+        """
+        Scan the model for matching elements, without creating any item.
+        """
+        self.__list = []
+        self.__dict = {}
+        self.__cache.clear ()
+
+        ns = self._get_namespace_uri ()
+        ln = self._get_local_name ()
+        base = self._getParent ().getUri (absolute=True)
+        push = advene.model.util.uri.push
+
+        self.__elements = [ e for e in self._getModelChildren ()
+                            if e.namespaceURI == ns and e.localName == ln ]
+        self.__uris = [ push (base, e.getAttributeNS (None, 'id'))
+                        for e in self.__elements ]
+        self.__positions = dict ( (u, i) for (i, u) in enumerate (self.__uris) )
+
+    def isMaterialized (self):
+        return self.__elements is None
+
+    def materialize (self):
+        """
+        Create all the items of the bundle, reusing the cached ones.
+        """
+        if self.__elements is None:
+            return
+        parent = self._getParent ()
+        make_item = self._make_item
+        cache = self.__cache
+        l = []
+        for (e, uri) in zip (self.__elements, self.__uris):
+            item = cache.get (uri)
+            if item is None:
+                item = make_item (parent, element=e)
+            l.append (item)
+        self.__list = l
+        self.__dict = dict (zip (self.__uris, l))
+        self.__elements = None
+        self.__uris = None
+        self.__positions = None
+        cache.clear ()
+
+    def __item (self, index):
+        """
+        Return the index'th item, creating it if necessary.
+        """
+        uri = self.__uris[index]
+        cache = self.__cache
+        item = cache.get (uri)
+        if item is None:
+            item = self._make_item (self._getParent (),
+                                    element=self.__elements[index])
+            cache[uri] = item
+            if (self.__cache_size is not None
+                and len (cache) > self.__cache_size):
+                cache.popitem (last=False)
+        else:
+            cache.move_to_end (uri)
+        return item
+
+    #
+    # lazy implementations of read-only methods
+    #
+
+    def __len__ (self):
+        if self.__elements is None:
+            return len (self.__list)
+        return len (self.__elements)
+
+    def __iter__ (self):
+        if self.__elements is None:
+            return iter (self.__list)
+        return self.__iter_lazy ()
+
+    def __iter_lazy (self):
+        for i in range (len (self)):
+            if self.__elements is None:
+                # materialized during iteration
+                yield self.__list[i]
+            else:
+                yield self.__item (i)
+
+    def __contains__ (self, v):
+        if self.__elements is None:
+            return super (LazyXmlBundle, self).__contains__ (v)
+        if isinstance (v, str):
+            return v in self.__positions
+        i = self.__positions.get (v.getUri (absolute=True))
+        return i is not None and self.__elements[i] is v._getModel ()
+
+    def __getitem__ (self, index):
+        if self.__elements is None or isinstance (index, slice):
+            return super (LazyXmlBundle, self).__getitem__ (index)
+        if isinstance (index, int):
+            if index < 0:
+                index += len (self.__elements)
+            if not 0 <= index < len (self.__elements):
+                raise IndexError (index)
+            return self.__item (index)
+        return self.__item (self.__positions[index])
+
+    def get (self, id_, default=None):
+        if self.__elements is None:
+            return self.__dict.get (id_, default)
+        i = self.__positions.get (id_)
+        if i is None:
+            return default
+        return self.__item (i)
+
+    def uris (self):
+        if self.__elements is None:
+            return list (self.__dict.keys ())
+        return self.__uris[:]
+
+    keys = uris
+
+    def iterkeys (self):
+        return iter (self.uris ())
+
+    def ids (self):
+        if self.__elements is None:
+            return super (LazyXmlBundle, self).ids ()
+        return [ e.getAttributeNS (None, 'id') for e in self.__elements ]
+
+    def get_by_id (self, id_):
+        if self.__elements is None:
+            return super (LazyXmlBundle, self).get_by_id (id_)
+        base = self._getParent ().getUri (absolute=True)
+        return self.get (advene.model.util.uri.push (base, id_))
+
+
 
 class ImportBundle (StandardXmlBundle):
     """
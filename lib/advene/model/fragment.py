@@ -16,6 +16,7 @@
 # along with Advene; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 #
+from array import array
 import time
 
 from advene.model.constants import adveneNS
@@ -96,6 +97,12 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
             assert begin is not None, "begin is required"
         modeled.Modeled.__init__(self, element, parent)
 
+        # Cached integer values of the begin and end attributes. They
+        # are read from the model on first access, and updated by
+        # setBegin/setEnd.
+        self._begin = None
+        self._end = None
+
         if begin is not None:
             assert end is not None or duration is not None, \
                    "end or duration is required"
@@ -120,16 +127,24 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
         return "Begin-End (%d,%d)" % (self.getBegin(), self.getEnd())
 
     def getBegin(self):
-        return int(self._getModel().getAttributeNS(None, 'begin'))
+        if self._begin is None:
+            self._begin = int(self._getModel().getAttributeNS(None, 'begin'))
+        return self._begin
 
     def setBegin(self, value):
-        return self._getModel().setAttributeNS(None, 'begin', str(int(value)))
+        value = int(value)
+        self._getModel().setAttributeNS(None, 'begin', str(value))
+        self._begin = value
 
     def getEnd(self):
-        return int(self._getModel().getAttributeNS(None, 'end'))
+        if self._end is None:
+            self._end = int(self._getModel().getAttributeNS(None, 'end'))
+        return self._end
 
     def setEnd(self, value):
-        return self._getModel().setAttributeNS(None, 'end', str(int(value)))
+        value = int(value)
+        self._getModel().setAttributeNS(None, 'end', str(value))
+        self._end = value
 
     def getDuration(self):
         return self.getEnd() - self.getBegin()
@@ -150,12 +165,12 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
             raise TypeError("Invalid comparison")
 
     def __contains__(self, other):
+        begin, end = self.getBegin(), self.getEnd()
         if type(self) == type(other):
-            return self.getBegin() <= other.getBegin() \
-                   and other.getEnd() <= self.getEnd()
+            return begin <= other.getBegin() and other.getEnd() <= end
         else:
             o = int(other)
-            return self.getBegin() <= o and o <= self.getEnd()
+            return begin <= o and o <= end
 
     def isOverlapping(self, other):
         if type(self) == type(other):
@@ -190,6 +205,8 @@ class AbstractNbeFragment (AbstractFragment, modeled.Modeled, metaclass=auto_pro
         parent = element.parentNode
         parent.replaceChild(new, element)
         # TODO: see how I can make this generic
+        # Note: __init__ resets the cached values, then setBegin/setEnd
+        # write them through to the new element.
         self.__init__(element=new, begin=self.getBegin(), end=self.getEnd())
 
 class ByteCountFragment(AbstractNbeFragment):
@@ -254,6 +271,25 @@ class MillisecondFragment(AbstractNbeFragment):
         return "Milliseconds (%s,%s)" % (self.format_time(self.getBegin()),
                                          self.format_time(self.getEnd()))
 
+def get_bounds(annotations):
+    """Return the begin and end times of the given annotations.
+
+    The result is a tuple (begins, ends) of two integer arrays, in the
+    order of the annotations iterable (typically a bundle). It is
+    meant for sorting and range queries over large sets of
+    annotations.
+
+    @param annotations: an iterable of annotations
+    @return: a tuple of 2 array.array('q')
+    """
+    begins = array('q')
+    ends = array('q')
+    for a in annotations:
+        f = a.getFragment()
+        begins.append(f.getBegin())
+        ends.append(f.getEnd())
+    return begins, ends
+
 class __UnknownFragment(AbstractFragment):
     """ An unkonw fragment is returned each time the fragment element is not
         recognized.
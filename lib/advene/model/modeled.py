@@ -64,20 +64,8 @@ class Modeled(object, metaclass=auto_properties):
            since only Element children are returned (and not, for example,
            Text children or Comment children).
         """
-        source = self.__model.childNodes
-        i = 0
-        start = -1
-        r = []
-        for e in self.__model.childNodes:
-            if e.nodeType == ELEMENT_NODE:
-                if start == -1: start = i
-            else:
-                r = r + source[start:i]
-                start = -1
-            i += 1
-        if start != -1:
-            r = r + source[start:]
-        return r
+        return [ e for e in self.__model.childNodes
+                 if e.nodeType == ELEMENT_NODE ]
 
     def _getChild(self, match=None, before=None, after=None):
         """Looks for the first Element child matching the parameters.
@@ -44,9 +44,12 @@ import advene.model.viewable as viewable
 from advene.model.zippackage import ZipPackage
 from advene.util.expat import PyExpat
 
-from advene.model.bundle import StandardXmlBundle, ImportBundle, InverseDictBundle, SumBundle
+from advene.model.bundle import StandardXmlBundle, LazyXmlBundle, ImportBundle, InverseDictBundle, SumBundle, InvalidatingObserver
 from advene.model.constants import adveneNS, xmlNS, xmlnsNS, xlinkNS, dcNS
 from advene.model.exception import AdveneException
+from advene.model.util.idindex import IdIndex
+from advene.model.util.temporalindex import TemporalIndex
+from advene.model.util.textindex import TextIndex
 
 # the following constant is used as a default value in in Package.__init__
 # to know whether the passed uri must be used to get a stream.
@@ -67,14 +70,21 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
     (schemas, types, annotations, relations, views, queries). It
     provides factory methods to create attached annotations, views, ..."""
 
-    def __init__(self, uri, source=_get_from_uri, importer=None):
+    def __init__(self, uri, source=_get_from_uri, importer=None, lazy=False):
         """Calling the constructor with just a URI tries to read the package
            from this URI. This can be overidden by providing explicitly the
            source parameter (a URL or a stream).
            Providing None for the source parameter creates a new Package.
+           If lazy is True, annotations and relations are only created
+           when accessed (see bundle.LazyXmlBundle).
         """
         self.meta_cache={}
+        # Modification counter, incremented by the controller on each
+        # modifying event
+        self.generation = 0
+        self.__lazy = lazy
         self.__uri = str(uri)
+        self.__uri_cache = None
         self.__importer = importer
         # Possible container
         self.__zip = None
@@ -129,6 +139,12 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
         self.__relations = None
         self.__schemas = None
         self.__views = None
+        self.__temporal_index = None
+        self.__id_index = None
+        self.__text_index = None
+        self.__annotation_types = None
+        self.__relation_types = None
+        self.__types_observer = InvalidatingObserver(self.__invalidate_types)
 
     def close(self):
         if self.__zip:
@@ -199,20 +215,27 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
         if not absolute and context is self:
             return ''
 
-        elements = urlparse(uri)
-        if elements.scheme == 'file' or elements.scheme == '':
-            # This is a file. Keep only the local path.
-
-            # win32 hack: there is a bug in pathlib:
-            # urlparse(Path(path).as_uri()) does not return path
-            # (c:/...) but /c:/...
-            path = elements.path
-            if re.search('^/[A-Za-z]:', path):
-                path = path[1:]
-            if absolute:
-                uri = Path(path).absolute().as_uri()
-            else:
-                uri = Path(path).as_uri()
+        # Resolving file paths is costly, and this method is called
+        # for the URI of every element: cache the last result.
+        key = (uri, absolute, os.getcwd() if absolute else None)
+        if self.__uri_cache is not None and self.__uri_cache[0] == key:
+            uri = self.__uri_cache[1]
+        else:
+            elements = urlparse(uri)
+            if elements.scheme == 'file' or elements.scheme == '':
+                # This is a file. Keep only the local path.
+
+                # win32 hack: there is a bug in pathlib:
+                # urlparse(Path(path).as_uri()) does not return path
+                # (c:/...) but /c:/...
+                path = elements.path
+                if re.search('^/[A-Za-z]:', path):
+                    path = path[1:]
+                if absolute:
+                    uri = Path(path).absolute().as_uri()
+                else:
+                    uri = Path(path).as_uri()
+            self.__uri_cache = (key, uri)
         importer = self.__importer
         if importer is not None:
             uri = urljoin (importer.getUri (absolute, context), uri)
@@ -242,13 +265,37 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
             self.__imports = InverseDictBundle (self, e, Import, Import.getAlias)
         return self.__imports
 
+    def __make_bundle(self, element, cls):
+        if self.__lazy:
+            return LazyXmlBundle(self, element, cls)
+        else:
+            return StandardXmlBundle(self, element, cls)
+
+    def isLazy(self):
+        return self.__lazy
+
     def getAnnotations(self):
         """Return a collection of this package's annotations"""
         if self.__annotations is None:
             e = self._getChild((adveneNS, "annotations"))
-            self.__annotations = StandardXmlBundle(self, e, annotation.Annotation)
+            self.__annotations = self.__make_bundle(e, annotation.Annotation)
         return self.__annotations
 
+    def getTemporalIndex(self):
+        """Return the temporal index of this package's annotations"""
+        if self.__temporal_index is None:
+            self.__temporal_index = TemporalIndex(self)
+            self.getAnnotations().add_observer(self.__temporal_index)
+        return self.__temporal_index
+
+    def getTextIndex(self):
+        """Return the full-text index of this package's annotations and relations"""
+        if self.__text_index is None:
+            self.__text_index = TextIndex(self)
+            self.getAnnotations().add_observer(self.__text_index)
+            self.getRelations().add_observer(self.__text_index)
+        return self.__text_index
+
     def getRelations(self):
         """Return a collection of this package's relations"""
         if self.__relations is None:
@@ -256,7 +303,7 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
             # yes, "annotations"!
             #relations are under the same element as annotations
             # FIXME: is this always the case ?
-            self.__relations = StandardXmlBundle(self, e, annotation.Relation)
+            self.__relations = self.__make_bundle(e, annotation.Relation)
         return self.__relations
 
     def getSchemas(self):
@@ -280,19 +327,32 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
             self.__queries = ImportBundle(self, e, query.Query)
         return self.__queries
 
-    def getAnnotationTypes (self):
-        """Return a collection of this package's annotation types"""
+    def __invalidate_types(self):
+        self.__annotation_types = None
+        self.__relation_types = None
+
+    def __sum_types(self, getter):
+        # The sum is cached until a schema or a type is added or removed
+        schemas = self.getSchemas()
+        schemas.add_observer(self.__types_observer)
         r = SumBundle ()
-        for s in self.getSchemas ():
-            r += s.getAnnotationTypes ()
+        for s in schemas:
+            b = getter(s)
+            b.add_observer(self.__types_observer)
+            r += b
         return r
 
+    def getAnnotationTypes (self):
+        """Return a collection of this package's annotation types"""
+        if self.__annotation_types is None:
+            self.__annotation_types = self.__sum_types(schema.Schema.getAnnotationTypes)
+        return self.__annotation_types
+
     def getRelationTypes(self):
         """Return a collection of this package's relation types"""
-        r = SumBundle ()
-        for s in self.getSchemas ():
-            r += s.getRelationTypes ()
-        return r
+        if self.__relation_types is None:
+            self.__relation_types = self.__sum_types(schema.Schema.getRelationTypes)
+        return self.__relation_types
 
     def getResources(self):
         if self.__zip is None:
@@ -300,17 +360,79 @@ class Package(modeled.Modeled, viewable.Viewable.withClass('package'),
         else:
             return self.__zip.getResources(package=self)
 
+    def getIdIndex(self):
+        """Return the index of this package's elements"""
+        if self.__id_index is None:
+            self.__id_index = IdIndex(self)
+        return self.__id_index
+
     def get_element_by_id(self, i):
         if not i:
             return None
-        uri=self.uri
-        for m in (self.getSchemas, self.getViews, self.getAnnotationTypes,
-                  self.getRelationTypes, self.getAnnotations, self.getQueries,
-                  self.getRelations):
-            el=m().get( '#'.join( (uri, i) ), None )
-            if el is not None:
-                return el
-        return None
+        return self.getIdIndex().get_by_id(i)
+
+    def create_annotations(self, records):
+        """Create annotations in bulk and append them to the package.
+
+        records is an iterable of dictionaries with the following keys:
+          - type (required): an annotation type of the package
+          - begin, end (required): the fragment bounds in ms
+          - id: if missing, a new id is generated
+          - content: the content data
+          - author, date
+
+        This is equivalent to createAnnotation + annotations.append for
+        each record, but the XML elements are built directly and added
+        to the annotations bundle in one pass.
+
+        An AdveneException is raised if a type is not imported or an
+        id is already used. The package is then left unmodified.
+
+        Return the list of created annotations.
+        """
+        doc = self._getDocument()
+        createElementNS = doc.createElementNS
+        type_uris = {}
+        ids = set()
+        counter = len(self.getAnnotations())
+        result = []
+        for r in records:
+            type_ = r['type']
+            type_uri = type_uris.get(type_)
+            if type_uri is None:
+                if type_ not in self.getAnnotationTypes():
+                    raise AdveneException("%s is not imported" % type_.getUri ())
+                type_uri = type_uris[type_] = type_.getUri(absolute=False, context=self)
+            ident = r.get('id')
+            if ident is not None and (ident in ids or self.get_element_by_id(ident) is not None):
+                # Importers may refer to the annotations by their id
+                raise AdveneException("The identifier %s is already used" % ident)
+            if ident is None:
+                ident = "a%d" % counter
+                while ident in ids or self.get_element_by_id(ident) is not None:
+                    counter += 1
+                    ident = "a%d" % counter
+            ids.add(ident)
+
+            e = createElementNS(adveneNS, 'annotation')
+            e.setAttributeNS(None, 'type', type_uri)
+            e.setAttributeNS(None, 'id', str(ident))
+            if r.get('author'):
+                e.setAttributeNS(dcNS, 'dc:creator', r['author'])
+            if r.get('date') is not None:
+                e.setAttributeNS(dcNS, 'dc:date', str(r['date']))
+            f = createElementNS(adveneNS, 'millisecond-fragment')
+            f.setAttributeNS(None, 'begin', str(int(r['begin'])))
+            f.setAttributeNS(None, 'end', str(int(r['end'])))
+            e.appendChild(f)
+
+            a = annotation.Annotation(self, element=e)
+            a._cached_type = type_
+            if r.get('content'):
+                a.getContent().setData(r['content'])
+            result.append(a)
+        self.getAnnotations().extend(result)
+        return result
 
     def generate_statistics(self):
         """Generate the statistics.xml file.
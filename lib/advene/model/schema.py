@@ -189,10 +189,8 @@ class AnnotationType(AbstractType,
     getLocalName = staticmethod(getLocalName)
 
     def getAnnotations (self):
-        # FIXME: return an iterator instead of a full fledged list
-        return sorted((a for a in self.getRootPackage ().getAnnotations ()
-                       if a.getType() == self),
-                      key=lambda a: a.fragment.begin)
+        """Return the annotations of this type, sorted by begin time."""
+        return self.getRootPackage ().getTemporalIndex ().annotations_of_type (self)
 
 class RelationType(AbstractType,
                    viewable.Viewable.withClass('relation-type')):
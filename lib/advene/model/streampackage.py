@@ -0,0 +1,533 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Read-only packages loaded with a streaming parser.
+
+The standard L{advene.model.package.Package} builds a complete
+xml.dom.minidom tree of the package, every model object being a view
+over this tree. For large packages, this is both slow and memory
+hungry.
+
+A L{StreamPackage} parses the package (.xml or .azp) with
+xml.etree.ElementTree.iterparse, and converts each element into a
+compact record (using __slots__) as soon as it is parsed, discarding
+the XML element. It offers the reading part of the Package API:
+annotations, relations, annotationTypes, relationTypes, schemas,
+views, queries, metadata, get_element_by_id...
+
+It is meant for batch tools (statistics, indexing, exports) that do
+not modify the package. Elements from imported packages are not
+resolved. To modify or serialize the package, use L{materialize},
+which loads the standard DOM-based Package from the same source.
+
+Typical use::
+
+  p = StreamPackage('foo.azp')
+  for a in p.annotationTypes['#'.join((p.uri, 'shot'))].annotations:
+      print(a.id, a.fragment.begin, a.content.data)
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+from pathlib import Path
+import re
+import urllib.parse
+import urllib.request
+from urllib.request import urlopen
+import xml.etree.ElementTree as ET
+import zipfile
+
+import advene.core.config as config
+from advene.model.bundle import ListBundle
+from advene.model.constants import adveneNS, dcNS, xlinkNS
+from advene.model.util.uri import urljoin
+
+def _tag(name, ns=adveneNS):
+    return '{%s}%s' % (ns, name)
+
+TAG_ANNOTATION = _tag('annotation')
+TAG_RELATION = _tag('relation')
+TAG_SCHEMA = _tag('schema')
+TAG_ANNOTATION_TYPE = _tag('annotation-type')
+TAG_RELATION_TYPE = _tag('relation-type')
+TAG_VIEW = _tag('view')
+TAG_QUERY = _tag('query')
+TAG_IMPORT = _tag('import')
+TAG_META = _tag('meta')
+TAG_CONTENT = _tag('content')
+TAG_CONTENT_TYPE = _tag('content-type')
+TAG_MEMBER = _tag('member')
+TAG_MILLISECOND_FRAGMENT = _tag('millisecond-fragment')
+TAG_BYTECOUNT_FRAGMENT = _tag('bytecount-fragment')
+TAG_PACKAGE = _tag('package')
+
+ATTR_CREATOR = '{%s}creator' % dcNS
+ATTR_DATE = '{%s}date' % dcNS
+ATTR_TITLE = '{%s}title' % dcNS
+ATTR_HREF = '{%s}href' % xlinkNS
+
+# Shared by all records without metadata
+_no_meta = {}
+
+def _parse_meta(elem):
+    """Return the metadata dict of the given element.
+
+    Keys are (namespace_uri, name) tuples, values are text contents.
+    """
+    meta = elem.find(TAG_META)
+    if meta is None or len(meta) == 0:
+        return _no_meta
+    res = {}
+    for m in meta:
+        if m.tag.startswith('{'):
+            ns, name = m.tag[1:].split('}', 1)
+        else:
+            ns, name = None, m.tag
+        res[(ns, name)] = ''.join(m.itertext())
+    return res
+
+class StreamFragment(object):
+    """Numerical begin-end fragment record.
+    """
+    __slots__ = ('begin', 'end')
+
+    def __init__(self, begin, end):
+        self.begin = begin
+        self.end = end
+
+    def getBegin(self):
+        return self.begin
+
+    def getEnd(self):
+        return self.end
+
+    @property
+    def duration(self):
+        return self.end - self.begin
+
+    def __contains__(self, other):
+        if isinstance(other, StreamFragment):
+            return self.begin <= other.begin and other.end <= self.end
+        o = int(other)
+        return self.begin <= o <= self.end
+
+    def __repr__(self):
+        return "<StreamFragment(%d,%d)>" % (self.begin, self.end)
+
+class StreamContent(object):
+    """Content record.
+    """
+    __slots__ = ('data', '_mimetype', 'href', '_parent')
+
+    def __init__(self, parent, elem):
+        self._parent = parent
+        if elem is None:
+            self.data = ''
+            self._mimetype = None
+            self.href = None
+        else:
+            self.data = ''.join(elem.itertext())
+            self._mimetype = elem.get('mime-type')
+            self.href = elem.get(ATTR_HREF)
+
+    @property
+    def mimetype(self):
+        if self._mimetype is not None:
+            return self._mimetype
+        t = getattr(self._parent, 'type', None)
+        return getattr(t, 'mimetype', None)
+
+    def getData(self):
+        return self.data
+
+class _Record(object):
+    """Common superclass of all package element records.
+    """
+    __slots__ = ('id', 'author', 'date', 'meta', 'ownerPackage')
+
+    viewableClass = None
+
+    def __init__(self, package, elem):
+        self.ownerPackage = package
+        self.id = elem.get('id')
+        self.author = elem.get(ATTR_CREATOR)
+        self.date = elem.get(ATTR_DATE)
+        self.meta = _parse_meta(elem)
+
+    def __repr__(self):
+        return "<%s.%s('%s')>" % (self.__class__.__module__,
+                                  self.__class__.__name__,
+                                  self.getUri())
+
+    def getId(self):
+        return self.id
+
+    def getUri(self, absolute=True, context=None):
+        return '#'.join( (self.ownerPackage.uri, self.id) )
+
+    uri = property(getUri)
+
+    @property
+    def rootPackage(self):
+        return self.ownerPackage
+
+    def getMetaData(self, namespace_uri, name):
+        return self.meta.get( (namespace_uri, name) )
+
+    def listMetaData(self):
+        return [ (ns, name, value) for ((ns, name), value) in self.meta.items() ]
+
+    @property
+    def title(self):
+        return self.meta.get( (dcNS, 'title') )
+
+    @property
+    def tags(self):
+        tagmeta = self.meta.get( (adveneNS, 'tags') )
+        if tagmeta is None:
+            return []
+        return [ urllib.parse.unquote(t) for t in tagmeta.split(',') ]
+
+    def hasTag(self, tag):
+        return tag in self.tags
+
+class StreamAnnotation(_Record):
+    __slots__ = ('type', 'fragment', 'content', 'relations')
+
+    viewableClass = 'annotation'
+
+    def __init__(self, package, elem):
+        super(StreamAnnotation, self).__init__(package, elem)
+        # Resolved into a type record at the end of the parsing
+        self.type = elem.get('type')
+        self.relations = []
+        f = elem.find(TAG_MILLISECOND_FRAGMENT)
+        if f is None:
+            f = elem.find(TAG_BYTECOUNT_FRAGMENT)
+        if f is None:
+            self.fragment = None
+        else:
+            self.fragment = StreamFragment(int(f.get('begin')), int(f.get('end')))
+        self.content = StreamContent(self, elem.find(TAG_CONTENT))
+
+    def getType(self):
+        return self.type
+
+    def getFragment(self):
+        return self.fragment
+
+    def getContent(self):
+        return self.content
+
+    @property
+    def annotationType(self):
+        return self.type
+
+class StreamRelation(_Record):
+    __slots__ = ('type', 'members', 'content')
+
+    viewableClass = 'relation'
+
+    def __init__(self, package, elem):
+        super(StreamRelation, self).__init__(package, elem)
+        self.type = elem.get('type')
+        # Resolved into annotation records at the end of the parsing
+        self.members = [ m.get(ATTR_HREF) for m in elem.iter(TAG_MEMBER) ]
+        self.content = StreamContent(self, elem.find(TAG_CONTENT))
+
+    def getType(self):
+        return self.type
+
+    def getContent(self):
+        return self.content
+
+class _StreamType(_Record):
+    __slots__ = ('schema', 'mimetype', '_title')
+
+    def __init__(self, package, elem, schema):
+        super(_StreamType, self).__init__(package, elem)
+        self.schema = schema
+        self._title = elem.get(ATTR_TITLE)
+        ct = elem.find(TAG_CONTENT_TYPE)
+        self.mimetype = None if ct is None else ct.get('mime-type')
+
+    @property
+    def title(self):
+        return self._title or self.meta.get( (dcNS, 'title') )
+
+class StreamAnnotationType(_StreamType):
+    __slots__ = ('annotations', )
+
+    viewableClass = 'annotation-type'
+
+    def __init__(self, package, elem, schema):
+        super(StreamAnnotationType, self).__init__(package, elem, schema)
+        self.annotations = []
+
+class StreamRelationType(_StreamType):
+    __slots__ = ('relations', )
+
+    viewableClass = 'relation-type'
+
+    def __init__(self, package, elem, schema):
+        super(StreamRelationType, self).__init__(package, elem, schema)
+        self.relations = []
+
+class StreamSchema(_Record):
+    __slots__ = ('annotationTypes', 'relationTypes', '_title')
+
+    viewableClass = 'schema'
+
+    def __init__(self, package, elem):
+        super(StreamSchema, self).__init__(package, elem)
+        self._title = elem.get(ATTR_TITLE)
+        self.annotationTypes = [ StreamAnnotationType(package, e, self)
+                                 for e in elem.iter(TAG_ANNOTATION_TYPE) ]
+        self.relationTypes = [ StreamRelationType(package, e, self)
+                               for e in elem.iter(TAG_RELATION_TYPE) ]
+
+    @property
+    def title(self):
+        return self._title or self.meta.get( (dcNS, 'title') )
+
+class _StreamContentElement(_Record):
+    __slots__ = ('content', 'attributes')
+
+    def __init__(self, package, elem):
+        super(_StreamContentElement, self).__init__(package, elem)
+        self.attributes = dict(elem.attrib)
+        self.content = StreamContent(self, elem.find(TAG_CONTENT))
+
+    @property
+    def title(self):
+        return self.attributes.get(ATTR_TITLE) or self.meta.get( (dcNS, 'title') )
+
+class StreamView(_StreamContentElement):
+    __slots__ = ()
+
+    viewableClass = 'view'
+
+    @property
+    def matchFilter(self):
+        return { 'class': self.attributes.get('viewable-class'),
+                 'type': self.attributes.get('viewable-type') }
+
+class StreamQuery(_StreamContentElement):
+    __slots__ = ()
+
+    viewableClass = 'query'
+
+class StreamPackage(object):
+    """Read-only package loaded with a streaming parser.
+
+    See the module documentation.
+    """
+    viewableClass = 'package'
+
+    def __init__(self, uri, source=None):
+        """Load the package from the given URI or filename.
+
+        If source is given (filename or stream), it is used to read
+        the data instead of uri.
+        """
+        self.uri = self.__absolute_uri(uri)
+        self._source = source
+        self.meta = _no_meta
+        self.attributes = {}
+        self.imports = []
+        annotations = []
+        relations = []
+        schemas = []
+        views = []
+        queries = []
+
+        handlers = {
+            TAG_ANNOTATION: (StreamAnnotation, annotations),
+            TAG_RELATION: (StreamRelation, relations),
+            TAG_SCHEMA: (StreamSchema, schemas),
+            TAG_VIEW: (StreamView, views),
+            TAG_QUERY: (StreamQuery, queries),
+            }
+        stream = self.__open(source if source is not None else uri)
+        try:
+            # Stack of the currently open elements
+            stack = []
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                depth = len(stack)
+                if depth == 2 and elem.tag in handlers:
+                    # package/<container>/<element>
+                    cls, l = handlers[elem.tag]
+                    l.append(cls(self, elem))
+                    stack[-1].remove(elem)
+                elif depth == 2 and elem.tag == TAG_IMPORT:
+                    self.imports.append( (elem.get('as'), elem.get(ATTR_HREF)) )
+                elif depth == 1 and elem.tag == TAG_META:
+                    self.meta = _parse_meta(stack[0])
+                elif depth == 0:
+                    self.attributes = dict(elem.attrib)
+                    elem.clear()
+        finally:
+            stream.close()
+
+        self.__resolve(annotations, relations, schemas)
+        self.annotations = ListBundle(annotations)
+        self.relations = ListBundle(relations)
+        self.schemas = ListBundle(schemas)
+        self.annotationTypes = ListBundle([ at for s in schemas for at in s.annotationTypes ])
+        self.relationTypes = ListBundle([ rt for s in schemas for rt in s.relationTypes ])
+        self.views = ListBundle(views)
+        self.queries = ListBundle(queries)
+        self.__ids = None
+
+    def __absolute_uri(self, uri):
+        uri = str(uri)
+        if re.match('[a-zA-Z]:', uri) or not re.match('[a-zA-Z]+:', uri):
+            # Filename. Use the same form as Package.getUri
+            return Path(uri).absolute().as_uri()
+        return uri
+
+    def __open(self, source):
+        """Return a stream giving access to the package XML data.
+        """
+        if hasattr(source, 'read'):
+            return source
+        source = str(source)
+        if source.startswith('file:'):
+            source = urllib.request.url2pathname(urllib.parse.urlparse(source).path)
+        if re.match('[a-zA-Z]+:', source) and not re.match('[a-zA-Z]:', source):
+            # Remote URL
+            if source.lower().endswith('.azp'):
+                raise ValueError("Remote .azp packages are not supported")
+            return urlopen(source)
+        if source.lower().endswith('.azp'):
+            z = zipfile.ZipFile(source)
+            f = z.open('content.xml')
+            # ZipExtFile does not close its ZipFile
+            z.close()
+            return f
+        return open(source, 'rb')
+
+    def __resolve(self, annotations, relations, schemas):
+        """Resolve references (types, members) into records.
+        """
+        uri = self.uri
+        def absolute(ref):
+            if ref.startswith('#'):
+                return uri + ref
+            return urljoin(uri, ref)
+
+        types = dict( (at.uri, at) for s in schemas for at in s.annotationTypes )
+        for a in annotations:
+            t = types.get(absolute(a.type))
+            if t is None:
+                logger.debug("Unresolved annotation type %s", a.type)
+            else:
+                a.type = t
+                t.annotations.append(a)
+        for t in types.values():
+            t.annotations.sort(key=lambda a: a.fragment.begin)
+
+        types = dict( (rt.uri, rt) for s in schemas for rt in s.relationTypes )
+        annotations_by_uri = dict( (a.uri, a) for a in annotations )
+        for r in relations:
+            t = types.get(absolute(r.type))
+            if t is not None:
+                r.type = t
+                t.relations.append(r)
+            members = []
+            for m in r.members:
+                a = annotations_by_uri.get(absolute(m))
+                if a is not None:
+                    a.relations.append(r)
+                    members.append(a)
+                else:
+                    members.append(m)
+            r.members = members
+
+    def __str__(self):
+        return "StreamPackage (%s)" % self.uri
+
+    def getUri(self, absolute=True, context=None):
+        return self.uri
+
+    def getOwnerPackage(self):
+        return self
+
+    ownerPackage = property(getOwnerPackage)
+    rootPackage = property(getOwnerPackage)
+
+    def getAnnotations(self):
+        return self.annotations
+
+    def getMetaData(self, namespace_uri, name):
+        return self.meta.get( (namespace_uri, name) )
+
+    def listMetaData(self):
+        return [ (ns, name, value) for ((ns, name), value) in self.meta.items() ]
+
+    def getMedia(self):
+        return self.getMetaData(config.data.namespace, 'mediafile') or ""
+
+    @property
+    def title(self):
+        return self.attributes.get(ATTR_TITLE) or self.meta.get( (dcNS, 'title') )
+
+    @property
+    def author(self):
+        return self.attributes.get(ATTR_CREATOR)
+
+    @property
+    def date(self):
+        return self.attributes.get(ATTR_DATE)
+
+    def get_element_by_id(self, i):
+        if not i:
+            return None
+        if self.__ids is None:
+            ids = {}
+            # Same precedence as Package.get_element_by_id (see
+            # advene.model.util.idindex): the first element wins.
+            for l in (self.schemas, self.views,
+                      self.annotationTypes, self.relationTypes,
+                      self.annotations, self.queries, self.relations):
+                for e in l:
+                    ids.setdefault(e.id, e)
+            self.__ids = ids
+        return self.__ids.get(i)
+
+    def materialize(self):
+        """Return the standard (DOM-based) Package for the same data.
+
+        The package is loaded again from its source.
+        """
+        from advene.model.package import Package
+        if self._source is None or hasattr(self._source, 'read'):
+            return Package(uri=self.uri)
+        return Package(uri=self.uri, source=self._source)
+
+    def save(self, name=None):
+        """Save the package, through its DOM materialisation.
+        """
+        self.materialize().save(name)
+
+    def close(self):
+        pass
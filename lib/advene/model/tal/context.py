@@ -20,8 +20,12 @@ import logging
 logger = logging.getLogger(__name__)
 
 import copy
+import functools
+import hashlib
+import threading
 
-from io import StringIO
+from collections import OrderedDict
+from io import BytesIO, StringIO
 
 from simpletal import simpleTAL
 from simpletal import simpleTALES
@@ -54,6 +58,83 @@ class DebugLogger:
 
 debuglogger_singleton = DebugLogger()
 
+class TemplateCache(object):
+        """LRU cache of compiled templates.
+
+        Templates are identified by an optional key (for views, their
+        URI), their kind (XML or HTML) and a hash of their source, so
+        that a modified source is recompiled. The entries for a given
+        key can be removed with invalidate (the controller does it on
+        ViewEditEnd and ViewDelete).
+        """
+        def __init__(self, size=256):
+            self.size = size
+            self._templates = OrderedDict()
+            # The webserver interprets views in its own threads
+            self._lock = threading.Lock()
+            self.hits = 0
+            self.misses = 0
+
+        def get(self, source, key=None, html=False, encoding='utf-8'):
+            """Return the compiled template for source.
+
+            source can be a string, bytes or a stream.
+            """
+            if not isinstance(source, (str, bytes)):
+                source = source.read()
+            data = source.encode('utf-8') if isinstance(source, str) else source
+            k = (key, html, hashlib.sha1(data).digest())
+            with self._lock:
+                template = self._templates.get(k)
+                if template is not None:
+                    self._templates.move_to_end(k)
+                    self.hits += 1
+                    return template
+                self.misses += 1
+            if html:
+                compiler = simpleTAL.HTMLTemplateCompiler ()
+                compiler.log = debuglogger_singleton
+                compiler.parseTemplate (BytesIO(data), encoding)
+            else:
+                compiler = simpleTAL.XMLTemplateCompiler ()
+                compiler.log = debuglogger_singleton
+                compiler.parseTemplate (StringIO(source) if isinstance(source, str) else BytesIO(data))
+            template = compiler.getTemplate ()
+            with self._lock:
+                self._templates[k] = template
+                while len(self._templates) > self.size:
+                    self._templates.popitem(last=False)
+            return template
+
+        def invalidate(self, key=None):
+            """Remove the templates for the given key, or all of them if key is None.
+            """
+            with self._lock:
+                if key is None:
+                    self._templates.clear()
+                else:
+                    for k in [ k for k in self._templates if k[0] == key ]:
+                        del self._templates[k]
+
+        def stats(self):
+            """Return a dict with the cache statistics.
+            """
+            total = self.hits + self.misses
+            return {
+                'size': self.size,
+                'count': len(self._templates),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+        def stats_repr(self):
+            st = self.stats()
+            st['hit_rate'] *= 100
+            return "Template cache: %(count)d/%(size)d templates, %(hits)d hits, %(misses)d misses (%(hit_rate).0f%% hit rate)" % st
+
+template_cache = TemplateCache()
+
 class NoCallVariable(simpleTALES.ContextVariable):
         """Not callable variable.
 
@@ -64,6 +145,178 @@ class NoCallVariable(simpleTALES.ContextVariable):
         def value (self, currentPath=None):
                 return self.ourValue
 
+class CompiledPath(object):
+    """TALES path, parsed once.
+
+    Its traversal is equivalent to L{_advene_context.traversePath}, but
+    the path is only split once, and the attribute access strategy of
+    each step is memoised per type of traversed object, so that
+    properties are not evaluated twice (hasattr then getattr).
+    """
+    def __init__(self, expr):
+        # Check for and correct for trailing/leading quotes
+        if (expr.startswith ('"') or expr.startswith ("'")):
+            if (expr.endswith ('"') or expr.endswith ("'")):
+                expr = expr [1:-1]
+            else:
+                expr = expr [1:]
+        elif (expr.endswith ('"') or expr.endswith ("'")):
+            expr = expr [0:-1]
+        self.expr = expr
+        self.pathList = expr.split('/')
+        # Dereferenced path elements are left to traversePath
+        self.dynamic = any(p.startswith('?') for p in self.pathList)
+        steps = []
+        for path in self.pathList[1:]:
+            try:
+                number = int(path)
+            except ValueError:
+                number = None
+            # The set holds the types which define path as a class
+            # attribute (property or method).
+            steps.append( (path, number, set()) )
+        self.steps = steps
+
+    def traverse(self, context, canCall=1):
+        if self.dynamic:
+            return context.traversePath(self.expr, canCall)
+        pathList = self.pathList
+        path = pathList[0]
+        if path in context.locals:
+            val = context.locals[path]
+        elif path in context.globals:
+            val = context.globals[path]
+        else:
+            # If we can't find it then raise an exception
+            raise simpleTALES.PathNotFoundException() from None
+
+        resolved_stack = [ (path, val) ]
+        # Locals are only pushed if a method (which may need the
+        # resolved stack) is called.
+        pushed = False
+        namespaces = None
+        namespaces_per_object = False
+        methods = context.methods
+        index = 1
+        try:
+            for (path, number, attribute_types) in self.steps:
+                try:
+                    if (isinstance (val, simpleTALES.ContextVariable)): temp = val.value((index, pathList))
+                    elif (callable (val)):temp = val(*())
+                    else: temp = val
+                except simpleTALES.ContextVariable as e:
+                    # Fast path for those functions that return values
+                    return e.value()
+
+                val = None
+                method = methods.get(path)
+                if method is not None:
+                    if not pushed:
+                        context.pushLocals()
+                        context.setLocal('__resolved_stack', resolved_stack)
+                        pushed = True
+                    val = method(temp, context)
+                if val is None and hasattr(temp, 'getQName'):
+                    if namespaces is None:
+                        namespaces = context.getNamespaces(temp)
+                        if context.getNamespaceReference() is None:
+                            # The namespaces depend on each object
+                            namespaces_per_object = True
+                    elif namespaces_per_object:
+                        namespaces = context.getNamespaces(temp)
+                    val = temp.getQName (path, namespaces, None)
+                if val is None:
+                    cls = type(temp)
+                    found = False
+                    if cls in attribute_types or hasattr(temp, path):
+                        try:
+                            val = getattr(temp, path)
+                            found = True
+                            if hasattr(cls, path):
+                                attribute_types.add(cls)
+                        except AttributeError:
+                            pass
+                    if not found:
+                        try:
+                            val = temp[path]
+                        except (TypeError, KeyError):
+                            if number is None:
+                                raise simpleTALES.PathNotFoundException() from None
+                            try:
+                                val = temp[number]
+                            except:
+                                raise simpleTALES.PathNotFoundException() from None
+                # Advene hook: stack resolution
+                resolved_stack.insert(0, (path, val) )
+                index = index + 1
+        finally:
+            if pushed:
+                context.popLocals()
+
+        if (canCall):
+            try:
+                if (isinstance (val, simpleTALES.ContextVariable)):
+                    result = val.value((index,pathList))
+                    # Advene hook: introduced by the NoCallVariable
+                    if callable(result):
+                        result = val.value((index, pathList))(*())
+                elif (callable (val)):result = val(*())
+                else: result = val
+            except simpleTALES.ContextVariable as e:
+                # Fast path for those functions that return values
+                return e.value()
+        else:
+            if (isinstance (val, simpleTALES.ContextVariable)): result = val.realValue
+            else: result = val
+        return result
+
+class CompiledExpression(object):
+    """TALES expression, parsed once.
+
+    Path expressions (possibly with alternatives) are evaluated through
+    L{CompiledPath}, other ones (string:, python:...) through the
+    standard evaluate method.
+
+    Use L{compile_expression} to get cached instances.
+    """
+    def __init__(self, expr):
+        expr = expr.strip()
+        self.expr = expr
+        self.path = None
+        self.alternatives = None
+        if expr.startswith('path:'):
+            body = expr[5:].lstrip()
+        elif expr.startswith( ('exists:', 'nocall:', 'not:', 'string:', 'python:') ):
+            body = None
+        else:
+            body = expr
+        if body is not None:
+            paths = body.split('|')
+            if len(paths) > 1:
+                self.alternatives = [ compile_expression(p.strip()) for p in paths ]
+            else:
+                self.path = CompiledPath(paths[0])
+
+    def evaluate(self, context):
+        if self.path is not None:
+            return self.path.traverse(context)
+        elif self.alternatives is not None:
+            for path in self.alternatives:
+                try:
+                    return path.evaluate(context)
+                except simpleTALES.PathNotFoundException:
+                    # Path didn't exist, try the next one
+                    pass
+            raise simpleTALES.PATHNOTFOUNDEXCEPTION
+        else:
+            return context.evaluate(self.expr)
+
+@functools.lru_cache(maxsize=2048)
+def compile_expression(expr):
+    """Return the (cached) CompiledExpression for expr.
+    """
+    return CompiledExpression(expr)
+
 class _advene_context (simpleTALES.Context):
     """Advene specific implementation of TALES.
        It is based on simpletal.simpleTALES.Context,
@@ -106,25 +359,39 @@ class _advene_context (simpleTALES.Context):
             # object
 
         if val is None and hasattr (obj, 'getQName'):
-            if 'view' in self.locals:
-                ref = self.locals['view']
-            elif 'view' in self.globals:
-                ref = self.globals['view']
-            elif 'here' in self.locals:
-                ref = self.locals['here']
-            elif 'here' in self.globals:
-                ref = self.globals['here']
-            else:
-                ref = None
-            if ref is None:
-                ref = obj
-            pkg = ref.getOwnerPackage ()
-            ns_dict = pkg.getImports ().getInverseDict ()
-            ns_dict[''] = pkg.getUri (absolute=True)
-            val = obj.getQName (path, ns_dict, None)
+            val = obj.getQName (path, self.getNamespaces(obj), None)
 
         return val
 
+    def getNamespaceReference(self):
+        """Return the element whose package defines the QName namespaces.
+
+        It is the current view (or here). If it is None, then the
+        package of the traversed object is used.
+        """
+        if 'view' in self.locals:
+            ref = self.locals['view']
+        elif 'view' in self.globals:
+            ref = self.globals['view']
+        elif 'here' in self.locals:
+            ref = self.locals['here']
+        elif 'here' in self.globals:
+            ref = self.globals['here']
+        else:
+            ref = None
+        return ref
+
+    def getNamespaces(self, obj):
+        """Return the namespaces used to resolve QNames on obj.
+        """
+        ref = self.getNamespaceReference()
+        if ref is None:
+            ref = obj
+        pkg = ref.getOwnerPackage ()
+        ns_dict = pkg.getImports ().getInverseDict ()
+        ns_dict[''] = pkg.getUri (absolute=True)
+        return ns_dict
+
     def traversePath (self, expr, canCall=1):
                 # canCall only applies to the *final* path destination, not points down the path.
                 # Check for and correct for trailing/leading quotes
@@ -281,25 +548,23 @@ class AdveneContext(_advene_context):
         else:
             raise AdveneTalesException("%s is not a valid method" % function)
 
-    def interpret (self, view_source, mimetype, stream=None):
+    def interpret (self, view_source, mimetype, stream=None, key=None):
         """
         Interpret the TAL template available through the stream view_source,
         with the mime-type mimetype, and print the result to the stream
         "stream". The stream is returned. If stream is not given or None, a
         StringIO will be created and returned.
+
+        The compiled template is cached (see L{TemplateCache}). key
+        (e.g. the view URI) allows to invalidate it.
         """
         if stream is None:
             stream = StringIO ()
 
-        if isinstance (view_source, str) or isinstance (view_source, str):
-            view_source = StringIO (str(view_source))
-
         kw = {}
-        compiler = simpleTAL.XMLTemplateCompiler ()
-        compiler.log = self.log
-        compiler.parseTemplate (view_source)
+        template = template_cache.get(view_source, key=key)
         kw["suppressXMLDeclaration"] = 1
-        compiler.getTemplate ().expand (context=self, outputFile=stream, outputEncoding='utf-8', **kw)
+        template.expand (context=self, outputFile=stream, outputEncoding='utf-8', **kw)
 
         return stream
 
@@ -311,7 +576,7 @@ class AdveneContext(_advene_context):
         """
         r = None
         try:
-                r = self.evaluate (expr)
+                r = compile_expression(expr).evaluate(self)
         except simpleTALES.PathNotFoundException:
                 raise AdveneTalesException(
                         'TALES expression %s returned None in context %s' %
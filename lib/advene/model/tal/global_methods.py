@@ -408,6 +408,8 @@ def query(target, context):
     """Apply a query on target.
 
     """
+    import advene.model.query
+
     class QueryWrapper (object):
 
         """
@@ -430,13 +432,17 @@ def query(target, context):
 
         def _get_query_by_id(self, key):
             try:
-                l=self._target.rootPackage.queries
+                p=self._target.rootPackage
             except AttributeError:
                 # We are querying an element that has no rootPackage
                 # (a list for instance). So fallback to the context
                 # package global.
-                l=self._context.globals['package'].queries
-            qlist=[ q for q in l if q.id == key ]
+                p=self._context.globals['package']
+            q=p.get_element_by_id(key)
+            if isinstance(q, advene.model.query.Query):
+                return q
+            # Imported queries have a prefixed id, not found above
+            qlist=[ q for q in p.queries if q.id == key ]
             if qlist:
                 return qlist[0]
             else:
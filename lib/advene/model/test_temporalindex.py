@@ -0,0 +1,234 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Tests of the temporal index, against brute-force computations.
+"""
+import random
+import unittest
+
+import sys
+sys.path.insert(0, ".")
+
+from advene.model.package import Package
+
+def make_package(records):
+    """Return a new package, with annotation types t1 and t2.
+
+    records is a list of (type id, begin, end) tuples.
+    """
+    p = Package(uri='test_temporalindex.xml', source=None)
+    schema = p.createSchema(ident='s')
+    p.schemas.append(schema)
+    for ident in ('t1', 't2'):
+        schema.annotationTypes.append(schema.createAnnotationType(ident=ident))
+    types = dict( (t.id, t) for t in p.annotationTypes )
+    p.create_annotations([ { 'type': types[t], 'begin': b, 'end': e }
+                           for (t, b, e) in records ])
+    return p
+
+def bounds(a):
+    f = a.fragment
+    return (f.begin, f.end)
+
+class TemporalIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.random = r = random.Random(2)
+        records = []
+        for i in range(300):
+            b = r.randrange(0, 100000)
+            d = r.choice( (0, 1, 10, 100, 1000, 10000) )
+            records.append( (r.choice( ('t1', 't2') ), b - b % 50, b - b % 50 + d) )
+        # A long annotation
+        records.append( ('t1', 10, 90000) )
+        self.package = make_package(records)
+        self.index = self.package.getTemporalIndex()
+        self.types = [ self.package.get_element_by_id(t) for t in ('t1', 't2') ]
+
+    def expected(self, test, type=None):
+        """Return the annotations verifying test(begin, end), sorted by begin time.
+        """
+        return [ a for a in sorted(self.package.annotations, key=lambda a: bounds(a)[0])
+                 if (type is None or a.type is type) and test(*bounds(a)) ]
+
+    def intervals(self):
+        r = self.random
+        for i in range(50):
+            begin = r.randrange(-1000, 110000)
+            yield (begin, begin + r.choice( (0, 50, 500, 5000, 50000) ))
+
+    def check_queries(self):
+        index = self.index
+        self.assertEqual(len(index), len(self.package.annotations))
+        for t in [ None ] + self.types:
+            self.assertEqual(index.annotations_by_begin(type=t), self.expected(lambda b, e: True, t))
+            for (begin, end) in self.intervals():
+                self.assertEqual(index.annotations_in(begin, end, t),
+                                 self.expected(lambda b, e: e >= begin and b <= end, t))
+                self.assertEqual(index.annotations_in(begin, end, t, contained=True),
+                                 self.expected(lambda b, e: b >= begin and e <= end, t))
+                self.assertEqual([ (a, b, e) for (a, b, e) in index.segments_in(begin, end, t) ],
+                                 [ (a, ) + bounds(a) for a in index.annotations_in(begin, end, t) ])
+                self.assertEqual(index.annotations_at(begin, t),
+                                 self.expected(lambda b, e: b <= begin <= e, t))
+
+    def pages(self, limit, **kw):
+        """Return the concatenated pages of segments_after.
+        """
+        result = []
+        after = None
+        while True:
+            page = self.index.segments_after(after=after, limit=limit, **kw)
+            self.assertTrue(len(page) <= limit)
+            result.extend(a for (a, b, e) in page)
+            if len(page) < limit:
+                return result
+            a, b, e = page[-1]
+            after = (b, a.id)
+
+    def test_queries(self):
+        self.check_queries()
+
+    def test_segments_after(self):
+        self.assertEqual(self.pages(7), self.expected(lambda b, e: True))
+        for (begin, end) in self.intervals():
+            for types in (None, self.types[:1], self.types):
+                ids = None if types is None else [ t.id for t in types ]
+                def expected(test):
+                    return [ a for a in self.expected(test)
+                             if ids is None or a.type.id in ids ]
+                self.assertEqual(self.pages(7, begin=begin, end=end, types=types),
+                                 expected(lambda b, e: e >= begin and b <= end))
+                self.assertEqual(self.pages(7, begin=begin, end=end, types=types, contained=True),
+                                 expected(lambda b, e: b >= begin and e <= end))
+        self.assertEqual(self.pages(5, begin=50000), self.expected(lambda b, e: e >= 50000))
+        self.assertEqual(self.pages(5, end=50000), self.expected(lambda b, e: b <= 50000))
+
+    def test_segments_after_removed_cursor(self):
+        # Annotations beginning at the time of a removed cursor
+        # annotation are returned again.
+        expected = self.expected(lambda b, e: True)
+        a = expected[100]
+        begin = bounds(a)[0]
+        self.package.annotations.remove(a)
+        result = [ s[0] for s in self.index.segments_after(after=(begin, a.id)) ]
+        self.assertEqual(result, [ x for x in expected if bounds(x)[0] >= begin and x is not a ])
+
+    def test_maintenance(self):
+        p = self.package
+        r = self.random
+        t1, t2 = self.types
+        # Build the index
+        len(self.index)
+        # Additions
+        p.create_annotations([ { 'type': r.choice(self.types), 'begin': b, 'end': b + r.randrange(0, 20000) }
+                               for b in (r.randrange(0, 100000) for i in range(50)) ])
+        a = p.createAnnotation(ident='added', type=t2, fragment=p.annotations[0].fragment.__class__(begin=5, end=120000))
+        p.annotations.append(a)
+        self.check_queries()
+        # Removals
+        for a in r.sample(list(p.annotations), 60):
+            p.annotations.remove(a)
+        self.check_queries()
+        # Modifications, notified by the controller
+        for a in r.sample(list(p.annotations), 60):
+            b = r.randrange(0, 100000)
+            a.fragment.begin = b
+            a.fragment.end = b + r.randrange(0, 30000)
+            if r.random() < .3:
+                a.type = t1 if a.type is t2 else t2
+            self.index.update(a)
+        self.check_queries()
+        # Rebuild
+        self.index.invalidate()
+        self.check_queries()
+
+    def test_overview(self):
+        overview = OverviewTestCase('check_overview')
+        overview.index = self.index
+        for t in [ None ] + self.types:
+            overview.check_overview(0, 100000, t)
+
+class OverviewTestCase(unittest.TestCase):
+
+    resolution = 1000
+    min_duration = 10000
+
+    def setUp(self):
+        r = random.Random(1)
+        # A long annotation before dense short ones, plus isolated
+        # short ones.
+        records = [ ('t1', 0, 1000000), ('t1', 500000, 500001), ('t1', 700000, 700000) ]
+        for i in range(3000):
+            b = 2000 + 10 * i
+            records.append( ('t1', b, b + r.choice( (1, 5, 50, 500, 5000, 20000) )) )
+        for i in range(500):
+            b = r.randrange(0, 1000000)
+            records.append( ('t2', b, b + r.randrange(0, 3000)) )
+        self.package = make_package(records)
+        self.index = self.package.getTemporalIndex()
+
+    def check_overview(self, begin, end, type=None):
+        overview = self.index.overview(begin, end, self.resolution, type, self.min_duration)
+        segments = self.index.segments_in(begin, end, type)
+        self.assertEqual(len(overview), len(set(a for (a, b, e) in overview)),
+                         "An annotation is returned twice")
+        returned = dict( (a, (b, e)) for (a, b, e) in overview )
+        for (a, b, e) in segments:
+            if e - b >= self.min_duration:
+                self.assertEqual(returned.get(a), (b, e))
+        for (a, (b, e)) in returned.items():
+            self.assertEqual(b, bounds(a)[0])
+            self.assertTrue(e >= begin and b <= end)
+            if bounds(a)[1] - b >= self.min_duration:
+                continue
+            # The end covers the short annotations beginning in the
+            # slot, and nothing more.
+            merged = [ e2 for (a2, b2, e2) in segments
+                       if b <= b2 < b + self.resolution and e2 - b2 < self.min_duration ]
+            self.assertTrue(min(bounds(a)[1], b + self.min_duration - 1)
+                            <= e
+                            <= min(max(merged), b + self.min_duration - 1))
+        # Each short annotation is covered by a returned slot
+        for (a, b, e) in segments:
+            if e - b < self.min_duration and a not in returned:
+                self.assertTrue(any(b2 <= b < b2 + self.resolution
+                                    and returned_end >= min(e, b2 + self.min_duration - 1)
+                                    for (b2, returned_end) in returned.values()),
+                                "%s is not covered" % a.id)
+        return overview
+
+    def test_isolated(self):
+        overview = self.check_overview(0, 1000000, self.package.get_element_by_id('t1'))
+        self.assertIn( (500000, 500001), [ (b, e) for (a, b, e) in overview ] )
+        self.assertIn( (700000, 700000), [ (b, e) for (a, b, e) in overview ] )
+
+    def test_types(self):
+        for t in (None, 't1', 't2'):
+            at = None if t is None else self.package.get_element_by_id(t)
+            for (begin, end) in ( (0, 1000000), (1500, 20000), (499000, 501000), (999999, 2000000) ):
+                self.check_overview(begin, end, at)
+
+    def test_small(self):
+        # Few annotations: the result is the same as segments_in
+        t2 = self.package.get_element_by_id('t2')
+        self.assertEqual(sorted(self.index.overview(499000, 501000, 100, t2), key=lambda s: s[0].id),
+                         sorted(self.index.segments_in(499000, 501000, t2), key=lambda s: s[0].id))
+
+if __name__ == "__main__":
+    unittest.main()
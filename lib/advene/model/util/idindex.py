@@ -0,0 +1,163 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Package-wide index of elements, used by Package.get_element_by_id.
+
+The index maps the URI of each element of the package (schemas, views,
+annotation and relation types, annotations, queries and relations) to
+the bundle holding it. The element itself is then fetched from the
+bundle, so that lazy bundles (see L{advene.model.bundle.LazyXmlBundle})
+do not have to create all their items.
+
+The index is built lazily on the first query. It is then kept up to
+date by observing the package bundles and the type bundles of each
+schema (see L{advene.model.bundle.WritableBundle.add_observer}).
+"""
+import advene.model.util.uri
+
+class IdIndex(object):
+    """Index of the elements of a package.
+    """
+    def __init__(self, package):
+        self._package = package
+        self._built = False
+        # uri -> bundle
+        self._bundles = {}
+        # Observed bundles
+        self._observed = []
+
+    def clear(self):
+        """Empty the index. It will be rebuilt on the next query.
+        """
+        for b in self._observed:
+            b.remove_observer(self)
+        self._observed = []
+        self._bundles = {}
+        self._built = False
+
+    invalidate = clear
+
+    def __observe(self, bundle):
+        if bundle in self._observed:
+            return
+        bundle.add_observer(self)
+        self._observed.append(bundle)
+        index = self._bundles
+        # Setdefault preserves the precedence of get_element_by_id
+        # when the same URI is (wrongly) used twice.
+        for uri in bundle.keys():
+            index.setdefault(uri, bundle)
+
+    def __observe_schema(self, schema):
+        self.__observe(schema.getAnnotationTypes())
+        self.__observe(schema.getRelationTypes())
+
+    def build(self):
+        """(Re)build the index from the package bundles.
+        """
+        self.clear()
+        p = self._package
+        schemas = p.getSchemas()
+        self.__observe(schemas)
+        self.__observe(p.getViews())
+        for s in schemas:
+            self.__observe(s.getAnnotationTypes())
+        for s in schemas:
+            self.__observe(s.getRelationTypes())
+        self.__observe(p.getAnnotations())
+        self.__observe(p.getQueries())
+        self.__observe(p.getRelations())
+        self._built = True
+
+    def _check(self):
+        if not self._built:
+            self.build()
+
+    def __len__(self):
+        self._check()
+        return len(self._bundles)
+
+    def get(self, uri, default=None):
+        """Return the element with the given URI.
+        """
+        self._check()
+        b = self._bundles.get(uri)
+        if b is None:
+            return default
+        return b.get(uri, default)
+
+    def get_by_id(self, id_, default=None):
+        """Return the element of the package with the given id.
+        """
+        return self.get(advene.model.util.uri.push(self._package.getUri(absolute=True), id_), default)
+
+    #
+    # Maintenance
+    #
+
+    def item_added(self, bundle, item):
+        """Bundle observer method.
+        """
+        if not self._built:
+            return
+        self._bundles[item.getUri(absolute=True)] = bundle
+        if bundle is self._package.getSchemas():
+            self.__observe_schema(item)
+
+    def item_removed(self, bundle, item):
+        """Bundle observer method.
+        """
+        if not self._built:
+            return
+        uri = item.getUri(absolute=True)
+        if self._bundles.get(uri) is bundle:
+            del self._bundles[uri]
+        if bundle is self._package.getSchemas():
+            for b in (item.getAnnotationTypes(), item.getRelationTypes()):
+                if b in self._observed:
+                    self._observed.remove(b)
+                    b.remove_observer(self)
+                    for u in b.keys():
+                        if self._bundles.get(u) is b:
+                            del self._bundles[u]
+
+    def add(self, element):
+        """Make sure that the given element is indexed.
+
+        This is not necessary for elements added through the package
+        bundles, but it is harmless.
+        """
+        if not self._built:
+            return
+        uri = element.getUri(absolute=True)
+        if uri in self._bundles:
+            return
+        for b in self._observed:
+            if b.get(uri) is element:
+                self._bundles[uri] = b
+                return
+
+    def remove(self, element):
+        """Make sure that the given element is not indexed anymore.
+        """
+        if not self._built:
+            return
+        uri = element.getUri(absolute=True)
+        b = self._bundles.get(uri)
+        if b is not None and b.get(uri) is None:
+            del self._bundles[uri]
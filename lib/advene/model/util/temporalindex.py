@@ -0,0 +1,443 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Temporal index of the annotations of a package.
+
+The index keeps the annotations in two arrays, sorted respectively
+along their begin and end times, plus one begin-sorted array per
+annotation type. Queries are done through bisection.
+
+Array items are tuples (time, seq, other_time, annotation), where seq
+is a sequence number unique to each annotation. It preserves the
+package order for annotations with the same time, and ensures that
+annotations themselves are never compared.
+
+The index is built lazily on the first query. It is then kept up to
+date by the annotations bundle (for additions and removals, see
+L{advene.model.bundle.WritableBundle.add_observer}) and by explicit
+calls to L{TemporalIndex.update} when a fragment or a type is
+modified (the controller does it on AnnotationEditEnd).
+"""
+from bisect import bisect_left, bisect_right, insort
+import heapq
+import itertools
+
+_infinity = float('inf')
+
+class TemporalIndex(object):
+    """Temporal index for the annotations of a package.
+    """
+    def __init__(self, package):
+        self._package = package
+        self._built = False
+        self.clear()
+
+    def clear(self):
+        """Empty the index. It will be rebuilt on the next query.
+        """
+        self._built = False
+        self._seq = 0
+        # annotation -> (begin, end, seq, type)
+        self._entries = {}
+        # Sorted (begin, seq, end, annotation)
+        self._begins = []
+        # Sorted (end, seq, begin, annotation)
+        self._ends = []
+        # type -> sorted (begin, seq, end, annotation)
+        self._types = {}
+        # Upper bound of annotation durations, globally and per
+        # type. They are not decreased upon removal, which does not
+        # affect the query results.
+        self._max_duration = 0
+        self._type_max_duration = {}
+        # type -> (items sorted by decreasing duration, negated
+        # durations, positions of the items in the begin-sorted list,
+        # range maxima of ends) for overview queries. They are
+        # computed on demand, and dropped upon modification.
+        self._summaries = {}
+
+    invalidate = clear
+
+    def build(self):
+        """(Re)build the index from the package annotations.
+        """
+        self.clear()
+        begins = self._begins
+        ends = self._ends
+        types = self._types
+        entries = self._entries
+        type_max_duration = self._type_max_duration
+        for seq, a in enumerate(self._package.getAnnotations()):
+            f = a.getFragment()
+            b, e = f.getBegin(), f.getEnd()
+            t = a.getType()
+            entries[a] = (b, e, seq, t)
+            begins.append( (b, seq, e, a) )
+            ends.append( (e, seq, b, a) )
+            types.setdefault(t, []).append( (b, seq, e, a) )
+            if e - b > type_max_duration.get(t, 0):
+                type_max_duration[t] = e - b
+        begins.sort()
+        ends.sort()
+        for l in types.values():
+            l.sort()
+        self._seq = len(entries)
+        self._max_duration = max(type_max_duration.values(), default=0)
+        self._built = True
+
+    def _check(self):
+        if not self._built:
+            self.build()
+
+    def __len__(self):
+        self._check()
+        return len(self._entries)
+
+    def __contains__(self, annotation):
+        self._check()
+        return annotation in self._entries
+
+    #
+    # Maintenance
+    #
+
+    def __insert(self, a, b, e, seq, t):
+        self._entries[a] = (b, e, seq, t)
+        insort(self._begins, (b, seq, e, a))
+        insort(self._ends, (e, seq, b, a))
+        insort(self._types.setdefault(t, []), (b, seq, e, a))
+        if e - b > self._max_duration:
+            self._max_duration = e - b
+        if e - b > self._type_max_duration.get(t, 0):
+            self._type_max_duration[t] = e - b
+        self._summaries.pop(t, None)
+        self._summaries.pop(None, None)
+
+    def __delete(self, a):
+        b, e, seq, t = self._entries.pop(a)
+        self._summaries.pop(t, None)
+        self._summaries.pop(None, None)
+        for l, key in ( (self._begins, (b, seq)),
+                        (self._ends, (e, seq)),
+                        (self._types.get(t, []), (b, seq)) ):
+            i = bisect_left(l, key)
+            if i < len(l) and l[i][3] is a:
+                del l[i]
+        return seq
+
+    def add(self, annotation):
+        """Add an annotation to the index.
+
+        If it is already indexed, its information is updated.
+        """
+        if not self._built:
+            return
+        if annotation in self._entries:
+            self.update(annotation)
+            return
+        f = annotation.getFragment()
+        seq = self._seq
+        self._seq += 1
+        self.__insert(annotation, f.getBegin(), f.getEnd(), seq, annotation.getType())
+
+    def remove(self, annotation):
+        """Remove an annotation from the index.
+        """
+        if self._built and annotation in self._entries:
+            self.__delete(annotation)
+
+    def update(self, annotation):
+        """Update the index information for a modified annotation.
+        """
+        if not self._built:
+            return
+        if annotation not in self._entries:
+            self.add(annotation)
+            return
+        f = annotation.getFragment()
+        b, e, t = f.getBegin(), f.getEnd(), annotation.getType()
+        old = self._entries[annotation]
+        if (b, e, t) == (old[0], old[1], old[3]):
+            return
+        seq = self.__delete(annotation)
+        self.__insert(annotation, b, e, seq, t)
+
+    # WritableBundle observer interface
+    def item_added(self, bundle, item):
+        self.add(item)
+
+    def item_removed(self, bundle, item):
+        self.remove(item)
+
+    #
+    # Queries
+    #
+
+    def __candidates(self, begin, end, type=None):
+        """Return the begin-sorted items that may intersect [begin, end].
+        """
+        self._check()
+        if type is None:
+            l = self._begins
+            max_duration = self._max_duration
+        else:
+            l = self._types.get(type, [])
+            max_duration = self._type_max_duration.get(type, 0)
+        lo = bisect_left(l, (begin - max_duration, ))
+        hi = bisect_right(l, (end, _infinity))
+        return l[lo:hi]
+
+    def annotations_at(self, t, type=None):
+        """Return the annotations containing the time t, sorted by begin time.
+
+        The bounds are inclusive, as in the fragment 'in' operator.
+        """
+        return [ item[3]
+                 for item in self.__candidates(t, t, type)
+                 if item[2] >= t ]
+
+    def annotations_in(self, begin, end, type=None, contained=False):
+        """Return the annotations intersecting [begin, end], sorted by begin time.
+
+        If contained is True, only return the annotations that are
+        completely included in [begin, end].
+        """
+        if contained:
+            self._check()
+            l = self._begins if type is None else self._types.get(type, [])
+            lo = bisect_left(l, (begin, ))
+            hi = bisect_right(l, (end, _infinity))
+            return [ item[3] for item in l[lo:hi] if item[2] <= end ]
+        return [ item[3]
+                 for item in self.__candidates(begin, end, type)
+                 if item[2] >= begin ]
+
+    def segments_in(self, begin, end, type=None):
+        """Return the (annotation, begin, end) triplets intersecting [begin, end], sorted by begin.
+
+        It is meant for renderers, which can then avoid accessing the
+        annotation fragments.
+        """
+        return [ (a, b, e)
+                 for (b, s, e, a) in self.__candidates(begin, end, type)
+                 if e >= begin ]
+
+    def segments_after(self, after=None, limit=None, begin=None, end=None,
+                       types=None, contained=False):
+        """Return (annotation, begin, end) triplets sorted by begin, for pagination.
+
+        Only the annotations intersecting [begin, end] (or completely
+        included in it, if contained is True) are returned. A None
+        bound is not checked. types is an optional list of annotation
+        types.
+
+        after is an optional (begin, annotation id) cursor, designating
+        the last annotation of the previous page: the result starts
+        with the next one. At most limit triplets are returned.
+        """
+        self._check()
+        if types is None:
+            lists = [ (self._begins, self._max_duration) ]
+        else:
+            lists = [ (self._types.get(t, []), self._type_max_duration.get(t, 0))
+                      for t in types ]
+        iterators = []
+        for l, max_duration in lists:
+            if begin is None:
+                lo = 0
+            elif contained:
+                lo = bisect_left(l, (begin, ))
+            else:
+                lo = bisect_left(l, (begin - max_duration, ))
+            if after is not None:
+                lo = max(lo, bisect_left(l, (after[0], )))
+            hi = len(l) if end is None else bisect_right(l, (end, _infinity))
+            iterators.append(map(l.__getitem__, range(lo, hi)))
+        # Sequence numbers are unique: annotations are never compared.
+        items = iterators[0] if len(iterators) == 1 else heapq.merge(*iterators)
+        if begin is not None and not contained:
+            items = (item for item in items if item[2] >= begin)
+        elif contained and end is not None:
+            items = (item for item in items if item[2] <= end)
+        if after is not None:
+            # Skip the annotations beginning at the cursor time, up
+            # to the cursor annotation. If it does not exist anymore,
+            # they are all returned again.
+            group = []
+            for item in items:
+                group.append(item)
+                if item[0] != after[0]:
+                    break
+                if item[3].id == after[1]:
+                    group = []
+                    break
+            items = itertools.chain(group, items)
+        return [ (a, b, e) for (b, s, e, a) in itertools.islice(items, limit) ]
+
+    def __summary(self, type):
+        try:
+            return self._summaries[type]
+        except KeyError:
+            pass
+        l = self._begins if type is None else self._types.get(type, [])
+        positions = sorted(range(len(l)), key=lambda i: l[i][0] - l[i][2])
+        longest = [ l[i] for i in positions ]
+        durations = [ b - e for (b, s, e, a) in longest ]
+        # Sparse table: maxima[k][i] is the maximum end of
+        # l[i:i + 2 ** k]. Levels are added by __max_end when needed.
+        maxima = [ [ item[2] for item in l ] ]
+        summary = self._summaries[type] = (longest, durations, positions, maxima)
+        return summary
+
+    @staticmethod
+    def __max_end(maxima, i, j):
+        """Return the maximum end of the items i to j - 1 (with i < j).
+        """
+        k = (j - i).bit_length() - 1
+        while len(maxima) <= k:
+            h = 1 << (len(maxima) - 1)
+            level = maxima[-1]
+            maxima.append(list(map(max, level[:-h], level[h:])))
+        level = maxima[k]
+        return max(level[i], level[j - (1 << k)])
+
+    def overview(self, begin, end, resolution, type=None, min_duration=None):
+        """Return (annotation, begin, end) triplets summarizing [begin, end] at the given resolution.
+
+        It is meant for renderers displaying many annotations in a
+        small space, where resolution is the duration of a pixel. All
+        annotations lasting at least min_duration (10 * resolution by
+        default) are returned. Shorter annotations are merged: for
+        each resolution-long slot where some of them begin, only the
+        first one is returned, with an end time covering the others
+        of the slot (but shorter than min_duration).
+
+        If there are not many more annotations than slots, the result
+        is the same as segments_in. The triplets are not sorted.
+        """
+        self._check()
+        if type is None:
+            l = self._begins
+            max_duration = self._max_duration
+        else:
+            l = self._types.get(type, [])
+            max_duration = self._type_max_duration.get(type, 0)
+        lo = bisect_left(l, (begin - max_duration, ))
+        hi = bisect_right(l, (end, _infinity))
+        if resolution <= 0 or hi - lo <= 2 * (end - begin) / resolution + 16:
+            return [ (a, b, e) for (b, s, e, a) in l[lo:hi] if e >= begin ]
+        if min_duration is None:
+            min_duration = 10 * resolution
+        longest, durations, positions, maxima = self.__summary(type)
+        count = bisect_right(durations, -min_duration)
+        result = [ (a, b, e)
+                   for (b, s, e, a) in longest[:count]
+                   if b <= end and e >= begin ]
+        # Positions of the long annotations, which are skipped below
+        skipped = sorted(positions[:count])
+        i = bisect_left(l, (begin - min_duration, ), lo, hi)
+        while i < hi:
+            j = bisect_left(l, (l[i][0] + resolution, ), i + 1, hi)
+            # The short annotations of the slot are the runs between
+            # the long ones.
+            first = None
+            e = None
+            start = i
+            k = bisect_left(skipped, i)
+            for stop in skipped[k:bisect_left(skipped, j, k)] + [ j ]:
+                if start < stop:
+                    if first is None:
+                        first = l[start]
+                    m = self.__max_end(maxima, start, stop)
+                    if e is None or m > e:
+                        e = m
+                start = stop + 1
+            if first is not None:
+                b, s, a = first[0], first[1], first[3]
+                e = min(e, b + min_duration - 1)
+                if e >= begin:
+                    result.append( (a, b, e) )
+            i = j
+        return result
+
+    def annotations_of_type(self, type):
+        """Return the annotations of the given type, sorted by begin time.
+        """
+        self._check()
+        return [ item[3] for item in self._types.get(type, []) ]
+
+    def annotations_by_begin(self, lo=None, hi=None, type=None):
+        """Return the annotations with lo <= begin <= hi, sorted by begin time.
+
+        A None bound is not checked.
+        """
+        self._check()
+        l = self._begins if type is None else self._types.get(type, [])
+        i = 0 if lo is None else bisect_left(l, (lo, ))
+        j = len(l) if hi is None else bisect_right(l, (hi, _infinity))
+        return [ item[3] for item in l[i:j] ]
+
+    def annotations_by_end(self, lo=None, hi=None):
+        """Return the annotations with lo <= end <= hi, sorted by end time.
+
+        A None bound is not checked.
+        """
+        self._check()
+        l = self._ends
+        i = 0 if lo is None else bisect_left(l, (lo, ))
+        j = len(l) if hi is None else bisect_right(l, (hi, _infinity))
+        return [ item[3] for item in l[i:j] ]
+
+    def types(self):
+        """Return the annotation types of the indexed annotations.
+        """
+        self._check()
+        return [ t for (t, l) in self._types.items() if l ]
+
+    def next_begin_after(self, t, type=None):
+        """Return the first annotation begin time strictly greater than t.
+
+        Return None if there is no such annotation.
+        """
+        self._check()
+        l = self._begins if type is None else self._types.get(type, [])
+        i = bisect_right(l, (t, _infinity))
+        if i < len(l):
+            return l[i][0]
+        return None
+
+    def begins_from(self, t):
+        """Return the (annotation, begin, end) triplets with begin >= t, sorted by begin.
+        """
+        self._check()
+        l = self._begins
+        return [ (a, b, e) for (b, s, e, a) in l[bisect_left(l, (t, )):] ]
+
+    def ends_from(self, t):
+        """Return the (annotation, begin, end) triplets with end >= t, sorted by end.
+        """
+        self._check()
+        l = self._ends
+        return [ (a, b, e) for (e, s, b, a) in l[bisect_left(l, (t, )):] ]
+
+    def active_at(self, t):
+        """Return the annotations with begin < t <= end, sorted by begin time.
+        """
+        return [ item[3]
+                 for item in self.__candidates(t, t)
+                 if item[0] < t and item[2] >= t ]
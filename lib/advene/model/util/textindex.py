@@ -0,0 +1,195 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Inverted index of the contents and tags of a package elements.
+
+The index maps each token of the annotation and relation contents
+(i.e. each whitespace-separated word, as is) to the elements containing
+it, and each tag to the elements bearing it.
+
+Searches keep the substring semantics of the former linear scans:
+every whitespace-free piece of a searched string must appear inside a
+single token of the content, so candidates are the elements holding a
+token which contains each piece. The token vocabulary being much
+smaller than the contents, it is scanned instead of the data. The
+candidates are then checked against the actual content.
+
+The index is built lazily on the first query. It is then kept up to
+date by the annotations and relations bundles (for additions and
+removals, see L{advene.model.bundle.WritableBundle.add_observer}) and by
+explicit calls to L{TextIndex.update} when the content or the tags of
+an element are modified (the controller does it on *EditEnd events).
+"""
+
+class TextIndex(object):
+    """Inverted index for the contents and tags of a package.
+    """
+    def __init__(self, package):
+        self._package = package
+        self._built = False
+        self.clear()
+
+    def clear(self):
+        """Empty the index. It will be rebuilt on the next query.
+        """
+        self._built = False
+        # element -> (tokens, tags)
+        self._entries = {}
+        # token -> set of elements
+        self._tokens = {}
+        # token -> lowercase token
+        self._lower = {}
+        # tag -> set of elements
+        self._tags = {}
+
+    invalidate = clear
+
+    def build(self):
+        """(Re)build the index from the package annotations and relations.
+        """
+        self.clear()
+        p = self._package
+        for l in (p.getAnnotations(), p.getRelations()):
+            for e in l:
+                self.__insert(e)
+        self._built = True
+
+    def _check(self):
+        if not self._built:
+            self.build()
+
+    def __len__(self):
+        self._check()
+        return len(self._entries)
+
+    def __contains__(self, element):
+        self._check()
+        return element in self._entries
+
+    #
+    # Maintenance
+    #
+
+    def __insert(self, element):
+        tokens = frozenset(element.getContent().getData().split())
+        tags = tuple(element.getTags())
+        self._entries[element] = (tokens, tags)
+        for t in tokens:
+            s = self._tokens.get(t)
+            if s is None:
+                s = self._tokens[t] = set()
+                self._lower[t] = t.lower()
+            s.add(element)
+        for t in tags:
+            self._tags.setdefault(t, set()).add(element)
+
+    def __delete(self, element):
+        tokens, tags = self._entries.pop(element)
+        for t in tokens:
+            s = self._tokens[t]
+            s.discard(element)
+            if not s:
+                del self._tokens[t]
+                del self._lower[t]
+        for t in tags:
+            s = self._tags[t]
+            s.discard(element)
+            if not s:
+                del self._tags[t]
+
+    def add(self, element):
+        """Add an element to the index.
+
+        If it is already indexed, its information is updated.
+        """
+        if not self._built:
+            return
+        if element in self._entries:
+            self.__delete(element)
+        self.__insert(element)
+
+    def remove(self, element):
+        """Remove an element from the index.
+        """
+        if self._built and element in self._entries:
+            self.__delete(element)
+
+    update = add
+
+    # WritableBundle observer interface
+    def item_added(self, bundle, item):
+        self.add(item)
+
+    def item_removed(self, bundle, item):
+        self.remove(item)
+
+    #
+    # Queries
+    #
+
+    def __tokens_containing(self, piece, case_sensitive):
+        if case_sensitive:
+            return [ t for t in self._tokens if piece in t ]
+        else:
+            return [ t for (t, l) in self._lower.items() if piece in l ]
+
+    def search(self, searched, case_sensitive=False):
+        """Return the set of indexed elements whose content contains searched.
+
+        If case_sensitive is False, the comparison is done on the
+        lowercase versions of both strings.
+        """
+        self._check()
+        if not case_sensitive:
+            searched = searched.lower()
+        candidates = None
+        for piece in searched.split():
+            s = set()
+            for t in self.__tokens_containing(piece, case_sensitive):
+                s.update(self._tokens[t])
+            if candidates is None:
+                candidates = s
+            else:
+                candidates &= s
+            if not candidates:
+                return set()
+        if candidates is None:
+            # Only whitespace: no pruning possible.
+            candidates = self._entries
+        elif searched.split() == [ searched ]:
+            # A single piece is found in a token: no need to check.
+            return candidates
+        if case_sensitive:
+            return set( e for e in candidates
+                        if searched in e.getContent().getData() )
+        else:
+            return set( e for e in candidates
+                        if searched in e.getContent().getData().lower() )
+
+    def tagged(self, tag, case_sensitive=False):
+        """Return the set of indexed elements bearing the given tag.
+        """
+        self._check()
+        if case_sensitive:
+            return set(self._tags.get(tag, ()))
+        tag = tag.lower()
+        r = set()
+        for (t, s) in self._tags.items():
+            if t.lower() == tag:
+                r.update(s)
+        return r
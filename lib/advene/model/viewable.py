@@ -153,7 +153,7 @@ class Viewable(object, metaclass=auto_properties):
         context.setLocal('here', self)
         context.setLocal('view', view)
         try:
-            context.interpret(view_source, mimetype, result)
+            context.interpret(view_source, mimetype, result, key=view.getUri(absolute=True))
             context.popLocals ()
         except Exception as e:
             title = "Error in view interpretation: %s" % str(e)
@@ -62,7 +62,7 @@ try:
         from gi.repository import GdkWin32
     from gi.repository import Gdk
     from gi.repository import Gtk
-    from advene.util.snapshotter import Snapshotter
+    from advene.util.snapshotter import Snapshotter, SnapshotterPool
     svgelement = 'rsvgoverlay'
     GObject.threads_init()
     Gst.init(None)
@@ -124,7 +124,15 @@ class Player:
         self.last_timestamp_update = 0
 
         try:
-            self.snapshotter = Snapshotter(self.snapshot_taken, width=config.data.player['snapshot-width'])
+            if config.data.player['snapshot-pipelines'] > 1:
+                self.snapshotter = SnapshotterPool(self.snapshot_taken,
+                                                   size=config.data.player['snapshot-pipelines'],
+                                                   width=config.data.player['snapshot-width'],
+                                                   batch_gap=config.data.player['snapshot-batch-gap'])
+            else:
+                self.snapshotter = Snapshotter(self.snapshot_taken,
+                                               width=config.data.player['snapshot-width'],
+                                               batch_gap=config.data.player['snapshot-batch-gap'])
         except Exception as e:
             self.log("Could not initialize snapshotter:" +  str(e))
             self.snapshotter = None
@@ -84,6 +84,7 @@ def register(controller=None):
                     ( 'annotation/content/data', _("The annotation content") ),
                     )},
             category='sound',
+            threaded=True,
             ))
 
 class TTSEngine:
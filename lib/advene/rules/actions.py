@@ -274,6 +274,7 @@ def register(controller=None):
                       'balance': 'string:0' },
             predefined=ac.PlaySoundClip_predefined,
             category='sound',
+            threaded=True,
             )
                                )
     controller.register_action(RegisteredAction(
@@ -287,6 +288,7 @@ def register(controller=None):
                       'volume': 'string:100',
                       'balance': 'string:0' },
             category='sound',
+            threaded=True,
             )
                                )
     controller.register_action(RegisteredAction(
@@ -27,26 +27,56 @@ logger = logging.getLogger(__name__)
 import advene.core.config as config
 
 import time
-import sched
-import threading
 import copy
 import io
 
 import advene.rules.elements
+from advene.rules.scheduler import ActionScheduler
 
-class MyThread(threading.Thread):
-    """Override the standard run() method.
+class LazyContext(object):
+    """Context of an event, built on first use.
 
-    Its behaviour changed in 2.6, and removed the __target, _args and
-    _kwargs variable. Since we keep reusing them, this broke our code.
+    Rules without condition do not need a context to be selected, and
+    many actions do not use it. The locals pushed and set before the
+    context is built are applied when it is.
     """
-    def __init__(self, **kwargs):
-        super(MyThread, self).__init__(**kwargs)
-        self._target=kwargs.get('target', None)
+    def __init__(self, factory):
+        self._factory = factory
+        self._context = None
+        # Pending pushLocals frames
+        self._frames = []
+
+    def _build(self):
+        if self._context is None:
+            context = self._factory()
+            for frame in self._frames:
+                context.pushLocals()
+                for k, v in frame.items():
+                    context.setLocal(k, v)
+            self._frames = None
+            self._context = context
+        return self._context
+
+    def pushLocals(self):
+        if self._context is None:
+            self._frames.append({})
+        else:
+            self._context.pushLocals()
+
+    def setLocal(self, name, value):
+        if self._context is None and self._frames:
+            self._frames[-1][name] = value
+        else:
+            self._build().setLocal(name, value)
+
+    def popLocals(self):
+        if self._context is None and self._frames:
+            self._frames.pop()
+        else:
+            self._build().popLocals()
 
-    def run(self):
-        if self._target:
-            self._target()
+    def __getattr__(self, name):
+        return getattr(self._build(), name)
 
 class ECAEngine:
     """ECAEngine class.
@@ -61,10 +91,12 @@ class ECAEngine:
     indexed by class name ('internal', 'default', 'user'). Upon every
     update, it rebuilds the L{self.ruledict} dictionary, which is
     indexed by EventName and keeps a list of all rules associated to
-    this EventName.
+    this EventName, sorted by decreasing priority.
 
     @ivar ruledict: the global rules dictionary, indexed by EventName
     @type ruledict: dict
+    @ivar dispatch_statistics: dispatch latency counters, indexed by EventName
+    @type dispatch_statistics: dict
     @ivar rulesets: dictionary holding the rules indexed by classname
     @type rulesets: dict
     @ivar controller: the Advene controller
@@ -72,9 +104,7 @@ class ECAEngine:
     @ivar catalog: the catalog of available actions
     @type catalog: elements.ECACatalog
     @ivar scheduler: the engine's scheduler
-    @type scheduler: sched.scheduler
-    @ivar schedulerthread: the scheduler's execution thread
-    @type schedulerthread: threading.Thread
+    @type scheduler: advene.rules.scheduler.ActionScheduler
     """
     def __init__ (self, controller):
         """Initialize the ECAEngine.
@@ -84,12 +114,17 @@ class ECAEngine:
         """
         self.clear_state()
         self.ruledict = {}
+        # EventName -> list of (rule, is_unconditional), sorted by priority
+        self._dispatch = {}
+        # EventName -> [ count, total time, max time ] (in s)
+        self.dispatch_statistics = {}
         # History of events
         self.event_history = []
         self.controller=controller
         self.catalog=advene.rules.elements.ECACatalog()
-        self.scheduler=sched.scheduler(time.time, time.sleep)
-        self.schedulerthread=MyThread(target=self.scheduler.run)
+        self.scheduler=ActionScheduler(dispatch=getattr(controller, 'queue_action', None),
+                                       workers=config.data.preferences['action-workers'],
+                                       max_pending=config.data.preferences['action-queue-size'])
         self.views_to_notify=[]
 
     def get_state(self):
@@ -186,12 +221,22 @@ class ECAEngine:
         This method is called by the other helper methods
         (L{set_ruleset}, L{clear_ruleset}, ...).
         """
-        self.ruledict.clear()
+        ruledict = {}
         # We could use self.rulesets.keys() but we want to specify the
         # class order:
         for type_ in ('internal', 'default', 'user'):
             for rule in self.rulesets[type_]:
-                self.ruledict.setdefault(rule.event, []).append(rule)
+                ruledict.setdefault(rule.event, []).append(rule)
+        dispatch = {}
+        for event, rules in ruledict.items():
+            # The sort is stable, so the class order is kept for
+            # rules with the same priority.
+            rules.sort(key=lambda r: r.priority, reverse=True)
+            dispatch[event] = [ (rule, getattr(rule.condition, 'is_true', bool)())
+                                for rule in rules ]
+        self.ruledict.clear()
+        self.ruledict.update(ruledict)
+        self._dispatch = dispatch
 
     def schedule(self, action, context, delay=0, immediate=False):
         """Schedule an action for execution.
@@ -202,30 +247,57 @@ class ECAEngine:
         @type context: AdveneContext
         @param delay: a delay for execution (in s)
         @type delay: float
+
+        Immediate actions, and actions run in the main thread without
+        delay, are executed at once. Other actions are handed to the
+        scheduler, with their own copy of the context: threaded actions
+        are run in a worker thread, the others in the main thread.
         """
         if isinstance(action, advene.rules.elements.ActionList):
             for a in action:
-                self.schedule(a, context, delay)
+                self.schedule(a, context, delay, immediate)
             return
 
-        if action.immediate or immediate:
+        threaded=getattr(action, 'threaded', False)
+        if action.immediate or immediate or not (delay or threaded):
             action.execute(context)
         else:
-            if delay:
-                self.scheduler.enterabs(time.time()+delay, 0, action.execute, (context,))
-            else:
-                self.scheduler.enter(delay, 0, action.execute, (context,))
-            if not self.schedulerthread.isAlive():
-                try:
-                    self.schedulerthread.run()
-                except Exception:
-                    logger.error("Exception in scheduler", exc_info=True)
+            self.scheduler.enter(delay, action.execute, (self.detach_context(context),), threaded=threaded)
+
+    def detach_context(self, context):
+        """Return a copy of context, for a deferred action.
+
+        The contexts of events are reused, and their locals are popped
+        once the rules are processed.
+        """
+        if isinstance(context, LazyContext):
+            # Build the context in the notifying thread, not in
+            # the scheduler one.
+            context=context._build()
+        c=copy.copy(context)
+        c.globals=dict(context.globals)
+        c.locals=dict(context.locals)
+        c.localStack=[]
+        return c
 
     def reset_queue (self):
         """Reset the scheduler's queue.
         """
-        for i in self.scheduler.queue:
-            self.scheduler.cancel(i[0])
+        self.scheduler.reset()
+
+    def shutdown(self):
+        """Cancel pending actions and stop the scheduler.
+        """
+        self.scheduler.stop()
+
+    def scheduler_statistics(self):
+        """Return the scheduler statistics, as a list of strings.
+        """
+        s=self.scheduler.stats()
+        return [ "Queue: %(depth)d pending (max %(max_depth)d, limit %(max_pending)d), %(running)d running on %(workers)d workers" % s,
+                 "Actions: %(scheduled)d scheduled, %(executed)d executed, %(failed)d failed, %(cancelled)d cancelled, %(rejected)d rejected" % s,
+                 "Lag: %.1f ms mean, %.1f ms max" % (1000 * s['lag_mean'], 1000 * s['lag_max']),
+                 "Duration: %.1f ms mean, %.1f ms max" % (1000 * s['duration_mean'], 1000 * s['duration_max']) ]
 
     def build_context(self, event, **kw):
         """Build an AdveneContext.
@@ -336,6 +408,19 @@ class ECAEngine:
             res.append("%s: %s" % (k, len(self.ruledict[k])))
         return res
 
+    def dump_statistics(self):
+        """Return the dispatch latency statistics, as a list of strings.
+        """
+        res=[]
+        for k, (count, total, maximum) in sorted(self.dispatch_statistics.items()):
+            res.append("%s: %d events, %.3f ms mean, %.3f ms max" % (k, count,
+                                                                     1000 * total / count,
+                                                                     1000 * maximum))
+        return res
+
+    def reset_statistics(self):
+        self.dispatch_statistics.clear()
+
     def notify (self, event_name, *param, **kw):
         """Invoked by the application on the occurence of an event.
 
@@ -375,36 +460,30 @@ class ECAEngine:
             del kw['delay']
             logger.debug("Delay specified: %f", delay)
 
-        context=self.build_context(event_name, **kw)
-        try:
-            a=self.ruledict[event_name]
-        except KeyError:
+        dispatch=self._dispatch.get(event_name)
+        if not dispatch:
+            # No rule: no need to build a context.
             return
 
-        rules=sorted( (rule
-                       for rule in a
-                       if rule.condition.match(context) ),
-                      key=lambda e: e.priority,
-                      reverse=True)
+        t=time.perf_counter()
+        # The context is only built if a condition or an action uses it.
+        context=LazyContext(lambda: self.build_context(event_name, **kw))
+        rules=[ rule
+                for (rule, unconditional) in dispatch
+                if unconditional or rule.condition.match(context) ]
 
         context.pushLocals()
-        for rule in rules:
-            context.setLocal('rule', rule.name)
-            # The 'view' is used in context.traversePathPreHook
-            # to determine the context of interpretation of symbols
+        # The 'view' is used in context.traversePathPreHook
+        # to determine the context of interpretation of symbols
 
-            # This is a kind of a mess. We should clarify all that
-            # (first, we should not have used the same name for different
-            # things).
+        # This is a kind of a mess. We should clarify all that
+        # (first, we should not have used the same name for different
+        # things).
 
-            # It could already be set  (for instance, ViewCreate view=...)
-            try:
-                v=context.locals['view']
-            except KeyError:
-                try:
-                    v = context.globals['view']
-                except KeyError:
-                    v=None
+        # It could already be set  (for instance, ViewCreate view=...)
+        v=kw.get('view')
+        for rule in rules:
+            context.setLocal('rule', rule.name)
             try:
                 v=self.controller.package.views[rule.origin]
             except KeyError:
@@ -414,3 +493,13 @@ class ECAEngine:
             context.setLocal('view', v)
             self.schedule(rule.action, context, delay=delay, immediate=immediate)
         context.popLocals()
+
+        t=time.perf_counter() - t
+        stats=self.dispatch_statistics.get(event_name)
+        if stats is None:
+            self.dispatch_statistics[event_name]=[ 1, t, t ]
+        else:
+            stats[0] += 1
+            stats[1] += t
+            if t > stats[2]:
+                stats[2]=t
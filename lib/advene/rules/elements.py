@@ -34,6 +34,7 @@ import itertools
 import advene.core.config as config
 from advene.model.annotation import Annotation
 from advene.model.fragment import MillisecondFragment
+import advene.rules.planner as planner
 
 from gettext import gettext as _
 
@@ -215,7 +216,7 @@ class Condition:
                 rv=self.convert_value(right, 'begin')
                 return lv <= rv
             elif self.operator == 'matches':
-                return re.search(rv, lv)
+                return re.search(str(right), str(left))
             elif self.operator == 'meets':
                 lv=self.convert_value(left, 'end')
                 rv=self.convert_value(right, 'begin')
@@ -333,6 +334,8 @@ class Action:
     @ivar registeredaction: the corresponding registeredaction
     @ivar immediate: indicates that the action should be executed at once and not scheduled
     @type immediate: boolean
+    @ivar threaded: indicates that a scheduled action can be run in a worker thread
+    @type threaded: boolean
     """
     def __init__ (self, registeredaction=None, method=None,
                   catalog=None, doc="", category="generic"):
@@ -345,6 +348,7 @@ class Action:
             self.doc=registeredaction.description
             self.registeredaction=registeredaction
             self.immediate=registeredaction.immediate
+            self.threaded=registeredaction.threaded
             self.category=registeredaction.category
         elif method is not None:
             self.bind(method)
@@ -354,6 +358,7 @@ class Action:
             self.catalog=catalog
             self.category=category
             self.immediate=False
+            self.threaded=False
         else:
             raise Exception("Error in Action constructor.")
 
@@ -788,6 +793,11 @@ class SimpleQuery(EtreeMixin):
         for source in self.sources:
             s=context.evaluateValue(source)
 
+            p=planner.plan(self, source, s, context)
+            if p is not None:
+                result.extend(p.execute(context, self.rvalue))
+                continue
+
             if self.condition is None:
                 if self.rvalue is None or self.rvalue == 'element':
                     result.extend(s)
@@ -816,6 +826,21 @@ class SimpleQuery(EtreeMixin):
                 pass
         return result
 
+    def explain(self, context):
+        """Describe how the query is executed.
+
+        @return: a string describing the plan for each source
+        """
+        res=[]
+        for source in self.sources:
+            s=context.evaluateValue(source)
+            p=planner.plan(self, source, s, context)
+            if p is not None:
+                res.append(p.explain())
+            else:
+                res.append("Source %s: generic loop over %d elements" % (source, len(s) if hasattr(s, '__len__') else 0))
+        return "\n".join(res)
+
 class Quicksearch(EtreeMixin):
     """Quicksearch component.
 
@@ -907,6 +932,8 @@ class RegisteredAction:
     @type: a dict whith list of couples as values or a method m(controller, item)
     @ivar immediate: if True, the action is immediately executed, else scheduled
     @type immediate: boolean
+    @ivar threaded: if True, a scheduled action is run in a worker thread
+    @type threaded: boolean
     """
     def __init__(self,
                  name=None,
@@ -916,7 +943,8 @@ class RegisteredAction:
                  category="generic",
                  immediate=False,
                  predefined=None,
-                 defaults=None):
+                 defaults=None,
+                 threaded=False):
         self.name=name
         # The method attribute is in fact ignored, since we always lookup in the
         # ECACatalog for each invocation
@@ -933,9 +961,13 @@ class RegisteredAction:
         for k, v in parameters.items():
             defaults.setdefault(k, "string:%s" % v)
         self.defaults=defaults
-        # If immediate, the action will be run in the main thread, and not
-        # in the scheduler thread.
+        # If immediate, the action will be run at once, and not
+        # scheduled.
         self.immediate=immediate
+        # If threaded, the action does not use the GUI and a scheduled
+        # action can be run in a worker thread. Else it is run in the
+        # main thread.
+        self.threaded=threaded
         # The available categories are described in Catalog
         self.category=category
         self.predefined=predefined
@@ -0,0 +1,265 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Query planner for SimpleQuery.
+
+A SimpleQuery evaluates its condition for each element of its sources.
+When a source is the set of annotations of a package or of an
+annotation type, some common condition shapes can instead be computed
+as set operations over the package indexes:
+
+  - conditions on the annotation type (element/type...), evaluated
+    once per type;
+  - temporal conditions (comparisons and Allen relations) between
+    element, element/fragment, element/fragment/begin or
+    element/fragment/end and a value which does not depend on the
+    element, answered by the temporal index;
+  - element/content/data contains a string, answered by the text
+    index.
+
+In "and" composition, the other conditions are then only evaluated on
+the remaining candidates. Queries which do not fit these shapes use
+the generic loop.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+from advene.model.annotation import Annotation
+from advene.model.fragment import MillisecondFragment
+from advene.model.package import Package
+from advene.model.schema import AnnotationType
+
+# operator -> (left mode, right mode, comparison), following the
+# Condition.convert_value semantics.
+_comparisons = {
+    'equals': ('begin', 'begin', '=='),
+    'different': ('begin', 'begin', '!='),
+    'greater': ('end', 'begin', '>='),
+    'lower': ('end', 'begin', '<='),
+    'before': ('end', 'begin', '<='),
+    'meets': ('end', 'begin', '=='),
+    'starts': ('begin', 'begin', '=='),
+    'finishes': ('end', 'end', '=='),
+    }
+
+# Temporal left-hand sides, and the fragment bound they compare
+# (None means: depending on the operator).
+_temporal_lhs = {
+    'element': None,
+    'element/fragment': None,
+    'element/fragment/begin': 'begin',
+    'element/fragment/end': 'end',
+    }
+
+class PlanNotApplicable(Exception):
+    pass
+
+def _conditions(condition):
+    """Return the (conditions, composition) of a query condition.
+    """
+    if isinstance(condition, list):
+        return [ c for c in condition if c is not None ], getattr(condition, 'composition', 'and')
+    return [ condition ], 'and'
+
+def _depends_on_element(expr):
+    return expr is not None and 'element' in expr
+
+class SourcePlan(object):
+    """Execution plan of a SimpleQuery for a given source.
+
+    @ivar source: the source expression
+    @ivar steps: the description of the plan steps
+    @ivar candidates: the set of elements matching the indexed conditions
+    @ivar residual: the conditions to evaluate on each candidate
+    """
+    def __init__(self, source, elements, package):
+        self.source = source
+        self.elements = elements
+        self.package = package
+        self.steps = []
+        self.candidates = None
+        self.residual = []
+
+    def explain(self):
+        return "\n".join([ "Source %s: indexed plan" % self.source ]
+                         + [ "  - %s" % s for s in self.steps ])
+
+    def execute(self, context, rvalue=None):
+        """Return the matching elements (or rvalues), in the source order.
+        """
+        candidates = self.candidates
+        result = []
+        context.pushLocals()
+        try:
+            for e in self.elements:
+                if e not in candidates:
+                    continue
+                if self.residual or (rvalue is not None and rvalue != 'element'):
+                    context.setLocal('element', e)
+                if not all(c.match(context) for c in self.residual):
+                    continue
+                if rvalue is None or rvalue == 'element':
+                    result.append(e)
+                else:
+                    result.append(context.evaluateValue(rvalue))
+        finally:
+            context.popLocals()
+        return result
+
+    #
+    # Index-backed conditions
+    #
+
+    def type_condition(self, condition, context):
+        """Evaluate a condition on element/type once per annotation type.
+        """
+        index = self.package.getTemporalIndex()
+        result = set()
+        context.pushLocals()
+        try:
+            for t in index.types():
+                annotations = index.annotations_of_type(t)
+                # The condition only depends on the type: use any
+                # annotation of this type.
+                context.setLocal('element', annotations[0])
+                if condition.match(context):
+                    result.update(annotations)
+        finally:
+            context.popLocals()
+        return result
+
+    def temporal_condition(self, condition, right):
+        """Evaluate a temporal condition through the temporal index.
+        """
+        index = self.package.getTemporalIndex()
+        op = condition.operator
+        if op in ('overlaps', 'during'):
+            if isinstance(right, Annotation):
+                right = right.fragment
+            if not isinstance(right, MillisecondFragment) or _temporal_lhs[condition.lhs.strip()] is not None:
+                raise PlanNotApplicable()
+            return set(index.annotations_in(right.begin, right.end, contained=(op == 'during')))
+
+        left_mode, right_mode, comparison = _comparisons[op]
+        left_mode = _temporal_lhs[condition.lhs.strip()] or left_mode
+        if isinstance(right, Annotation):
+            value = getattr(right.fragment, right_mode)
+        elif isinstance(right, MillisecondFragment):
+            value = getattr(right, right_mode)
+        else:
+            try:
+                value = float(right)
+            except (TypeError, ValueError):
+                # String comparison
+                raise PlanNotApplicable()
+        lookup = index.annotations_by_begin if left_mode == 'begin' else index.annotations_by_end
+        if comparison == '==':
+            return set(lookup(value, value))
+        elif comparison == '!=':
+            return set(self.elements).difference(lookup(value, value))
+        elif comparison == '>=':
+            return set(lookup(lo=value))
+        else:
+            return set(lookup(hi=value))
+
+    def content_condition(self, condition, right):
+        """Evaluate element/content/data contains string through the text index.
+        """
+        if not isinstance(right, str):
+            raise PlanNotApplicable()
+        return self.package.getTextIndex().search(right, case_sensitive=True)
+
+    def index_condition(self, condition, context):
+        """Return the set of elements matching condition, or None if it cannot use an index.
+        """
+        lhs, rhs, op = condition.lhs, condition.rhs, condition.operator
+        if lhs is None:
+            return None
+        lhs = lhs.strip()
+        if (lhs == 'element/type' or lhs.startswith('element/type/')) and not _depends_on_element(rhs):
+            try:
+                s = self.type_condition(condition, context)
+            except Exception:
+                logger.debug("Cannot use index for %s %s %s", lhs, op, rhs, exc_info=True)
+                return None
+            self.steps.append("type index: %s %s %s -> %d" % (lhs, op, rhs or '', len(s)))
+            return s
+        if op not in condition.binary_operators or _depends_on_element(rhs):
+            return None
+        if lhs in _temporal_lhs and (op in _comparisons or op in ('overlaps', 'during')):
+            kind = "temporal index"
+            compute = self.temporal_condition
+        elif lhs == 'element/content/data' and op == 'contains':
+            kind = "text index"
+            compute = self.content_condition
+        else:
+            return None
+        try:
+            right = context.evaluateValue(rhs)
+            s = compute(condition, right)
+        except PlanNotApplicable:
+            return None
+        except Exception:
+            logger.debug("Cannot use index for %s %s %s", lhs, op, rhs, exc_info=True)
+            return None
+        self.steps.append("%s: %s %s %s -> %d" % (kind, lhs, op, rhs, len(s)))
+        return s
+
+def plan(query, source, elements, context):
+    """Return a SourcePlan for the given query source, or None.
+
+    elements is the value of the source expression.
+    """
+    if query.condition is None:
+        return None
+    source = source.strip()
+    if not source.endswith('/annotations'):
+        return None
+    root = context.evaluateValue(source[:-len('/annotations')])
+    if isinstance(root, Package):
+        if elements is not root.getAnnotations():
+            return None
+        package = root
+    elif isinstance(root, AnnotationType):
+        package = root.getRootPackage()
+    else:
+        return None
+
+    conditions, composition = _conditions(query.condition)
+    if not conditions:
+        return None
+    p = SourcePlan(source, elements, package)
+    p.steps.append("%d %s" % (len(elements), "annotations"))
+    indexed = []
+    for c in conditions:
+        s = p.index_condition(c, context)
+        if s is None:
+            p.residual.append(c)
+        else:
+            indexed.append(s)
+    if not indexed or (composition != 'and' and p.residual):
+        return None
+    if composition == 'and':
+        p.candidates = set.intersection(*indexed)
+        p.steps.append("intersection -> %d candidates" % len(p.candidates))
+    else:
+        p.candidates = set.union(*indexed)
+        p.steps.append("union -> %d candidates" % len(p.candidates))
+    for c in p.residual:
+        p.steps.append("filter on candidates: %s %s %s" % (c.lhs, c.operator, c.rhs or ''))
+    return p
@@ -0,0 +1,261 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Action scheduler for the ECA engine.
+
+Scheduled actions are kept in a priority queue, ordered by due time,
+which is handled by a dispatcher thread. When an action is due, it is
+either:
+
+  - run in a bounded pool of worker threads, if it is threaded (see
+    L{advene.rules.elements.RegisteredAction}): sound playback,
+    external processes...
+  - or handed to the main thread, through the dispatch method given
+    to the scheduler (the controller queue_action method), since most
+    actions update the GUI.
+
+The scheduler never blocks its callers: when the queue is full, new
+actions are rejected. The dispatcher does not submit more actions than
+there are workers: due threaded actions wait for a free worker in a
+ready queue, where they can still be cancelled, without delaying the
+other actions.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+class Job(object):
+    """A scheduled action.
+    """
+    __slots__ = ('due', 'method', 'args', 'threaded', 'cancelled')
+
+    def __init__(self, due, method, args, threaded):
+        self.due = due
+        self.method = method
+        self.args = args
+        self.threaded = threaded
+        self.cancelled = False
+
+class ActionScheduler(object):
+    """Schedule actions for a later execution.
+
+    @ivar dispatch: method used to run non-threaded actions in the main thread
+    @ivar workers: number of worker threads
+    @ivar max_pending: maximum number of pending actions
+    """
+    def __init__(self, dispatch=None, workers=4, max_pending=1024):
+        self.dispatch = dispatch
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Condition()
+        # Heap of (due time, sequence number, Job)
+        self._queue = []
+        self._sequence = itertools.count()
+        # Due threaded jobs, waiting for a worker
+        self._ready = collections.deque()
+        # Number of busy workers
+        self._running = 0
+        self._executor = None
+        self._thread = None
+        self._stopped = False
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self._stats = {
+            'scheduled': 0,
+            'executed': 0,
+            'rejected': 0,
+            'cancelled': 0,
+            'failed': 0,
+            'max_depth': 0,
+            # Delay between the due time and the actual execution (in s)
+            'lag_total': 0.0,
+            'lag_max': 0.0,
+            # Duration of the actions run by the scheduler (in s)
+            'timed': 0,
+            'duration_total': 0.0,
+            'duration_max': 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue) + len(self._ready)
+
+    def _start(self):
+        """Start the dispatcher thread. Must be called with the lock held.
+        """
+        if self._thread is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                   thread_name_prefix='advene-action')
+            self._thread = threading.Thread(target=self._run, name='advene-scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def enter(self, delay, method, args=(), threaded=False):
+        """Schedule method(*args) in delay seconds.
+
+        @return: the scheduled Job, or None if the queue is full
+        """
+        with self._lock:
+            if self._stopped:
+                return None
+            depth = len(self._queue) + len(self._ready)
+            if depth >= self.max_pending:
+                self._stats['rejected'] += 1
+                logger.warning("Action queue full (%d pending actions): dropping %s",
+                               depth, method)
+                return None
+            job = Job(time.time() + delay, method, args, threaded)
+            heapq.heappush(self._queue, (job.due, next(self._sequence), job))
+            self._stats['scheduled'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], depth + 1)
+            self._start()
+            self._lock.notify()
+            return job
+
+    def cancel(self, job):
+        """Cancel a pending job.
+        """
+        with self._lock:
+            if not job.cancelled:
+                job.cancelled = True
+                self._stats['cancelled'] += 1
+
+    def reset(self):
+        """Cancel all pending actions.
+
+        Running actions are not interrupted.
+        """
+        with self._lock:
+            for job in itertools.chain((j for (due, n, j) in self._queue), self._ready):
+                if not job.cancelled:
+                    job.cancelled = True
+                    self._stats['cancelled'] += 1
+            self._queue = []
+            self._ready.clear()
+            self._lock.notify()
+
+    def stop(self, wait=False):
+        """Cancel all pending actions and stop the dispatcher.
+        """
+        self.reset()
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _lag(self, job):
+        """Update the lag statistics. Must be called with the lock held.
+        """
+        lag = time.time() - job.due
+        self._stats['lag_total'] += lag
+        self._stats['lag_max'] = max(self._stats['lag_max'], lag)
+
+    def _run(self):
+        """Dispatcher thread.
+        """
+        lock = self._lock
+        while True:
+            with lock:
+                if self._stopped:
+                    return
+                queue = self._queue
+                if not queue:
+                    lock.wait()
+                    continue
+                due, n, job = queue[0]
+                if job.cancelled:
+                    heapq.heappop(queue)
+                    continue
+                now = time.time()
+                if due > now:
+                    lock.wait(due - now)
+                    continue
+                heapq.heappop(queue)
+                if job.threaded:
+                    if self._running >= self.workers:
+                        # Back-pressure: the job will be run by the
+                        # first available worker.
+                        self._ready.append(job)
+                        continue
+                    self._running += 1
+                else:
+                    self._lag(job)
+            if job.threaded:
+                self._executor.submit(self._work, job)
+            elif self.dispatch is not None:
+                self.dispatch(job.method, *job.args)
+                with lock:
+                    self._stats['executed'] += 1
+            else:
+                self._execute(job)
+
+    def _work(self, job):
+        """Worker: run job, then the waiting jobs.
+        """
+        while job is not None:
+            self._execute(job)
+            with self._lock:
+                job = None
+                while self._ready:
+                    j = self._ready.popleft()
+                    if not j.cancelled:
+                        job = j
+                        break
+                if job is None:
+                    self._running -= 1
+
+    def _execute(self, job):
+        with self._lock:
+            self._lag(job)
+        t = time.time()
+        try:
+            job.method(*job.args)
+            failed = False
+        except Exception:
+            logger.error("Exception in scheduled action %s", job.method, exc_info=True)
+            failed = True
+        t = time.time() - t
+        with self._lock:
+            self._stats['executed'] += 1
+            self._stats['timed'] += 1
+            if failed:
+                self._stats['failed'] += 1
+            self._stats['duration_total'] += t
+            self._stats['duration_max'] = max(self._stats['duration_max'], t)
+
+    def stats(self):
+        """Return a dictionary holding the scheduler statistics.
+        """
+        with self._lock:
+            res = dict(self._stats)
+            res['depth'] = len(self._queue) + len(self._ready)
+            res['running'] = self._running
+            res['workers'] = self.workers
+            res['max_pending'] = self.max_pending
+        res['lag_mean'] = res['lag_total'] / (res['executed'] or 1)
+        res['duration_mean'] = res['duration_total'] / (res['timed'] or 1)
+        return res
@@ -0,0 +1,386 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""
+Dynamic Time Warping alignment of annotations
+=============================================
+
+Align a sequence of destination segments (e.g. the output of a speech
+recognizer) on a sequence of reference segments: each destination
+segment is associated to a reference segment.
+
+The distance between two segments is the sum of the differences of
+their begins, ends and durations. The dynamic programming goes through
+the destination segments; for each one and each reference segment j,
+the best path either maps it to j like the previous destination
+segment (cost d), maps it to j after a mapping to j-1 (cost 1.5 * d),
+or reuses the best path to j-1 (cost d).
+
+The computation is done row by row on begin/end arrays with NumPy when
+it is available, and in pure Python otherwise. Only the path choices
+are kept. An optional Sakoe-Chiba band limits the computation to the
+reference segments around the diagonal, so that time and memory are
+in O(n * band) instead of O(n * m).
+
+It can be used from the command line:
+
+  python3 -m advene.util.dtw align -s reference_type -d asr_type package.azp [package.azp...]
+  python3 -m advene.util.dtw benchmark
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if __name__ == '__main__':
+    saved_args = sys.argv[1:]
+    sys.argv = [ sys.argv[0] ]
+
+# Path choices
+INSERT = 0
+SUBSTITUTE = 1
+DELETE = 2
+
+INFINITY = float('inf')
+
+def segments(annotations):
+    """Return the list of (begin, end) of annotations.
+    """
+    return [ (a.fragment.begin, a.fragment.end) for a in annotations ]
+
+def band_limits(i, m, n, band=None):
+    """Return the (first, last) reference indexes considered for destination index i.
+    """
+    if band is None or m < 2:
+        return 0, n - 1
+    center = i * (n - 1) / (m - 1)
+    return max(0, int(math.floor(center)) - band), min(n - 1, int(math.ceil(center)) + band)
+
+def _check_band(m, n, band):
+    """Return a band ensuring that the last segment can be reached.
+    """
+    if band is None or m < 2:
+        return band
+    # The band must overlap from one row to the next one.
+    return max(band, int(math.ceil((n - 1) / (m - 1))))
+
+def _backtrack(choices, limits, origins, m, n):
+    """Return the reference index for each destination index.
+    """
+    path = [ 0 ] * m
+    i, j = m - 1, n - 1
+    while i > 0:
+        c = choices[i][j - limits[i][0]]
+        if c == DELETE:
+            j -= 1
+            continue
+        path[i] = j
+        if c == SUBSTITUTE:
+            j -= 1
+        i -= 1
+    path[0] = int(origins[j - limits[0][0]])
+    return path
+
+def align_python(source, dest, band=None):
+    """Pure Python implementation of L{align}.
+    """
+    n, m = len(source), len(dest)
+    band = _check_band(m, n, band)
+    sb = [ float(s[0]) for s in source ]
+    se = [ float(s[1]) for s in source ]
+    sd = [ e - b for (b, e) in zip(sb, se) ]
+
+    def distances(i, lo, hi):
+        db, de = dest[i]
+        dd = de - db
+        return [ abs(sb[j] - db) + abs(se[j] - de) + abs(sd[j] - dd) for j in range(lo, hi + 1) ]
+
+    limits = [ band_limits(i, m, n, band) for i in range(m) ]
+    best = [ INFINITY ] * n
+    # First row: a path starts again from each segment closer than
+    # the previous ones.
+    lo, hi = limits[0]
+    d = distances(0, lo, hi)
+    mindist = d[0]
+    best[lo] = d[0]
+    origins = [ lo ]
+    for j in range(lo + 1, hi + 1):
+        dist = d[j - lo]
+        if dist < mindist:
+            mindist = dist
+            best[j] = dist
+            origins.append(j)
+        else:
+            best[j] = best[j - 1] + dist
+            origins.append(origins[-1])
+
+    choices = [ None ]
+    for i in range(1, m):
+        lo, hi = limits[i]
+        d = distances(i, lo, hi)
+        row = [ INFINITY ] * n
+        c = bytearray(hi - lo + 1)
+        for j in range(lo, hi + 1):
+            dist = d[j - lo]
+            insdist = best[j] + dist
+            subdist = best[j - 1] + dist * 1.5 if j > 0 else INFINITY
+            deldist = row[j - 1] + dist if j > lo else INFINITY
+            if insdist < subdist:
+                value, choice = insdist, INSERT
+            else:
+                value, choice = subdist, SUBSTITUTE
+            if value >= deldist:
+                value, choice = deldist, DELETE
+            row[j] = value
+            c[j - lo] = choice
+        best = row
+        choices.append(c)
+
+    if best[n - 1] == INFINITY:
+        raise ValueError("No alignment path")
+    return _backtrack(choices, limits, origins, m, n)
+
+def align_numpy(source, dest, band=None):
+    """NumPy implementation of L{align}.
+    """
+    n, m = len(source), len(dest)
+    band = _check_band(m, n, band)
+    s = numpy.asarray(source, dtype=numpy.float64).reshape(n, 2)
+    d = numpy.asarray(dest, dtype=numpy.float64).reshape(m, 2)
+    sb, se = s[:, 0], s[:, 1]
+    sd = se - sb
+    db, de = d[:, 0], d[:, 1]
+    dd = de - db
+
+    def distances(i, lo, hi):
+        return (numpy.abs(sb[lo:hi + 1] - db[i])
+                + numpy.abs(se[lo:hi + 1] - de[i])
+                + numpy.abs(sd[lo:hi + 1] - dd[i]))
+
+    limits = [ band_limits(i, m, n, band) for i in range(m) ]
+    best = numpy.full(n, numpy.inf)
+    # First row
+    lo, hi = limits[0]
+    dist = distances(0, lo, hi)
+    indexes = numpy.arange(hi - lo + 1)
+    starts = numpy.empty(len(dist), dtype=bool)
+    starts[0] = True
+    starts[1:] = dist[1:] < numpy.minimum.accumulate(dist)[:-1]
+    start = numpy.maximum.accumulate(numpy.where(starts, indexes, 0))
+    cumulated = numpy.cumsum(dist)
+    best[lo:hi + 1] = dist[start] + cumulated - cumulated[start]
+    origins = start + lo
+
+    choices = [ None ]
+    for i in range(1, m):
+        lo, hi = limits[i]
+        dist = distances(i, lo, hi)
+        insdist = best[lo:hi + 1] + dist
+        previous = numpy.empty(hi - lo + 1)
+        if lo > 0:
+            previous[:] = best[lo - 1:hi]
+        else:
+            previous[0] = numpy.inf
+            previous[1:] = best[:hi]
+        subdist = previous + 1.5 * dist
+        value = numpy.where(insdist < subdist, insdist, subdist)
+        choice = numpy.where(insdist < subdist, INSERT, SUBSTITUTE).astype(numpy.int8)
+        # deldist[j] = row[j - 1] + dist[j], where row is the running
+        # minimum of value - cumulated distances, plus cumulated distances.
+        cumulated = numpy.cumsum(dist)
+        running = numpy.minimum.accumulate(value - cumulated)
+        deldist = numpy.empty(hi - lo + 1)
+        deldist[0] = numpy.inf
+        deldist[1:] = running[:-1] + cumulated[1:]
+        deleted = value >= deldist
+        choice[deleted] = DELETE
+        best = numpy.full(n, numpy.inf)
+        best[lo:hi + 1] = numpy.where(deleted, deldist, value)
+        choices.append(choice)
+
+    if not numpy.isfinite(best[n - 1]):
+        raise ValueError("No alignment path")
+    return _backtrack(choices, limits, origins, m, n)
+
+def align(source, dest, band=None):
+    """Align dest segments on source segments.
+
+    source and dest are sequences of (begin, end) couples, sorted by
+    begin. band is the half-width of the Sakoe-Chiba band (in number of
+    segments), or None for no constraint.
+
+    @return: the list of source indexes, for each dest segment
+    """
+    if not dest:
+        return []
+    if not source:
+        raise ValueError("No reference segment")
+    if numpy is not None:
+        return align_numpy(source, dest, band)
+    else:
+        return align_python(source, dest, band)
+
+def align_annotations(source, dest, band=None):
+    """Align the dest annotations on the source annotations.
+
+    @return: a list of (dest annotation, source annotation) couples
+    """
+    source = sorted(source, key=lambda a: a.fragment.begin)
+    dest = sorted(dest, key=lambda a: a.fragment.begin)
+    path = align(segments(source), segments(dest), band)
+    return [ (dest[i], source[j]) for (i, j) in enumerate(path) ]
+
+def align_package(package, source_type, dest_type, mode='time', band=None):
+    """Align the annotations of dest_type on those of source_type.
+
+    mode is 'time' (copy the reference time codes) or 'content' (copy
+    the reference contents).
+
+    @return: the number of modified annotations
+    """
+    source = package.get_element_by_id(source_type)
+    dest = package.get_element_by_id(dest_type)
+    for (t, name) in ((source, source_type), (dest, dest_type)):
+        if t is None:
+            raise ValueError("No annotation type %s in %s" % (name, package.uri))
+    count = 0
+    for (a, reference) in align_annotations(source.annotations, dest.annotations, band):
+        if mode == 'time':
+            if (a.fragment.begin, a.fragment.end) != (reference.fragment.begin, reference.fragment.end):
+                a.fragment.begin = reference.fragment.begin
+                a.fragment.end = reference.fragment.end
+                count += 1
+        elif mode == 'content':
+            if a.content.data != reference.content.data:
+                a.content.data = reference.content.data
+                count += 1
+    return count
+
+def generate_segments(count, duration=2000, jitter=300, seed=0):
+    """Generate a reference segmentation and a noisy version of it.
+    """
+    r = random.Random(seed)
+    reference = []
+    t = 0
+    for i in range(count):
+        d = r.randint(duration // 2, 2 * duration)
+        reference.append((t, t + d))
+        t += d + r.randint(0, duration // 4)
+    noisy = []
+    for (b, e) in reference:
+        if r.random() < .1 and e - b > jitter * 2:
+            # Split the segment
+            m = r.randint(b + jitter, e - jitter)
+            noisy.extend([ (b, m), (m, e) ])
+        else:
+            noisy.append((b, e))
+    noisy = [ (max(0, b + r.randint(-jitter, jitter)), e + r.randint(-jitter, jitter))
+              for (b, e) in noisy ]
+    noisy.sort()
+    return reference, noisy
+
+def benchmark(sizes=(100, 500, 1000, 2000, 5000), band=50, python_limit=2000):
+    """Compare the implementations on generated data.
+
+    @return: a list of (size, implementation, band, duration in s, path identity) tuples
+    """
+    results = []
+    for size in sizes:
+        reference, noisy = generate_segments(size)
+        implementations = []
+        if size <= python_limit:
+            implementations.append(('python', align_python))
+        if numpy is not None:
+            implementations.append(('numpy', align_numpy))
+        first = None
+        for (name, method) in implementations:
+            for b in (None, band):
+                t = time.time()
+                path = method(reference, noisy, b)
+                t = time.time() - t
+                if b is None and first is None:
+                    first = path
+                results.append((size, name, b, t, None if first is None else path == first))
+    return results
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="DTW alignment of annotation types")
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('align', help="Align the annotations of a type on a reference type.")
+    p.add_argument('-s', '--source', required=True, help="Reference annotation type id.")
+    p.add_argument('-d', '--dest', required=True, help="Id of the annotation type to align.")
+    p.add_argument('-m', '--mode', choices=('time', 'content'), default='time',
+                   help="Copy the reference time codes (default) or contents.")
+    p.add_argument('-b', '--band', type=int, default=None,
+                   help="Half-width of the Sakoe-Chiba band (in annotations). Default: no constraint.")
+    p.add_argument('-o', '--output-dir', default=None,
+                   help="Save the aligned packages in this directory instead of overwriting them.")
+    p.add_argument('-n', '--dry-run', action='store_true', help="Do not save the packages.")
+    p.add_argument('packages', nargs='+')
+
+    p = subparsers.add_parser('benchmark', help="Benchmark the implementations on generated data.")
+    p.add_argument('-b', '--band', type=int, default=50)
+    p.add_argument('-s', '--sizes', default="100,500,1000,2000,5000",
+                   help="Comma-separated list of reference sizes.")
+    p.add_argument('-p', '--python-limit', type=int, default=2000,
+                   help="Largest size for the pure Python implementation.")
+
+    args = parser.parse_args(saved_args)
+
+    if args.command == 'align':
+        from advene.model.package import Package
+        status = 0
+        for name in args.packages:
+            t = time.time()
+            package = Package(uri=name)
+            try:
+                count = align_package(package, args.source, args.dest, args.mode, args.band)
+            except ValueError as e:
+                logger.error("%s: %s", name, e)
+                status = 1
+                continue
+            logger.info("%s: %d annotation(s) modified in %.2fs", name, count, time.time() - t)
+            if not args.dry_run:
+                if args.output_dir is not None:
+                    package.save(os.path.join(args.output_dir, os.path.basename(name)))
+                else:
+                    package.save()
+            package.close()
+        sys.exit(status)
+    elif args.command == 'benchmark':
+        if numpy is None:
+            logger.warning("NumPy is not available: only the pure Python implementation is benchmarked")
+        sizes = [ int(s) for s in args.sizes.split(',') ]
+        print("%8s %8s %6s %10s %s" % ("size", "impl", "band", "time (s)", "same path"))
+        for (size, name, band, duration, same) in benchmark(sizes, args.band, args.python_limit):
+            print("%8d %8s %6s %10.3f %s" % (size, name, band if band is not None else '-', duration,
+                                             '' if same is None else same))
+    else:
+        parser.print_help()
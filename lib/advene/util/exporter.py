@@ -31,13 +31,17 @@ from gettext import gettext as _
 import optparse
 import io
 import os
-from simpletal import simpleTAL, simpleTALES
+import threading
+from simpletal import simpleTALES
 
 if __name__ != '__main__':
     import advene.core.config as config
     from advene.model.package import Package
+    from advene.model.tal.context import template_cache
 
 EXPORTERS = []
+_template_exporters_loaded = False
+_template_exporters_lock = threading.Lock()
 
 def register_exporter(imp):
     """Register an importer
@@ -48,6 +52,7 @@ def register_exporter(imp):
 def get_exporters():
     """Return the list of exporters.
     """
+    init_templateexporters()
     return EXPORTERS
 
 class GenericExporter(object):
@@ -214,43 +219,56 @@ class TemplateExporter(GenericExporter):
             return True
 
         if self.templateview.content.mimetype is None or self.templateview.content.mimetype.startswith('text/'):
-            compiler = simpleTAL.HTMLTemplateCompiler ()
-            compiler.parseTemplate(self.templateview.content.stream, 'utf-8')
+            template = template_cache.get(self.templateview.content.stream,
+                                          key=self.templateview.getUri(absolute=True), html=True)
             if self.templateview.content.mimetype == 'text/plain':
                 # Convert HTML entities to their values
                 output = io.BytesIO()
             else:
                 output = stream
             try:
-                compiler.getTemplate().expand(context=ctx, outputFile=output, outputEncoding='utf-8')
+                template.expand(context=ctx, outputFile=output, outputEncoding='utf-8')
             except simpleTALES.ContextContentException:
                 logger.error(_("Error when exporting text template"), exc_info=True)
             if self.templateview.content.mimetype == 'text/plain':
                 stream.write(output.getvalue().replace(b'&lt;', b'<').replace(b'&gt;', b'>').replace(b'&amp;', b'&'))
         else:
-            compiler = simpleTAL.XMLTemplateCompiler ()
-            compiler.parseTemplate(self.templateview.content.stream)
+            template = template_cache.get(self.templateview.content.stream,
+                                          key=self.templateview.getUri(absolute=True))
             try:
-                compiler.getTemplate().expand(context=ctx, outputFile=stream, outputEncoding='utf-8', suppressXMLDeclaration=True)
+                template.expand(context=ctx, outputFile=stream, outputEncoding='utf-8', suppressXMLDeclaration=True)
             except simpleTALES.ContextContentException:
                 logger.error(_("Error when exporting XML template"), exc_info=True)
         stream.close()
         return _("Data exported to %s") % filename
 
 def init_templateexporters():
-    exporter_package = Package(uri=config.data.advenefile('exporters.xml', as_uri=True))
-    for v in exporter_package.views:
-        if v.id == 'index':
-            continue
-        klass = type("{}Exporter".format(v.id), (TemplateExporter,), {
-            'name': v.title,
-            'templateview': v,
-            'extension': v.getMetaData(config.data.namespace, 'extension') or v.id
-        })
-        register_exporter(klass)
-
-if __name__ != "__main__":
-    init_templateexporters()
+    """Register the template exporters defined in exporters.xml.
+
+    It is done on the first L{get_exporters} call, since loading the
+    package is costly. They are listed before the plugin exporters.
+    """
+    global _template_exporters_loaded
+    if _template_exporters_loaded:
+        return
+    with _template_exporters_lock:
+        if _template_exporters_loaded:
+            return
+        exporter_package = Package(uri=config.data.advenefile('exporters.xml', as_uri=True))
+        templates = []
+        for v in exporter_package.views:
+            if v.id == 'index':
+                continue
+            klass = type("{}Exporter".format(v.id), (TemplateExporter,), {
+                'name': v.title,
+                'templateview': v,
+                'extension': v.getMetaData(config.data.namespace, 'extension') or v.id
+            })
+            templates.append(klass)
+        EXPORTERS[:0] = templates
+        # Only set once loaded, so that a failed load is retried
+        # and that concurrent callers wait for the complete list.
+        _template_exporters_loaded = True
 
 if __name__ == "__main__":
     import io
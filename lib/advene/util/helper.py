@@ -616,7 +616,7 @@ def get_statistics(fname):
         # If we are here, it is that we could not get the statistics.xml.
         # Generate it (it can take some time)
         try:
-            p=Package(uri=fname)
+            p=Package(uri=fname, lazy=True)
         except Exception as e:
             raise _("Error:\n%s")
         st=p.generate_statistics()
@@ -1026,3 +1026,36 @@ def media_is_valid(uri):
         return False
     except urllib.error.URLError:
         return False
+
+def locate_mediafile(mediafile, package_uri=None):
+    """Locate the given media file.
+
+    If it does not exist, look for a file with the same name in the
+    moviepath directories (where _ designates the directory of
+    package_uri).
+    """
+    if media_is_valid(mediafile):
+        return mediafile
+
+    mediafile = Path(uri2path(mediafile))
+    if not mediafile.exists():
+        name = mediafile.name
+        for d in str(config.data.path['moviepath']).split(os.pathsep):
+            if d == '_':
+                if package_uri is None:
+                    continue
+                # Get package dirname
+                d = Path(uri2path(package_uri))
+                d = d.parent
+            elif '~' in d:
+                # Expand userdir
+                d = Path(d).expanduser()
+            d = Path(d)
+
+            n = d / name
+            if n.is_file():
+                mediafile = n
+                logger.info(_("Found matching video file in moviepath: %s") % n)
+                break
+
+    return str(mediafile.absolute())
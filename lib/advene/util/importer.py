@@ -61,7 +61,10 @@ import urllib.request, urllib.parse, urllib.error
 
 from gettext import gettext as _
 
-from gi.repository import GObject
+try:
+    from gi.repository import GObject
+except ImportError:
+    GObject = None
 
 import shutil
 import subprocess
@@ -168,6 +171,8 @@ class GenericImporter(object):
         self.callback=callback
         # Default offset in ms
         self.offset=0
+        # Number of annotations created at once by convert
+        self.chunk_size=1000
         # Dictionary holding the number of created elements
         self.statistics={
             'annotation': 0,
@@ -439,6 +444,10 @@ class GenericImporter(object):
           - notify: if True, then each annotation creation will generate a AnnotationCreate signal
           - complete: boolean. Used to mark the completeness of the annotation.
           - send: yield should return the created annotation
+
+        Annotations are created in chunks of self.chunk_size items
+        (see Package.create_annotations), except when the send key is
+        set, in which case the pending annotations are created at once.
         """
         if self.package is None:
             self.package, self.defaulttype=self.init_package(annotationtypeid='imported', schemaid='imported-schema')
@@ -448,6 +457,23 @@ class GenericImporter(object):
             # access its contents.
             source = iter(source)
 
+        # Pending (record, source dict) couples
+        chunk=[]
+
+        def flush():
+            records = [ r for (r, d) in chunk ]
+            created = self.package.create_annotations(records)
+            self.statistics['annotation'] = self.statistics.get('annotation', 0) + len(created)
+            self.package._modified = True
+            for a, (r, d) in zip(created, chunk):
+                if 'complete' in d:
+                    a.complete=d['complete']
+                if 'notify' in d and d['notify'] and self.controller is not None:
+                    logger.debug("Notifying %s", a)
+                    self.controller.notify('AnnotationCreate', annotation=a)
+            del chunk[:]
+            return created
+
         try:
             if hasattr(source, 'send'):
                 d = source.send(None)
@@ -497,36 +523,34 @@ class GenericImporter(object):
                 author=d['author']
             except KeyError:
                 author=self.author
-            try:
-                title=d['title']
-            except KeyError:
-                title=(content or '')[:20]
             try:
                 timestamp=d['timestamp']
             except KeyError:
                 timestamp=self.timestamp
 
-            a = self.create_annotation(type_=type_,
-                                       begin=begin,
-                                       end=end,
-                                       data=content,
-                                       ident=ident,
-                                       author=author,
-                                       title=title,
-                                       timestamp=timestamp)
-            self.package._modified = True
-            if 'complete' in d:
-                a.complete=d['complete']
-            if 'notify' in d and d['notify'] and self.controller is not None:
-                logger.debug("Notifying %s", a)
-                self.controller.notify('AnnotationCreate', annotation=a)
+            if ident is None and self.controller is not None:
+                ident=self.controller.package._idgenerator.get_id(Annotation)
+            chunk.append( ({ 'type': type_,
+                             'begin': begin + self.offset,
+                             'end': end + self.offset,
+                             'content': content,
+                             'id': ident,
+                             'author': author,
+                             'date': timestamp }, d) )
+            a = None
+            if d.get('send'):
+                a = flush()[-1]
+            elif len(chunk) >= self.chunk_size:
+                flush()
             try:
                 if hasattr(source, 'send'):
-                    d = source.send(None)
+                    d = source.send(a)
                 else:
                     d = next(source)
             except StopIteration:
                 break
+        if chunk:
+            flush()
 
 class ExternalAppImporter(GenericImporter):
     """External application importer.
@@ -584,7 +608,8 @@ class ExternalAppImporter(GenericImporter):
             msg = str(e.args)
             raise Exception(_("Could not run %(appname)s: %(msg)s") % locals())
 
-        self.progress(.01, _("Processing %s") % GObject.filename_display_name(filename))
+        name = GObject.filename_display_name(filename) if GObject is not None else filename
+        self.progress(.01, _("Processing %s") % name)
 
         def execute_process():
             self.convert(self.iterator())
@@ -1714,11 +1739,10 @@ class IRIImporter(GenericImporter):
                     if not self.progress(progress, view.title):
                         break
                     for ref in view.ref:
-                        an = [a for a in self.package.annotations if a.id == ref.id ]
-                        if not an:
+                        an = self.package.get_element_by_id(ref.id)
+                        if not isinstance(an, Annotation):
                             logger.error("IRIImporter: Invalid id %s", ref.id)
                         else:
-                            an=an[0]
                             if self.multiple_types:
                                 d={
                                    'type': at,
@@ -0,0 +1,181 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+"""Reader/writer lock.
+
+Any number of threads can hold the lock for reading, or a single
+thread for writing:
+
+  with lock.read():
+      render(package)
+
+  with lock.write():
+      package.annotations.append(a)
+
+Waiting writers have priority over new readers, so that writers are
+not starved by a continuous flow of readers. Both modes are
+reentrant, and a thread holding the lock for writing can also acquire
+it for reading. Upgrading a read lock to a write lock is not possible
+(two upgrading readers would wait for each other): it raises a
+RuntimeError.
+"""
+import logging
+logger = logging.getLogger(__name__)
+
+from contextlib import contextmanager
+import threading
+import time
+
+class RWLock(object):
+    """Reader/writer lock, with contention statistics.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # Number of threads holding the lock for reading
+        self._readers = 0
+        # Thread holding the lock for writing, and its hold count
+        self._writer = None
+        self._write_count = 0
+        self._waiting_writers = 0
+        # Per-thread read hold count, and whether the thread is
+        # counted in _readers (read locks taken while holding the
+        # write lock are not).
+        self._local = threading.local()
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        with self._cond:
+            self._stats = {
+                'reads': 0,
+                'writes': 0,
+                # Acquisitions which had to wait
+                'read_contended': 0,
+                'write_contended': 0,
+                # Waiting time (in s)
+                'read_wait_total': 0.0,
+                'read_wait_max': 0.0,
+                'write_wait_total': 0.0,
+                'write_wait_max': 0.0,
+                'max_readers': 0,
+                }
+
+    def _wait(self, mode, t):
+        """Update the waiting statistics. Must be called with the lock held.
+        """
+        t = time.time() - t
+        self._stats[mode + '_contended'] += 1
+        self._stats[mode + '_wait_total'] += t
+        self._stats[mode + '_wait_max'] = max(self._stats[mode + '_wait_max'], t)
+
+    def acquire_read(self):
+        local = self._local
+        reads = getattr(local, 'reads', 0)
+        if reads:
+            local.reads = reads + 1
+            return
+        if self._writer == threading.get_ident():
+            local.reads = 1
+            local.shared = False
+            return
+        with self._cond:
+            if self._writer is not None or self._waiting_writers:
+                t = time.time()
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._wait('read', t)
+            self._readers += 1
+            self._stats['reads'] += 1
+            self._stats['max_readers'] = max(self._stats['max_readers'], self._readers)
+        local.reads = 1
+        local.shared = True
+
+    def release_read(self):
+        local = self._local
+        reads = getattr(local, 'reads', 0)
+        if not reads:
+            raise RuntimeError("Releasing a read lock which is not held")
+        local.reads = reads - 1
+        if local.reads == 0 and local.shared:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._write_count += 1
+            return
+        if getattr(self._local, 'reads', 0):
+            raise RuntimeError("Cannot upgrade a read lock to a write lock")
+        with self._cond:
+            if self._writer is not None or self._readers:
+                t = time.time()
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._wait('write', t)
+            self._writer = me
+            self._write_count = 1
+            self._stats['writes'] += 1
+
+    def release_write(self):
+        if self._writer != threading.get_ident():
+            raise RuntimeError("Releasing a write lock which is not held")
+        self._write_count -= 1
+        if self._write_count:
+            return
+        local = self._local
+        with self._cond:
+            self._writer = None
+            if getattr(local, 'reads', 0):
+                # The thread keeps its read locks
+                local.shared = True
+                self._readers += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+    def stats(self):
+        """Return a dictionary holding the lock statistics.
+        """
+        with self._cond:
+            res = dict(self._stats)
+            res['readers'] = self._readers
+            res['writer'] = self._writer is not None
+            res['waiting_writers'] = self._waiting_writers
+        res['read_wait_mean'] = res['read_wait_total'] / (res['read_contended'] or 1)
+        res['write_wait_mean'] = res['write_wait_total'] / (res['write_contended'] or 1)
+        return res
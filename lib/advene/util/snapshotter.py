@@ -28,8 +28,25 @@ Command-line usage:
 snapshotter.py file://uri/to/movie/file.avi 1200 2400 4600
 
 This will capture snapshots for the given timestamps (in ms) and save them into /tmp.
+
+snapshotter.py --benchmark file://uri/to/movie/file.avi
+
+This will compare the throughput (snapshots/sec) of the batch mode
+and of the per-seek mode.
+
+Batch mode: seeking is expensive, since the decoder has to start again
+from the previous keyframe. When pending timestamps are close to each
+other (see the batch_gap parameter), they are processed as a run: the
+snapshotter seeks to the first one, then decodes the movie linearly,
+only encoding the frames that match a requested timestamp.
+
+Pool: a SnapshotterPool runs several snapshotter pipelines in
+parallel, each one handling a segment of the movie.
 """
+import argparse
+import os
 import sys
+import time
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -38,7 +55,7 @@ from gi.repository import GObject, GLib, GstBase, Gst
 GObject.threads_init()
 Gst.init(None)
 
-from threading import Event, Thread
+from threading import Event, Lock, Thread
 import queue
 import heapq
 
@@ -50,6 +67,12 @@ try:
 except ImportError:
     Evaluator=None
 
+# Default maximum gap (in ms) between timestamps captured by linear
+# decoding.
+BATCH_GAP = 5000
+# Minimum time (in s) allowed for the capture of a run
+BATCH_TIMEOUT = 10
+
 def debug(f):
     def wrap(*args):
         logger.warn("%s %s", f.__name__, args)
@@ -70,12 +93,14 @@ class NotifySink(GstBase.BaseSink):
 
     __gproperties__ = {
         'notify': ( GObject.TYPE_PYOBJECT, 'notify', 'The notify method', GObject.ParamFlags.READWRITE ),
+        'render-notify': ( GObject.TYPE_PYOBJECT, 'render-notify', 'The notify method for rendered buffers', GObject.ParamFlags.READWRITE ),
         }
 
     def __init__(self):
         GstBase.BaseSink.__init__(self)
         self.set_sync(False)
         self._notify=None
+        self._render_notify=None
 
     def do_preroll(self, buffer):
         logger.debug("do_preroll %s", self._notify)
@@ -83,15 +108,24 @@ class NotifySink(GstBase.BaseSink):
             self._notify(self.buffer_as_struct(buffer))
         return Gst.FlowReturn.OK
 
+    def do_render(self, buffer):
+        if self._render_notify is not None:
+            self._render_notify(self.buffer_as_struct(buffer))
+        return Gst.FlowReturn.OK
+
     def do_set_property(self, key, value):
         if key.name == 'notify':
             self._notify=value
+        elif key.name == 'render-notify':
+            self._render_notify=value
         else:
             logger.info("No property %s" % key.name)
 
     def do_get_property(self, key):
         if key.name == 'notify':
             return self._notify
+        elif key.name == 'render-notify':
+            return self._render_notify
         else:
             logger.info("No property %s" % key.name)
 
@@ -162,8 +196,11 @@ class Snapshotter(object):
     * call GObject.threads_init() at the beginning of you application
     * invoke the "start" method to start the thread.
 
+    Pending timestamps which are less than batch_gap ms apart are
+    captured in batch mode, by decoding linearly from the first
+    one. A batch_gap of 0 disables the batch mode.
     """
-    def __init__(self, notify=None, width=None):
+    def __init__(self, notify=None, width=None, batch_gap=BATCH_GAP):
         self.active = False
         self.notify=notify
         # Snapshot queue handling
@@ -173,6 +210,27 @@ class Snapshotter(object):
         self.thread_running=False
         self.should_clear = False
 
+        # Batch mode
+        self.batch_gap = batch_gap
+        self._batch_lock = Lock()
+        self._batch_active = False
+        # The pipeline was flushed after the seek to the run start
+        self._batch_flushed = False
+        # Remaining timestamps of the current run
+        self._batch = []
+        # pts (in ms) -> timestamps, for the frames let through
+        self._batch_frames = {}
+        self._batch_done = Event()
+        # Timestamps which could not be captured in batch mode
+        self._seek_only = set()
+        self.statistics = {
+            'snapshots': 0,
+            'seeks': 0,
+            'runs': 0,
+            # Frames decoded in batch mode
+            'decoded': 0,
+            }
+
         # Pipeline building
         self.videobin = Gst.Bin()
         self.videobin.set_name('videosink')
@@ -202,6 +260,10 @@ class Snapshotter(object):
             src.link(dst)
         # Keep a reference on all pipeline elements, so that they are not garbage-collected
         self._elements = l
+        # In batch mode, only let through the frames that match a
+        # requested timestamp.
+        csp.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_FLUSH,
+                                             self.batch_probe)
 
         self._ghostpad = Gst.GhostPad.new('sink', csp.get_static_pad('sink'))
         self._ghostpad.set_active(True)
@@ -215,14 +277,17 @@ class Snapshotter(object):
         bus.add_signal_watch()
         bus.connect('message::error', self.on_bus_message_error)
         bus.connect('message::warning', self.on_bus_message_warning)
+        bus.connect('message::eos', self.on_bus_message_eos)
 
         sink.props.notify=self.queue_notify
+        sink.props.render_notify=self.render_notify
 
     def get_uri(self):
         return self.player.get_property('current-uri')
 
     def set_uri(self, uri):
         logger.debug("set_uri %s", uri)
+        self._seek_only.clear()
         if uri:
             self.player.set_state(Gst.State.NULL)
             self.player.set_property('uri', uri)
@@ -259,6 +324,13 @@ class Snapshotter(object):
         logger.warn("%s: %s", title, message)
         return True
 
+    def on_bus_message_eos(self, bus, message):
+        if self._batch_active:
+            # The remaining timestamps of the run are after the end
+            # of the movie.
+            self._batch_done.set()
+        return True
+
     def simple_notify(self, struct):
         """Basic single-snapshot method.
 
@@ -282,6 +354,7 @@ class Snapshotter(object):
         """
         p = int(t * Gst.MSECOND)
         logger.debug("Seeking to %d", t)
+        self.statistics['seeks'] += 1
         self.player.set_state(Gst.State.PAUSED)
         res = self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE, p)
         if not res:
@@ -300,6 +373,11 @@ class Snapshotter(object):
         logger.debug("----- enqueued elements %s (%d total)", l, self.timestamp_queue.qsize())
         self.snapshot_ready.set()
 
+    def pending(self):
+        """Return the number of queued timestamps.
+        """
+        return self.timestamp_queue.qsize()
+
     def process_queue(self):
         """Process the timestamp queue.
 
@@ -321,12 +399,105 @@ class Snapshotter(object):
                         break
             (t, dummy) = self.timestamp_queue.get()
             self.snapshot_ready.clear()
-            self.snapshot(t)
+            run = self.get_run(t)
+            if len(run) > 1:
+                self.snapshot_run(run)
+            else:
+                self._seek_only.discard(t)
+                self.snapshot(t)
         return True
 
+    def get_run(self, t):
+        """Return the run of pending timestamps beginning with t.
+
+        The following timestamps are taken from the queue as long as
+        they are less than batch_gap apart.
+        """
+        run = [ t ]
+        if not self.batch_gap or t in self._seek_only:
+            return run
+        while True:
+            try:
+                (n, dummy) = self.timestamp_queue.get_nowait()
+            except queue.Empty:
+                break
+            if n - run[-1] > self.batch_gap or n in self._seek_only:
+                self.timestamp_queue.put_nowait( (n, n) )
+                break
+            run.append(n)
+        return run
+
+    def snapshot_run(self, run):
+        """Capture the snapshots for a run of close timestamps.
+
+        Seek to the first timestamp, then decode linearly until all
+        the timestamps have been captured. Timestamps that could not
+        be captured are enqueued again, to be captured with seeks.
+        """
+        logger.debug("Capturing %d timestamps from %d to %d", len(run), run[0], run[-1])
+        with self._batch_lock:
+            self._batch = list(run)
+            self._batch_frames = {}
+            self._batch_flushed = False
+            self._batch_active = True
+        self._batch_done.clear()
+        self.statistics['runs'] += 1
+        self.statistics['seeks'] += 1
+        self.player.set_state(Gst.State.PAUSED)
+        done = False
+        if self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE, int(run[0] * Gst.MSECOND)):
+            self.player.set_state(Gst.State.PLAYING)
+            # Linear decoding is usually faster than real time
+            done = self._batch_done.wait(BATCH_TIMEOUT + 2 * (run[-1] - run[0]) / 1000)
+        self.player.set_state(Gst.State.PAUSED)
+        with self._batch_lock:
+            self._batch_active = False
+            leftover = self._batch + [ t for l in self._batch_frames.values() for t in l ]
+            self._batch = []
+            self._batch_frames = {}
+        if leftover:
+            if not done:
+                logger.warn("Snapshotter: cannot capture %d timestamps in batch mode", len(leftover))
+            self._seek_only.update(leftover)
+            self.enqueue(*leftover)
+        self.snapshot_ready.set()
+
+    def batch_probe(self, pad, info):
+        """Pad probe letting through the frames needed by the current run.
+        """
+        if not self._batch_active:
+            return Gst.PadProbeReturn.OK
+        if info.type & Gst.PadProbeType.EVENT_FLUSH:
+            if info.get_event().type == Gst.EventType.FLUSH_STOP:
+                self._batch_flushed = True
+            return Gst.PadProbeReturn.OK
+        if not self._batch_flushed:
+            # Frame from before the seek
+            return Gst.PadProbeReturn.DROP
+        buf = info.get_buffer()
+        end = buf.pts + (buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else 1)
+        with self._batch_lock:
+            self.statistics['decoded'] += 1
+            batch = self._batch
+            wanted = []
+            while batch and batch[0] * Gst.MSECOND < end:
+                wanted.append(batch.pop(0))
+            if wanted:
+                self._batch_frames.setdefault(buf.pts / Gst.MSECOND, []).extend(wanted)
+                return Gst.PadProbeReturn.OK
+            if not batch and not self._batch_frames:
+                self._batch_done.set()
+        return Gst.PadProbeReturn.DROP
+
     def clear(self):
         """Clear the queue.
         """
+        with self._batch_lock:
+            if self._batch_active:
+                # Interrupt the current run
+                self._batch = []
+                self._batch_frames = {}
+                self._batch_done.set()
         if not self.timestamp_queue.empty():
             self.should_clear = True
         return True
@@ -337,6 +508,11 @@ class Snapshotter(object):
         It processes the captured buffer and unlocks the
         snapshot_event to process further timestamps.
         """
+        if self._batch_active:
+            # Frames are notified upon rendering in batch mode
+            return True
+        if struct is not None:
+            self.statistics['snapshots'] += 1
         if self.notify is not None:
             # Add media info to the structure
             struct['media'] = self.get_uri()
@@ -345,6 +521,25 @@ class Snapshotter(object):
         self.snapshot_ready.set()
         return True
 
+    def render_notify(self, struct):
+        """Notification method for the frames rendered in batch mode.
+        """
+        if struct is None or not self._batch_active:
+            return True
+        with self._batch_lock:
+            wanted = self._batch_frames.pop(struct['pts'], [])
+            done = not self._batch and not self._batch_frames
+        for t in wanted:
+            s = dict(struct)
+            s['date'] = t
+            self.statistics['snapshots'] += 1
+            if self.notify is not None:
+                s['media'] = self.get_uri()
+                self.notify(s)
+        if done:
+            self._batch_done.set()
+        return True
+
     def start(self):
         """Start the snapshotter thread.
         """
@@ -352,27 +547,277 @@ class Snapshotter(object):
         t.setDaemon(True)
         t.start()
 
+class SnapshotterPool(object):
+    """Pool of snapshotter pipelines.
+
+    The movie is divided into as many segments as there are pipelines,
+    and each timestamp is captured by the pipeline of its segment: the
+    pipelines decode distinct parts of the movie in parallel, while
+    each one can still use the batch mode in its own segment.
+
+    It offers the same interface as Snapshotter. Snapshots are
+    notified one at a time, so that the notify method (which usually
+    stores them into the ImageCache) does not have to be thread-safe.
+
+    @ivar duration: the movie duration (in ms), 0 if unknown
+    """
+    def __init__(self, notify=None, size=None, width=None, batch_gap=BATCH_GAP):
+        if not size:
+            size = os.cpu_count() or 1
+        self.notify = notify
+        self.snapshotters = [ Snapshotter(self.pipeline_notify, width=width, batch_gap=batch_gap)
+                              for i in range(size) ]
+        self.duration = 0
+        self._lock = Lock()
+        self.reset_progress()
+
+    @property
+    def thread_running(self):
+        return all(s.thread_running for s in self.snapshotters)
+
+    @property
+    def active(self):
+        return self.snapshotters[0].active
+
+    def reset_progress(self):
+        with self._lock:
+            self._progress = {
+                'requested': 0,
+                'done': 0,
+                # Time of the first request and of the last snapshot
+                'start': None,
+                'last': None,
+                }
+
+    def start(self):
+        """Start the snapshotter threads.
+        """
+        for s in self.snapshotters:
+            if not s.thread_running:
+                s.start()
+
+    def get_uri(self):
+        return self.snapshotters[0].get_uri()
+
+    def set_uri(self, uri, duration=None):
+        """Set the movie uri.
+
+        If the duration (in ms) is not given, it is queried from the
+        first pipeline when needed.
+        """
+        self.duration = duration or 0
+        for s in self.snapshotters:
+            s.set_uri(uri)
+
+    def get_duration(self):
+        if not self.duration and self.active:
+            ok, d = self.snapshotters[0].player.query_duration(Gst.Format.TIME)
+            if ok and d > 0:
+                self.duration = d / Gst.MSECOND
+        return self.duration
+
+    def partition(self, timestamps):
+        """Return the list of timestamps to enqueue in each pipeline.
+        """
+        n = len(self.snapshotters)
+        timestamps = sorted(timestamps)
+        duration = self.get_duration()
+        if duration:
+            parts = [ [] for i in range(n) ]
+            for t in timestamps:
+                parts[min(n - 1, max(0, int(t * n / duration)))].append(t)
+        else:
+            # Unknown duration: split the timestamps themselves into
+            # contiguous segments.
+            size = -(-len(timestamps) // n)
+            parts = [ timestamps[i * size:(i + 1) * size] for i in range(n) ]
+        return parts
+
+    def enqueue(self, *l):
+        """Enqueue timestamps to capture.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            if self._progress['start'] is None or not self.pending():
+                # New series of captures
+                self._progress.update(requested=0, done=0, start=time.time())
+            self._progress['requested'] += len(l)
+        for s, part in zip(self.snapshotters, self.partition(l)):
+            if part:
+                s.enqueue(*part)
+
+    def clear(self):
+        """Clear the queues.
+        """
+        for s in self.snapshotters:
+            s.clear()
+
+    def pending(self):
+        """Return the number of queued timestamps.
+        """
+        return sum(s.pending() for s in self.snapshotters)
+
+    def pipeline_notify(self, struct):
+        """Notification method of the pipelines.
+        """
+        with self._lock:
+            self._progress['done'] += 1
+            self._progress['last'] = time.time()
+            if self.notify is not None:
+                self.notify(struct)
+        return True
+
+    def progress(self):
+        """Return a dictionary describing the progress of the captures.
+
+        It holds the number of requested, done and pending snapshots,
+        the elapsed time (in s) and the throughput (snapshots/sec)
+        since the pool was last idle, and the statistics of each pipeline.
+        """
+        with self._lock:
+            res = dict(self._progress)
+        res['pending'] = self.pending()
+        start = res.pop('start')
+        last = res.pop('last')
+        if start is None:
+            res['elapsed'] = 0
+        elif res['pending']:
+            res['elapsed'] = time.time() - start
+        else:
+            res['elapsed'] = (last or start) - start
+        res['rate'] = res['done'] / res['elapsed'] if res['elapsed'] else 0
+        res['pipelines'] = [ dict(s.statistics, pending=s.pending()) for s in self.snapshotters ]
+        return res
+
+    def wait(self, timeout=None):
+        """Wait until all queued timestamps are processed.
+
+        @return: True if all timestamps were processed, False on timeout
+        """
+        t = time.time()
+        while self.active:
+            if all(s.snapshot_ready.is_set() and not s.pending() for s in self.snapshotters):
+                return True
+            if timeout is not None and time.time() - t > timeout:
+                return False
+            time.sleep(.1)
+        return True
+
+def benchmark(uri, timestamps, width=None, batch_gap=BATCH_GAP, pipelines=1, timeout=600):
+    """Compare the throughput of the per-seek and batch modes.
+
+    If pipelines is greater than 1, also measure the throughput of a
+    SnapshotterPool with this number of pipelines.
+
+    Return a dict mode -> (snapshots, duration in s, snapshots/sec).
+    Note that the per-seek mode is run first, so the other modes may
+    benefit from the filesystem cache.
+    """
+    wanted = set(timestamps)
+    results = {}
+    modes = [ ('seek', 0, 1), ('batch', batch_gap, 1) ]
+    if pipelines > 1:
+        modes.append( ('pool', batch_gap, pipelines) )
+    for mode, gap, size in modes:
+        captured = set()
+        def notify(struct, captured=captured):
+            if struct is not None and struct['date'] in wanted:
+                captured.add(struct['date'])
+            return True
+        if size > 1:
+            s = SnapshotterPool(notify, size=size, width=width, batch_gap=gap)
+        else:
+            s = Snapshotter(notify, width=width, batch_gap=gap)
+        s.set_uri(uri)
+        s.start()
+        # Wait for the initial snapshots
+        if size > 1:
+            s.wait(BATCH_TIMEOUT)
+        else:
+            s.snapshot_ready.wait(BATCH_TIMEOUT)
+        captured.clear()
+        t = time.time()
+        s.enqueue(*timestamps)
+
+        loop = GLib.MainLoop()
+        def check():
+            if len(captured) == len(wanted) or time.time() - t > timeout:
+                loop.quit()
+                return False
+            return True
+        GLib.timeout_add(50, check)
+        loop.run()
+        duration = time.time() - t
+        if size > 1:
+            statistics = {}
+            for p in s.snapshotters:
+                p.player.set_state(Gst.State.NULL)
+                for k, v in p.statistics.items():
+                    statistics[k] = statistics.get(k, 0) + v
+        else:
+            s.player.set_state(Gst.State.NULL)
+            statistics = s.statistics
+        results[mode] = (len(captured), duration, len(captured) / duration)
+        logger.info("%s mode: %d/%d snapshots in %.2fs (%.1f snapshots/sec) - %s",
+                    mode, len(captured), len(wanted), duration, len(captured) / duration,
+                    ", ".join("%s: %d" % i for i in sorted(statistics.items())))
+    return results
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
-    try:
-        uri=sys.argv[1]
-        if uri.startswith('/'):
-            uri='file://'+uri
-    except IndexError:
-        uri='file:///data/video/Bataille.avi'
-
-    s=Snapshotter(width=160)
+    parser = argparse.ArgumentParser(description="Capture movie snapshots.")
+    parser.add_argument('-w', '--width', type=int, default=160,
+                        help="Snapshot width (default: 160).")
+    parser.add_argument('-g', '--batch-gap', type=int, default=BATCH_GAP,
+                        help="Maximum gap (in ms) between timestamps captured in batch mode, 0 to disable it (default: %d)." % BATCH_GAP)
+    parser.add_argument('-p', '--pipelines', type=int, default=1,
+                        help="Number of parallel pipelines (default: 1).")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="Compare the throughput of the per-seek and batch modes (and of the pool, if --pipelines is greater than 1).")
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help="Benchmark: number of timestamps (default: 200).")
+    parser.add_argument('-s', '--step', type=int, default=500,
+                        help="Benchmark: interval between timestamps, in ms (default: 500).")
+    parser.add_argument('--start', type=int, default=1000,
+                        help="Benchmark: first timestamp, in ms (default: 1000).")
+    parser.add_argument('uri', nargs='?', default='file:///data/video/Bataille.avi')
+    parser.add_argument('timestamps', nargs='*', type=int)
+    args = parser.parse_args()
+
+    uri = args.uri
+    if uri.startswith('/'):
+        uri='file://'+uri
+
+    if args.benchmark:
+        logging.getLogger().setLevel(logging.INFO)
+        timestamps = args.timestamps or [ args.start + i * args.step for i in range(args.count) ]
+        res = benchmark(uri, timestamps, width=args.width, batch_gap=args.batch_gap, pipelines=args.pipelines)
+        if res['seek'][2]:
+            logger.info("Speedup: %.2f", res['batch'][2] / res['seek'][2])
+        sys.exit(0)
+
+    if args.pipelines > 1:
+        s=SnapshotterPool(size=args.pipelines, width=args.width, batch_gap=args.batch_gap)
+        # simple_notify does not depend on the pipeline
+        s.notify=s.snapshotters[0].simple_notify
+    else:
+        s=Snapshotter(width=args.width, batch_gap=args.batch_gap)
+        s.notify=s.simple_notify
     s.set_uri(uri)
-    s.notify=s.simple_notify
     s.start()
 
-    if sys.argv[2:]:
+    if args.timestamps:
         # Timestamps have been specified. Non-interactive version.
-        s.enqueue( *(int(t) for t in sys.argv[2:]) )
+        s.enqueue( *args.timestamps )
 
         loop=GObject.MainLoop()
         def wait_for_completion():
-            if s.timestamp_queue.empty():
+            if args.pipelines > 1:
+                if s.wait(timeout=0):
+                    logger.info("%(done)d snapshots in %(elapsed).2fs (%(rate).1f snapshots/sec)", s.progress())
+                    loop.quit()
+            elif s.timestamp_queue.empty():
                 # Quit application
                 s.snapshot_ready.wait()
                 loop.quit()
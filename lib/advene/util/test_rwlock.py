@@ -0,0 +1,169 @@
+#
+# Advene: Annotate Digital Videos, Exchange on the NEt
+# Copyright (C) 2008-2017 Olivier Aubert <contact@olivieraubert.net>
+#
+# Advene is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Advene is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Advene; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#
+import threading
+import time
+import unittest
+
+import sys
+sys.path.insert(0, ".")
+
+from advene.util.rwlock import RWLock
+
+# Maximum time (in s) to wait for another thread
+TIMEOUT = 5
+# Time (in s) after which a thread is considered as blocked
+DELAY = .2
+
+class Worker(threading.Thread):
+    """Thread running a function, which can be waited for.
+    """
+    def __init__(self, function):
+        super().__init__(daemon=True)
+        self.function = function
+        self.done = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            self.function()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+def start(function):
+    w = Worker(function)
+    w.start()
+    return w
+
+class RWLockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = RWLock()
+
+    def assertBlocked(self, worker):
+        self.assertFalse(worker.done.wait(DELAY), "The thread is not blocked")
+
+    def assertDone(self, worker):
+        self.assertTrue(worker.done.wait(TIMEOUT), "The thread is blocked")
+        if worker.error is not None:
+            raise worker.error
+
+    def write(self):
+        with self.lock.write():
+            pass
+
+    def read(self):
+        with self.lock.read():
+            pass
+
+    def test_reentrancy(self):
+        lock = self.lock
+        with lock.read():
+            with lock.read():
+                pass
+            # Other readers are not blocked
+            self.assertDone(start(self.read))
+            w = start(self.write)
+            self.assertBlocked(w)
+        self.assertDone(w)
+
+        with lock.write():
+            with lock.write():
+                with lock.read():
+                    pass
+            r = start(self.read)
+            self.assertBlocked(r)
+        self.assertDone(r)
+        self.assertEqual(lock.stats()['readers'], 0)
+        self.assertFalse(lock.stats()['writer'])
+
+    def test_downgrade(self):
+        lock = self.lock
+        lock.acquire_write()
+        lock.acquire_read()
+        lock.release_write()
+        # The thread now only holds the lock for reading
+        self.assertDone(start(self.read))
+        w = start(self.write)
+        self.assertBlocked(w)
+        lock.release_read()
+        self.assertDone(w)
+
+    def test_upgrade(self):
+        lock = self.lock
+        with lock.read():
+            self.assertRaises(RuntimeError, lock.acquire_write)
+            # The read lock is still held
+            w = start(self.write)
+            self.assertBlocked(w)
+        self.assertDone(w)
+        self.assertRaises(RuntimeError, lock.release_read)
+        self.assertRaises(RuntimeError, lock.release_write)
+        # The lock is still usable
+        self.write()
+
+    def test_writer_priority(self):
+        lock = self.lock
+        order = []
+        def write():
+            with lock.write():
+                order.append('write')
+        def read():
+            with lock.read():
+                order.append('read')
+        lock.acquire_read()
+        w = start(write)
+        self.assertBlocked(w)
+        # New readers wait for the waiting writer
+        r = start(read)
+        self.assertBlocked(r)
+        self.assertEqual(lock.stats()['waiting_writers'], 1)
+        lock.release_read()
+        self.assertDone(w)
+        self.assertDone(r)
+        self.assertEqual(order, [ 'write', 'read' ])
+
+    def test_concurrency(self):
+        lock = self.lock
+        state = { 'value': 0, 'errors': 0 }
+        def reader():
+            for i in range(200):
+                with lock.read():
+                    value = state['value']
+                    time.sleep(0)
+                    if state['value'] != value:
+                        state['errors'] += 1
+        def writer():
+            for i in range(200):
+                with lock.write():
+                    value = state['value']
+                    time.sleep(0)
+                    state['value'] = value + 1
+        workers = [ start(reader) for i in range(4) ] + [ start(writer) for i in range(2) ]
+        for w in workers:
+            self.assertDone(w)
+        self.assertEqual(state['value'], 400)
+        self.assertEqual(state['errors'], 0)
+        stats = lock.stats()
+        self.assertEqual(stats['writes'], 400)
+        self.assertEqual(stats['readers'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,6 +30,7 @@ import shutil
 
 import advene.core.config as config
 import advene.util.helper as helper
+from advene.model.tal.context import template_cache
 
 fragment_re=re.compile('(.*)#(.+)')
 package_expression_re=re.compile('packages/(\w+)/(.*)')
@@ -552,6 +553,7 @@ class WebsiteExporter(object):
 </body></html>""" % { 'title': self.controller.get_title(self.controller.package) })
         f.close()
 
+        logger.info(template_cache.stats_repr())
         self.progress_callback(1.0, _("Export complete"))
 
 class VideoPlayer(object):